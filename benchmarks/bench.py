@@ -0,0 +1,280 @@
+"""
+benchmarks KMeans and Silhouette on `make_clusters` data of increasing size
+
+every case starts from a base configuration and changes one of n, m, k or the cluster `scale`, then
+records the wall time (best of `--repeat` runs) and the peak traced memory of `fit`, `predict` and
+`score`, plus the iteration count of `fit` and the distance evaluations counted by each operation.
+results are written as JSON so runs from different commits can be compared:
+
+    python benchmarks/bench.py --output before.json
+    python benchmarks/bench.py --output after.json
+    python benchmarks/bench.py --compare before.json after.json
+
+the file sits outside `test/`, so pytest never collects it
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+import numpy as np
+
+#run against the working tree rather than an installed copy of the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cluster import KMeans, Silhouette, make_clusters
+
+#configuration that every case starts from, and the values swept for each parameter
+BASE = dict(n=2000, m=2, k=3, scale=1.0)
+SWEEPS = {
+    "n": [1000, 4000, 16000],
+    "m": [2, 16, 128],
+    "k": [3, 8, 32],
+    "scale": [0.3, 1.0, 2.0],
+}
+QUICK_SWEEPS = {
+    "n": [500, 2000],
+    "m": [2, 16],
+    "k": [3, 8],
+    "scale": [0.3, 2.0],
+}
+
+
+def make_cases(sweeps: dict) -> list:
+    """
+    builds the list of benchmark cases, changing one parameter of `BASE` at a time
+
+    inputs:
+        sweeps: dict
+            the values to try for each of "n", "m", "k" and "scale"
+
+    outputs:
+        list
+            dictionaries of `make_clusters` parameters, without duplicates
+    """
+    cases = []
+    for name, values in sweeps.items():
+        for value in values:
+            case = dict(BASE, **{name: value})
+            if case not in cases:
+                cases.append(case)
+    return cases
+
+
+def measure(func, repeat: int = 3) -> dict:
+    """
+    times a function and measures the peak memory it allocates
+
+    the timed runs happen without tracing, since tracemalloc slows allocation down; one more run
+    under tracemalloc records the peak (numpy reports its array buffers to tracemalloc)
+
+    inputs:
+        func
+            a function without arguments
+        repeat: int
+            the number of timed runs, of which the fastest is kept
+
+    outputs:
+        dict
+            "seconds", "peak_mb" and "result" (the return value of the traced run)
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(times), "peak_mb": peak / 2**20, "result": result}
+
+
+def run_case(case: dict, repeat: int = 3, kmeans_options: dict = None, score_limit: int = 20000) -> list:
+    """
+    benchmarks `fit`, `predict` and `score` on one dataset
+
+    inputs:
+        case: dict
+            the `make_clusters` parameters n, m, k and scale
+        repeat: int
+            the number of timed runs per operation
+        kmeans_options: dict
+            extra keyword arguments for KMeans
+        score_limit: int
+            the largest n for which the exact (quadratic) silhouette score is benchmarked
+
+    outputs:
+        list
+            one result dictionary per operation
+    """
+    kmeans_options = kmeans_options or {}
+    mat, _ = make_clusters(n=case["n"], m=case["m"], k=case["k"], scale=case["scale"], seed=42)
+
+    def fit():
+        model = KMeans(k=case["k"], random_state=0, **kmeans_options)
+        model.fit(mat)
+        return model
+
+    results = []
+    fitted = measure(fit, repeat)
+    model = fitted.pop("result")
+    results.append(dict(case, op="fit", n_iter=int(model.n_iter_), n_distance_evals=int(model.n_distance_evals_), **fitted))
+
+    def predict():
+        model.n_predict_evals_ = 0 #count a single run
+        return model.predict(mat)
+
+    predicted = measure(predict, repeat)
+    labels = predicted.pop("result")[0]
+    results.append(dict(case, op="predict", n_iter=None, n_distance_evals=int(model.n_predict_evals_), **predicted))
+
+    def score():
+        scorer = Silhouette()
+        scorer.score(mat, labels)
+        return scorer
+
+    if case["n"] <= score_limit:
+        scored = measure(score, repeat)
+        scorer = scored.pop("result")
+        results.append(dict(case, op="score", n_iter=None, n_distance_evals=int(scorer.n_distance_evals_), **scored))
+    return results
+
+
+def environment() -> dict:
+    """
+    describes where the benchmark ran, so results from different machines or commits can be told apart
+
+    outputs:
+        dict
+            the git commit (if available), python and numpy versions, platform and start time
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def case_key(result: dict) -> tuple:
+    """
+    gets the key that matches a result across runs
+
+    inputs:
+        result: dict
+            one benchmark result
+
+    outputs:
+        tuple
+            (op, n, m, k, scale)
+    """
+    return (result["op"], result["n"], result["m"], result["k"], result["scale"])
+
+
+def count_change(old, new) -> str:
+    """
+    describes how a counter changed between two runs
+
+    inputs:
+        old
+            the count of the reference run, or None if it wasn't counted
+        new
+            the count of the new run, or None if it wasn't counted
+
+    outputs:
+        str
+            "-" if either run has no count, the count if it didn't change and "old->new" otherwise
+    """
+    if old is None or new is None:
+        return "-"
+    if old == new:
+        return str(new)
+    return "{}->{}".format(old, new)
+
+
+def compare(before: dict, after: dict, threshold: float = 0.1) -> bool:
+    """
+    prints the change in time, memory, iterations and distance evaluations of every case found in both
+    result files. only time and memory count towards regressions
+
+    inputs:
+        before: dict
+            the results of the reference run
+        after: dict
+            the results of the new run
+        threshold: float
+            the relative slowdown or memory growth that counts as a regression
+
+    outputs:
+        bool
+            True if any case regressed by more than `threshold`
+    """
+    old = {case_key(result): result for result in before["results"]}
+    regressed = False
+    print("{:<8}{:>7}{:>5}{:>5}{:>7}{:>12}{:>12}{:>9}{:>11}{:>10}  {}".format(
+        "op", "n", "m", "k", "scale", "before s", "after s", "time", "memory", "iter", "evals"))
+    for result in after["results"]:
+        key = case_key(result)
+        if key not in old:
+            continue
+        time_ratio = result["seconds"] / max(old[key]["seconds"], 1e-12)
+        memory_ratio = result["peak_mb"] / max(old[key]["peak_mb"], 1e-12)
+        flag = ""
+        if time_ratio > 1 + threshold or memory_ratio > 1 + threshold:
+            regressed = True
+            flag = "  <- regression"
+        iterations = count_change(old[key].get("n_iter"), result.get("n_iter"))
+        evals = count_change(old[key].get("n_distance_evals"), result.get("n_distance_evals"))
+        print("{:<8}{:>7}{:>5}{:>5}{:>7}{:>12.4f}{:>12.4f}{:>8.2f}x{:>10.2f}x{:>10}  {}{}".format(
+            *key, old[key]["seconds"], result["seconds"], time_ratio, memory_ratio, iterations, evals, flag))
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark KMeans and Silhouette scaling")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--quick", action="store_true", help="run a smaller sweep")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per operation (the fastest is kept)")
+    parser.add_argument("--algorithm", default="lloyd", help="the KMeans algorithm to benchmark")
+    parser.add_argument("--score-limit", type=int, default=20000, help="largest n to benchmark the silhouette score on")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files instead of running")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change reported as a regression")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            before = json.load(f)
+        with open(args.compare[1]) as f:
+            after = json.load(f)
+        return 1 if compare(before, after, args.threshold) else 0
+
+    results = []
+    for case in make_cases(QUICK_SWEEPS if args.quick else SWEEPS):
+        for result in run_case(case, args.repeat, dict(algorithm=args.algorithm), args.score_limit):
+            print("{op:<8} n={n:<6} m={m:<4} k={k:<4} scale={scale:<4} {seconds:9.4f}s {peak_mb:9.2f}MB "
+                  "iter={n_iter} evals={n_distance_evals}".format(**result))
+            results.append(result)
+
+    output = {"environment": environment(), "algorithm": args.algorithm, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
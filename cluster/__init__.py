@@ -1,7 +1,11 @@
 from .kmeans import KMeans
+from .bisecting import BisectingKMeans
 from .silhouette import Silhouette
+from .selection import select_k
 from .utils import (
         make_clusters, 
+        iter_clusters,
+        write_clusters,
         plot_clusters,
         plot_multipanel)
 
@@ -0,0 +1,370 @@
+import heapq
+import numpy as np
+from scipy import sparse
+from .kmeans import KMeans
+from .distance import assign, chunk_rows, compute_dtype, pairwise, paired_distances, PAIRED_METRICS, SPARSE_METRICS
+from .chunks import data_dtype, is_chunked, to_dense
+from .centers import cluster_medians, medoid, spherical_means, unit_rows
+
+
+class BisectingKMeans(KMeans):
+    """
+    k-means that starts from one cluster and repeatedly splits the worst cluster in two with 2-means,
+    until there are `k` clusters. every split only looks at the samples of one cluster, so a fit costs
+    about `n log k` distances instead of `n k` per iteration, which pays off for large `k`
+
+    the splits form a binary tree of clusters. `predict` descends the tree, comparing each sample with the
+    two children of its current node, which takes `2 log k` distances per sample for a balanced tree
+    instead of `k`. the descent can miss the closest leaf centroid near cluster borders; pass `index` to
+    search the leaf centroids exactly instead. `cut` reads the clustering off the tree at any coarser level
+
+    the node centroids follow the `update` rule of KMeans (e.g. medians for cityblock), so the tree agrees
+    with the 2-means splits that built it
+    """
+    def __init__(
+            self,
+            k: int,
+            metric: str = "euclidean",
+            strategy: str = "largest_sse",
+            **kmeans_options):
+        """
+        inputs:
+            k: int
+                the number of clusters (leaves of the tree)
+            metric: str
+                the name of the distance metric to use
+            strategy: str
+                which cluster is split next: "largest_sse" picks the cluster with the largest sum of
+                squared distances to its centroid, "largest_cluster" the cluster with the most samples
+            **kmeans_options
+                the other options of KMeans, which are used for every 2-means split. `n_init` gives the
+                number of 2-means restarts per split
+        """
+        if strategy not in ("largest_sse", "largest_cluster"):
+            raise AttributeError("strategy must be 'largest_sse' or 'largest_cluster'")
+        super().__init__(k, metric, **kmeans_options)
+        self.strategy = strategy
+
+        #the cluster tree, with the root as node 0
+        self.centers_ = None #`n_nodes x m` centroid of each node
+        self.children_ = None #`n_nodes x 2` child nodes of each node, -1 for leaves
+        self.sizes_ = None #number of fit samples in each node
+        self.sse_ = None #sum of squared distances from the samples of each node to its centroid
+        self.leaf_labels_ = None #cluster label of each leaf, -1 for inner nodes
+        self._created = None #the number of splits made before each node was created
+        self._split = None #the number of the split that divided each node, k for leaves
+
+    def fit(self, mat: np.ndarray):
+        """
+        fits the cluster tree onto a provided 2D matrix (a `np.memmap` or a `scipy.sparse` matrix work too)
+
+        inputs:
+            mat: np.ndarray
+                A 2D matrix where the rows are observations and columns are features
+        """
+        if is_chunked(mat):
+            raise AttributeError("bisecting k-means needs a matrix or np.memmap, not chunked input")
+        if sparse.issparse(mat) and self.metric not in SPARSE_METRICS:
+            raise AttributeError("sparse input requires one of the metrics " + ", ".join(SPARSE_METRICS))
+        self.n, self.m = mat.shape
+        if self.k>self.n:
+            raise AttributeError("k must be less than the number of observations")
+        self._rng = np.random.default_rng(self.random_state)
+        self._index = None
+        self.n_predict_evals_ = 0
+        self._dtype = compute_dtype(self.dtype, data_dtype(mat))
+        self.n_distance_evals_ = 0
+        self.history_ = []
+
+        #start from a single cluster holding every sample
+        members = {0: np.arange(self.n)}
+        root = self._as_compute(mat)
+        sums = [self._sums(root)]
+        centers = [self._root_center(root, sums[0])]
+        sizes = [self.n]
+        sse = [self._sse(root, centers[0])]
+        children = [[-1, -1]]
+        created, split = [0], [self.k]
+        del root
+
+        #leaves that can still be split, ordered by the strategy's score
+        heap = [(-self._priority(sse[0], sizes[0]), 0)]
+        n_leaves = 1
+        while n_leaves < self.k:
+            if len(heap) == 0:
+                raise AttributeError("the samples could only be split into " + str(n_leaves) + " distinct clusters")
+            _, node = heapq.heappop(heap)
+            idx = members[node]
+            sub = self._as_compute(mat[idx])
+            labels, halves = self._bisect(sub)
+            if labels is None:
+                continue #every sample of the node is identical, so it can't be split
+
+            #replace the node by its two halves
+            del members[node]
+            split[node] = n_leaves
+            children[node] = [len(centers), len(centers) + 1]
+            for half in (0, 1):
+                rows = np.flatnonzero(labels == half)
+                part = sub[rows]
+                members[len(centers)] = idx[rows]
+                sums.append(self._sums(part))
+                #a mean is recomputed from the sums; the other update rules keep the split's converged centroids
+                centers.append(sums[-1] / len(rows) if self._update_rule() == "mean" else halves[half])
+                sizes.append(len(rows))
+                sse.append(self._sse(part, centers[-1]))
+                children.append([-1, -1])
+                created.append(n_leaves)
+                split.append(self.k)
+                if sizes[-1] > 1 and sse[-1] > 0:
+                    heapq.heappush(heap, (-self._priority(sse[-1], sizes[-1]), len(centers) - 1))
+            n_leaves += 1
+
+        self.centers_ = np.array(centers, dtype=self._dtype)
+        self.children_ = np.array(children, dtype=np.intp)
+        self.sizes_ = np.array(sizes, dtype=np.int64)
+        self.sse_ = np.array(sse)
+        self._created = np.array(created)
+        self._split = np.array(split)
+
+        #the leaves are the clusters, labelled in the order of their nodes
+        leaves = np.flatnonzero(self.children_[:, 0] < 0)
+        self.leaf_labels_ = np.full(len(centers), -1, dtype=np.int32)
+        self.leaf_labels_[leaves] = np.arange(self.k)
+        self.labels_ = np.empty(self.n, dtype=np.int32)
+        for label, node in enumerate(leaves):
+            self.labels_[members[node]] = label
+        self.centroids = self.centers_[leaves]
+        self.counts_ = self.sizes_[leaves]
+        self._cluster_sums = np.array([sums[node] for node in leaves])
+        self._error = self.sse_[leaves].sum() / self.n
+        self.n_iter_ = self.k - 1 #one split per iteration
+        self.converged_ = True
+
+    def partial_fit(self, batch: np.ndarray):
+        """
+        not available, since moving the leaf centroids would break the cluster tree
+        """
+        raise AttributeError("bisecting k-means can't be updated with partial_fit")
+
+    def predict_one(self, sample: np.ndarray) -> (int, float):
+        """
+        predicts the cluster label of a single observation by descending the cluster tree
+
+        inputs:
+            sample: np.ndarray
+                a 1D feature vector
+
+        outputs:
+            (int, float)
+                returns the cluster label of the observation
+                returns the distance of the observation to its centroid
+        """
+        if self.index is not None or self.children_ is None:
+            return super().predict_one(sample)
+        labels, distances = self._descend(self._as_row(sample))
+        return int(labels[0]), float(distances[0])
+
+    def cut(self, n_clusters: int) -> (np.ndarray, np.ndarray):
+        """
+        reads a coarser clustering off the cluster tree: the clusters as they were after the first
+        `n_clusters - 1` splits
+
+        inputs:
+            n_clusters: int
+                the number of clusters, from 1 to `k`
+
+        outputs:
+            (np.ndarray, np.ndarray)
+                returns a 1D array with the coarse cluster that each of the `k` clusters belongs to, so
+                `mapping[labels]` relabels the output of `predict` or `labels_` at the coarser level
+                returns a `n_clusters x m` matrix of the coarse centroids
+        """
+        if self.children_ is None:
+            raise AttributeError("the model must be fit before it can be cut")
+        if not 1 <= n_clusters <= self.k:
+            raise AttributeError("n_clusters must be between 1 and k")
+        #the nodes that were leaves after n_clusters - 1 splits
+        splits = n_clusters - 1
+        cut_nodes = np.flatnonzero((self._created <= splits) & (self._split > splits))
+
+        #walk down from every cut node, handing its label to all the leaves below it
+        node_labels = np.full(len(self.children_), -1)
+        node_labels[cut_nodes] = np.arange(n_clusters)
+        for node in range(len(self.children_)):
+            #children always come after their parent, so a single pass in node order reaches every leaf
+            if node_labels[node] >= 0 and self.children_[node, 0] >= 0:
+                node_labels[self.children_[node]] = node_labels[node]
+        leaves = np.flatnonzero(self.leaf_labels_ >= 0)
+        mapping = np.empty(self.k, dtype=np.int32)
+        mapping[self.leaf_labels_[leaves]] = node_labels[leaves]
+        return mapping, self.centers_[cut_nodes]
+
+    def _predict_chunk(self, mat):
+        """
+        finds the cluster of every sample of one matrix by descending the cluster tree, or through the
+        index if there is one
+
+        input:
+            2D matrix where the rows are observations and columns are features
+        output:
+            1D array of cluster labels and 1D array of the distances to those clusters' centroids
+        """
+        if self.index is not None or self.children_ is None:
+            return super()._predict_chunk(mat) #a loaded model keeps only its leaf centroids
+        return self._descend(mat)
+
+    def _descend(self, mat):
+        """
+        moves every sample from the root of the cluster tree to a leaf, stepping to the closer of the two
+        children at each node. samples are processed in chunks, and each chunk descends one level at a time
+
+        input:
+            2D matrix where the rows are observations and columns are features
+        output:
+            1D array of cluster labels and 1D array of the distances to those clusters' centroids
+        """
+        n = mat.shape[0]
+        labels = np.empty(n, dtype=np.int32)
+        distances = np.empty(n)
+        #each level gathers two `rows x m` matrices of child centroids
+        step = chunk_rows(2 * self.m, self.working_memory)
+        for start in range(0, n, step):
+            block = self._as_compute(mat[start:start + step])
+            rows = block.shape[0]
+            node = np.zeros(rows, dtype=np.intp)
+            dist = np.zeros(rows)
+            active = np.arange(rows)
+            while len(active) > 0:
+                children = self.children_[node[active]]
+                left = self._node_distances(block[active], children[:, 0])
+                right = self._node_distances(block[active], children[:, 1])
+                self.n_predict_evals_ += 2 * len(active)
+                go_right = right < left #ties go left, towards the lower label
+                node[active] = np.where(go_right, children[:, 1], children[:, 0])
+                dist[active] = np.where(go_right, right, left)
+                active = active[self.children_[node[active], 0] >= 0]
+            labels[start:start + rows] = self.leaf_labels_[node]
+            distances[start:start + rows] = dist
+        return labels, distances
+
+    def _node_distances(self, rows, nodes):
+        """
+        calculates the distance from each row to the centroid of the matching node
+
+        inputs:
+            rows
+                2D matrix of samples
+            nodes
+                1D array with one node per sample
+        output:
+            1D array of distances
+        """
+        if self.metric in PAIRED_METRICS and not sparse.issparse(rows):
+            return paired_distances(rows, self.centers_[nodes], self.metric, self.working_memory)
+        #other metrics and sparse rows are compared with one node at a time
+        distances = np.empty(rows.shape[0])
+        for node in np.unique(nodes):
+            members = np.flatnonzero(nodes == node)
+            distances[members] = pairwise(rows[members], self.centers_[node:node + 1], self.metric)[:, 0]
+        return distances
+
+    def _bisect(self, sub):
+        """
+        splits the samples of one cluster in two with 2-means
+
+        input:
+            2D matrix of the samples of the cluster
+        output:
+            1D array with the half (0 or 1) of each sample and the `2 x m` centroids of the halves, or
+            None twice if the cluster can't be split
+        """
+        model = KMeans(2, random_state=int(self._rng.integers(2**63)), **self._split_options())
+        model.fit(sub)
+        self.n_distance_evals_ += model.n_distance_evals_
+        if np.any(model.counts_ == 0):
+            return None, None
+        return model.labels_, np.asarray(model.centroids, dtype=np.float64)
+
+    def _root_center(self, root, total):
+        """
+        gets the center of the root node, which holds every sample, with the `update` rule
+        
+        inputs:
+            root
+                2D matrix of every sample
+            total
+                1D array of the summed features of every sample (unit-length samples for the spherical update)
+        output:
+            1D centroid of the root
+        """
+        rule = self._update_rule()
+        if rule == "median":
+            return cluster_medians(root, [np.arange(self.n)], self.m)[0]
+        if rule == "spherical":
+            return spherical_means(total[np.newaxis, :], np.array([self.n]))[0]
+        if rule == "medoid":
+            candidates = np.arange(self.n)
+            if self.n > self.medoid_candidates:
+                candidates = np.sort(self._rng.choice(self.n, self.medoid_candidates, replace=False))
+            index, evals = medoid(root, np.arange(self.n), candidates, self.metric, self.working_memory)
+            self.n_distance_evals_ += evals
+            return np.asarray(to_dense(root[index:index + 1])[0], dtype=np.float64)
+        return total / self.n
+
+    def _split_options(self):
+        """
+        gets the KMeans options for the 2-means splits
+
+        output:
+            dictionary of keyword arguments for KMeans, without k and random_state
+        """
+        options = self._restart_params()
+        del options["k"]
+        if not isinstance(options["init"], str):
+            options["init"] = "k-means++" #starting centroids for k clusters don't apply to a split
+        options.update(n_init=self.n_init, n_jobs=self.n_jobs, executor=self.executor)
+        return options
+
+    def _sums(self, sub):
+        """
+        sums the samples of one cluster in float64, scaled to unit length first for the spherical update
+
+        input:
+            2D matrix of samples
+        output:
+            1D array of summed features
+        """
+        if self._update_rule() == "spherical":
+            sub = unit_rows(sub)
+        return np.asarray(sub.sum(axis=0, dtype=np.float64)).ravel() #sparse sums come back as a 1 x m matrix
+
+    def _sse(self, sub, center):
+        """
+        calculates the sum of squared distances from the samples of one cluster to its centroid
+
+        inputs:
+            sub
+                2D matrix of the samples of the cluster
+            center
+                1D centroid of the cluster
+        output:
+            the sum of squared distances
+        """
+        _, distances = assign(sub, np.asarray(center, dtype=sub.dtype)[np.newaxis, :], self.metric, self.working_memory)
+        self.n_distance_evals_ += sub.shape[0]
+        return float(np.dot(distances, distances))
+
+    def _priority(self, sse, size):
+        """
+        scores a leaf for splitting; the leaf with the highest score is split first
+
+        inputs:
+            sse
+                the sum of squared distances of the leaf
+            size
+                the number of samples in the leaf
+        output:
+            the score
+        """
+        return sse if self.strategy == "largest_sse" else size
@@ -0,0 +1,150 @@
+import numpy as np
+from scipy import sparse
+from .distance import chunk_rows, pairwise, row_norms
+from .chunks import take_rows, to_dense
+
+#the center update that minimizes the within-cluster distances of each metric, for `update="auto"`
+AUTO_UPDATES = {"euclidean": "mean", "sqeuclidean": "mean", "cityblock": "median", "cosine": "spherical"}
+
+
+def resolve_update(update: str, metric: str) -> str:
+    """
+    picks the center update rule for a metric
+
+    inputs:
+        update: str
+            "mean", "median", "spherical", "medoid", or "auto" for the rule that suits `metric`:
+            the mean for euclidean distances, the median for cityblock, the normalized mean for cosine
+            and the medoid for any other metric
+        metric: str
+            the name of the distance metric
+
+    outputs:
+        str
+            the update rule
+    """
+    if update not in ("auto", "mean", "median", "spherical", "medoid"):
+        raise AttributeError("update must be one of 'auto', 'mean', 'median', 'spherical' or 'medoid'")
+    if update == "auto":
+        return AUTO_UPDATES.get(metric, "medoid")
+    return update
+
+
+def cluster_members(labels: np.ndarray, k: int) -> list:
+    """
+    groups the sample indices by cluster
+
+    inputs:
+        labels: np.ndarray
+            1D array with the cluster of every sample
+        k: int
+            the number of clusters
+
+    outputs:
+        list
+            `k` sorted 1D arrays of sample indices, one per cluster
+    """
+    order = np.argsort(labels, kind="stable")
+    return np.split(order, np.cumsum(np.bincount(labels, minlength=k))[:-1])
+
+
+def unit_rows(mat, norms: np.ndarray = None):
+    """
+    scales every row of a dense or sparse matrix to unit length, so that each sample counts towards a
+    spherical centroid by its direction only. rows of zeros are left as they are
+
+    inputs:
+        mat
+            a 2D `np.ndarray` or `scipy.sparse` matrix
+        norms: np.ndarray
+            1D array of the squared row norms of `mat`, if already known
+
+    outputs:
+        a matrix of the same shape and kind as `mat` with unit-length rows
+    """
+    norms = np.sqrt(row_norms(mat) if norms is None else norms)
+    scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    if sparse.issparse(mat):
+        return sparse.diags(scale.astype(mat.dtype, copy=False)) @ mat
+    return mat * scale.astype(mat.dtype, copy=False)[:, np.newaxis]
+
+
+def spherical_means(sums: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    calculates the centroids of spherical k-means, the cluster means scaled to unit length. cosine
+    distances ignore the length of a vector, and the unit mean direction of the unit-length samples
+    minimizes the summed cosine distance of the cluster
+
+    inputs:
+        sums: np.ndarray
+            `k x m` matrix of the summed unit-length feature vectors of the clusters (see `unit_rows`)
+        counts: np.ndarray
+            1D array of cluster sizes
+
+    outputs:
+        np.ndarray
+            `k x m` matrix of unit-length centroids (NaN for empty clusters)
+    """
+    norms = np.sqrt(row_norms(sums))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        centroids = sums / norms[:, np.newaxis]
+    #a cluster whose samples cancel out has no direction, so it keeps its plain (zero) mean
+    centroids[norms == 0] = 0
+    centroids[counts == 0] = np.nan
+    return centroids
+
+
+def cluster_medians(data, members: list, m: int) -> np.ndarray:
+    """
+    calculates the feature-wise median of every cluster, which minimizes the summed cityblock distance
+    to the cluster's samples. only the samples of one cluster are gathered at a time
+
+    inputs:
+        data
+            a 2D matrix or `np.memmap` where the rows are observations and columns are features
+        members: list
+            1D arrays of the sorted sample indices of each cluster
+        m: int
+            the number of features
+
+    outputs:
+        np.ndarray
+            `k x m` matrix of cluster medians (NaN for empty clusters)
+    """
+    medians = np.full((len(members), m), np.nan)
+    for label, idx in enumerate(members):
+        if len(idx) > 0:
+            medians[label] = np.median(to_dense(take_rows(data, idx)), axis=0)
+    return medians
+
+
+def medoid(data, idx: np.ndarray, candidates: np.ndarray, metric: str = "euclidean", working_memory: float = 64) -> (int, int):
+    """
+    finds the candidate with the smallest summed distance to all the samples of a cluster. the distances
+    are computed block by block over the cluster's samples, so only a `block x candidates` matrix of
+    distances is held at once
+
+    inputs:
+        data
+            a 2D matrix, `np.memmap` or `scipy.sparse` matrix where the rows are observations and columns are features
+        idx: np.ndarray
+            1D array of the sorted sample indices of the cluster
+        candidates: np.ndarray
+            1D array of sorted sample indices that may become the medoid
+        metric: str
+            the name of the distance metric to use
+        working_memory: float
+            the maximum size (in megabytes) of each block of distances
+
+    outputs:
+        (int, int)
+            returns the sample index of the medoid
+            returns the number of distances computed
+    """
+    candidate_rows = to_dense(take_rows(data, candidates))
+    costs = np.zeros(len(candidates))
+    step = chunk_rows(len(candidates), working_memory)
+    for start in range(0, len(idx), step):
+        block = take_rows(data, idx[start:start + step])
+        costs += pairwise(block, candidate_rows.astype(block.dtype, copy=False), metric).sum(axis=0)
+    return int(candidates[np.argmin(costs)]), len(idx) * len(candidates)
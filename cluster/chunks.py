@@ -0,0 +1,167 @@
+import itertools
+import numpy as np
+from scipy import sparse
+
+
+def is_chunked(data) -> bool:
+    """
+    checks whether the input is an iterable of chunks rather than a single matrix (or memory-mapped matrix)
+
+    inputs:
+        data
+            a 2D matrix, a `np.memmap`, or an iterable of 2D chunks of rows
+
+    outputs:
+        bool
+            True for an iterable of chunks
+    """
+    return not hasattr(data, "shape")
+
+
+def iter_chunks(data, step: int):
+    """
+    walks through the rows of a matrix or an iterable of chunks, so that callers only ever hold one
+    chunk of rows in memory. matrices (including memory-mapped ones) are sliced into chunks of `step`
+    rows; an iterable of chunks is passed through as it is and must start over each time it is iterated,
+    since most callers make several passes
+
+    inputs:
+        data
+            a 2D matrix, a `np.memmap`, or a re-iterable of 2D chunks of rows (e.g. a list of arrays)
+        step: int
+            the number of rows per chunk when slicing a matrix
+
+    outputs:
+        generator
+            yields (start, chunk) where `start` is the index of the first row of the chunk
+    """
+    if not is_chunked(data):
+        for start in range(0, data.shape[0], step):
+            yield start, data[start:start + step]
+        return
+    if iter(data) is data:
+        raise AttributeError("chunked input must be re-iterable (e.g. a list, not a generator) so it can be read more than once")
+    start = 0
+    for chunk in data:
+        chunk = np.atleast_2d(np.asarray(chunk))
+        yield start, chunk
+        start += chunk.shape[0]
+
+
+def n_features(data) -> int:
+    """
+    gets the number of columns of a matrix or an iterable of chunks
+
+    inputs:
+        data
+            a 2D matrix, a `np.memmap`, or a re-iterable of 2D chunks of rows
+
+    outputs:
+        int
+            the number of features
+    """
+    if not is_chunked(data):
+        return data.shape[1]
+    for _, chunk in iter_chunks(data, 1):
+        return chunk.shape[1]
+    raise AttributeError("chunked input must contain at least one chunk")
+
+
+def data_dtype(data) -> np.dtype:
+    """
+    gets the dtype of a matrix or an iterable of chunks (the dtype of its first chunk)
+
+    inputs:
+        data
+            a 2D matrix, a `np.memmap`, or a re-iterable of 2D chunks of rows
+
+    outputs:
+        np.dtype
+            the dtype of the data
+    """
+    if not is_chunked(data):
+        return data.dtype
+    for _, chunk in iter_chunks(data, 1):
+        return chunk.dtype
+    raise AttributeError("chunked input must contain at least one chunk")
+
+
+def take_rows(data, idx: np.ndarray, step: int = 65536) -> np.ndarray:
+    """
+    gathers some rows of a matrix or an iterable of chunks into memory
+
+    inputs:
+        data
+            a 2D matrix, a `np.memmap`, or a re-iterable of 2D chunks of rows
+        idx: np.ndarray
+            1D array of sorted row indices to gather
+        step: int
+            the number of rows per chunk when slicing a matrix
+
+    outputs:
+        np.ndarray
+            a `len(idx) x m` matrix of the requested rows (sparse for a sparse matrix)
+    """
+    if sparse.issparse(data):
+        return data[idx]
+    if not is_chunked(data):
+        return np.asarray(data[idx])
+    rows = []
+    for start, chunk in iter_chunks(data, step):
+        lo, hi = np.searchsorted(idx, [start, start + chunk.shape[0]])
+        rows.append(chunk[idx[lo:hi] - start])
+    return np.concatenate(rows)
+
+
+def to_dense(block) -> np.ndarray:
+    """
+    converts a (small) block of rows to a dense array, such as sparse rows that become centroids
+
+    inputs:
+        block
+            a 2D `np.ndarray`, `np.matrix` or `scipy.sparse` matrix
+
+    outputs:
+        np.ndarray
+            the block as a dense 2D array
+    """
+    if sparse.issparse(block):
+        return block.toarray()
+    return np.asarray(block)
+
+
+class CsvChunks:
+    """
+    a re-iterable reader that parses a delimited text file (e.g. CSV) in chunks of rows, so the file
+    can be passed anywhere chunked input is accepted without loading it into memory. every iteration
+    reads the file again from the start
+    """
+    def __init__(self, path: str, chunk_size: int = 65536, delimiter: str = ",", skip_header: int = 0, dtype=np.float64):
+        """
+        inputs:
+            path: str
+                the text file to read
+            chunk_size: int
+                the number of rows per chunk
+            delimiter: str
+                the string that separates the columns
+            skip_header: int
+                the number of lines to skip at the start of the file
+            dtype: np.dtype
+                the dtype of the parsed values
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.delimiter = delimiter
+        self.skip_header = skip_header
+        self.dtype = dtype
+
+    def __iter__(self):
+        with open(self.path) as f:
+            for _ in range(self.skip_header):
+                next(f, None)
+            while True:
+                lines = [line for line in itertools.islice(f, self.chunk_size) if line.strip()]
+                if len(lines) == 0:
+                    return
+                yield np.atleast_2d(np.loadtxt(lines, delimiter=self.delimiter, dtype=self.dtype, ndmin=2))
@@ -0,0 +1,300 @@
+import numpy as np
+from scipy import sparse
+from scipy.spatial.distance import cdist
+
+
+def chunk_rows(n_cols: int, working_memory: float = 64, itemsize: int = 8) -> int:
+    """
+    gets the number of rows that can be processed at once so that a `rows x n_cols` block of
+    distances stays within the working memory budget
+
+    inputs:
+        n_cols: int
+            the number of columns in each block of distances (e.g. the number of centroids)
+        working_memory: float
+            the maximum size of a block of distances in megabytes
+        itemsize: int
+            the number of bytes used for each distance value
+
+    outputs:
+        int
+            the number of rows per chunk (always at least 1)
+    """
+    budget = int(working_memory * 2**20) #convert megabytes to bytes
+    return max(1, budget // (max(1, n_cols) * itemsize))
+
+
+def compute_dtype(dtype=None, data_dtype=None) -> np.dtype:
+    """
+    picks the floating point type that distances and centroids are computed in. float32 data is kept in
+    float32 (halving memory and bandwidth); anything else is computed in float64
+
+    inputs:
+        dtype
+            a requested dtype, or None to follow the data
+        data_dtype
+            the dtype of the data, used when no dtype is requested
+
+    outputs:
+        np.dtype
+            float32 or float64
+    """
+    if dtype is not None:
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float64):
+            raise AttributeError("dtype must be float32, float64 or None")
+        return dtype
+    if data_dtype is not None and np.dtype(data_dtype) == np.float32:
+        return np.dtype(np.float32)
+    return np.dtype(np.float64)
+
+
+#metrics that can be computed on sparse matrices from dot products and row norms
+SPARSE_METRICS = ("euclidean", "sqeuclidean", "cosine")
+
+
+def row_norms(mat) -> np.ndarray:
+    """
+    calculates the squared euclidean norm of every row of a dense or sparse matrix
+
+    inputs:
+        mat
+            a 2D `np.ndarray` or `scipy.sparse` matrix
+
+    outputs:
+        np.ndarray
+            a 1D float64 array of squared row norms
+    """
+    if sparse.issparse(mat):
+        return np.asarray(mat.multiply(mat).sum(axis=1), dtype=np.float64).ravel()
+    return np.einsum("ij,ij->i", mat, mat, dtype=np.float64)
+
+
+def pairwise(
+        a: np.ndarray,
+        b: np.ndarray,
+        metric: str = "euclidean",
+        a_norms: np.ndarray = None,
+        b_norms: np.ndarray = None) -> np.ndarray:
+    """
+    calculates the block of distances between every row of `a` and every row of `b`
+
+    float32 euclidean distances are expanded as |a|^2 - 2 a.b + |b|^2 so the block is one float32 matrix
+    product, instead of `cdist` converting both inputs to float64 first. sparse inputs use the same
+    expansion (or the normalized dot product for cosine), so they are never densified; only the block of
+    distances is dense. the expansion loses some precision for points much closer together than their
+    norms; every other case goes through `cdist`
+
+    inputs:
+        a: np.ndarray
+            a 2D matrix (dense or `scipy.sparse`) where the rows are observations and columns are features
+        b: np.ndarray
+            a 2D matrix (dense or `scipy.sparse`) with the same number of columns as `a`
+        metric: str
+            the name of the distance metric to use; one of `SPARSE_METRICS` for sparse inputs
+        a_norms: np.ndarray
+            optional precomputed squared row norms of `a` (see `row_norms`), used for sparse inputs
+        b_norms: np.ndarray
+            optional precomputed squared row norms of `b`, used for sparse inputs
+
+    outputs:
+        np.ndarray
+            an `a.shape[0] x b.shape[0]` matrix of distances (float32 for float32 euclidean inputs, float64 otherwise)
+    """
+    if sparse.issparse(a) or sparse.issparse(b):
+        if metric not in SPARSE_METRICS:
+            raise AttributeError("sparse input requires one of the metrics " + ", ".join(SPARSE_METRICS))
+        a_norms = row_norms(a) if a_norms is None else a_norms
+        b_norms = row_norms(b) if b_norms is None else b_norms
+        dist = a @ b.T
+        dist = dist.toarray() if sparse.issparse(dist) else np.asarray(dist)
+        if metric == "cosine":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                dist /= np.sqrt(a_norms)[:, np.newaxis]
+                dist /= np.sqrt(b_norms)[np.newaxis, :]
+            dist[~np.isfinite(dist)] = 0 #rows without any nonzero entry count as orthogonal to everything
+            np.subtract(1, dist, out=dist)
+            return dist
+        dist *= -2
+        dist += a_norms[:, np.newaxis]
+        dist += b_norms[np.newaxis, :]
+        np.maximum(dist, 0, out=dist)
+        return dist if metric == "sqeuclidean" else np.sqrt(dist, out=dist)
+    if metric == "euclidean" and a.dtype == np.float32 and b.dtype == np.float32:
+        dist = a @ b.T
+        dist *= -2
+        dist += np.einsum("ij,ij->i", a, a)[:, np.newaxis]
+        dist += np.einsum("ij,ij->i", b, b)[np.newaxis, :]
+        np.maximum(dist, 0, out=dist) #rounding can push the expansion slightly below zero
+        return np.sqrt(dist, out=dist)
+    return cdist(a, b, metric)
+
+
+def assign(
+        mat: np.ndarray,
+        centroids: np.ndarray,
+        metric: str = "euclidean",
+        working_memory: float = 64,
+        norms: np.ndarray = None) -> (np.ndarray, np.ndarray):
+    """
+    assigns every row of a matrix to its closest centroid
+
+    the sample-to-centroid distances are computed with one `cdist` call per chunk of rows, so
+    at most `working_memory` megabytes of distances are held in memory at any time. float32 euclidean
+    input ranks the centroids with a float32 matrix product instead and only the winning distances are
+    recomputed exactly, so the chunk is never converted to float64. a `scipy.sparse` matrix is
+    compared with the centroids through `pairwise`, one chunk of rows at a time
+
+    inputs:
+        mat: np.ndarray
+            A 2D matrix (dense or `scipy.sparse`) where the rows are observations and columns are features
+        centroids: np.ndarray
+            a `k x m` 2D matrix of centroids
+        metric: str
+            the name of the distance metric to use
+        working_memory: float
+            the maximum size of a block of distances in megabytes
+        norms: np.ndarray
+            optional precomputed squared row norms of a sparse `mat` (see `row_norms`)
+
+    outputs:
+        (np.ndarray, np.ndarray)
+            returns a 1D array with the index of the closest centroid for each observation
+            returns a 1D array with the distance from each observation to its closest centroid
+    """
+    centroids = np.atleast_2d(np.asarray(centroids))
+    n = mat.shape[0]
+    labels = np.empty(n, dtype=np.int32)
+    distances = np.empty(n, dtype=np.float64)
+
+    is_sparse = sparse.issparse(mat)
+    expand = metric == "euclidean" and mat.dtype == np.float32 and centroids.dtype == np.float32 and not is_sparse
+    if expand:
+        sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+    if is_sparse:
+        centroid_norms = row_norms(centroids) #shared by every chunk
+
+    step = chunk_rows(centroids.shape[0], working_memory, 4 if expand else 8)
+    for start in range(0, n, step):
+        stop = min(start + step, n)
+        block = mat[start:stop]
+        if is_sparse:
+            block_norms = None if norms is None else norms[start:stop]
+            dist = pairwise(block, centroids, metric, block_norms, centroid_norms)
+            idx = np.argmin(dist, axis=1)
+            distances[start:stop] = dist[np.arange(stop - start), idx]
+        elif expand:
+            #|c|^2 - 2 x.c ranks the centroids the same as the squared distance, since |x|^2 is shared
+            rank = block @ centroids.T
+            rank *= -2
+            rank += sq_norms
+            idx = np.argmin(rank, axis=1)
+            distances[start:stop] = paired_distances(block, centroids[idx], metric, working_memory)
+        else:
+            dist = cdist(block, centroids, metric) #distances between the chunk and every centroid
+            idx = np.argmin(dist, axis=1) #closest centroid for each row of the chunk
+            distances[start:stop] = dist[np.arange(stop - start), idx]
+        labels[start:stop] = idx
+    return labels, distances
+
+
+#metrics that `paired_distances` can compute row by row (all of them obey the triangle inequality)
+PAIRED_METRICS = ("euclidean", "cityblock", "chebyshev")
+
+
+def paired_distances(
+        a: np.ndarray,
+        b: np.ndarray,
+        metric: str = "euclidean",
+        working_memory: float = 64) -> np.ndarray:
+    """
+    calculates the distance between each row of `a` and the matching row of `b`
+
+    inputs:
+        a: np.ndarray
+            a 2D matrix where the rows are observations and columns are features
+        b: np.ndarray
+            a 2D matrix with the same shape as `a`
+        metric: str
+            the name of the distance metric to use, one of `PAIRED_METRICS`
+        working_memory: float
+            the maximum size of each block of feature differences in megabytes
+
+    outputs:
+        np.ndarray
+            a 1D array with the distance between each pair of rows
+
+    the differences are taken in the inputs' own precision (float32 stays float32) and the sums over
+    features are accumulated in float64
+    """
+    if metric not in PAIRED_METRICS:
+        raise AttributeError("paired distances are only available for the metrics " + ", ".join(PAIRED_METRICS))
+
+    n = a.shape[0]
+    distances = np.empty(n, dtype=np.float64)
+    dtype = np.result_type(a.dtype, b.dtype, np.float32) #float32 pairs stay float32, integers become float64
+    step = chunk_rows(a.shape[1], working_memory, dtype.itemsize)
+    for start in range(0, n, step):
+        diff = np.subtract(a[start:start + step], b[start:start + step], dtype=dtype)
+        np.abs(diff, out=diff)
+        if metric == "euclidean":
+            np.square(diff, out=diff)
+            distances[start:start + step] = np.sqrt(diff.sum(axis=1, dtype=np.float64))
+        elif metric == "cityblock":
+            distances[start:start + step] = diff.sum(axis=1, dtype=np.float64)
+        else:
+            distances[start:start + step] = diff.max(axis=1)
+    return distances
+
+
+def label_indicator(labels: np.ndarray, k: int, dtype=np.float64):
+    """
+    builds a sparse `n x k` indicator matrix with a one in the column of each sample's label, so that
+    multiplying a block of distances by it sums the distances to each cluster in a single vectorized step
+
+    inputs:
+        labels: np.ndarray
+            a 1D array of integer labels in `[0, k)`
+        k: int
+            the number of clusters
+        dtype
+            the dtype of the matrix; matching the dtype of the block it multiplies avoids converting the block
+
+    outputs:
+        scipy.sparse.csr_matrix
+            the `n x k` indicator matrix
+    """
+    n = len(labels)
+    return sparse.csr_matrix((np.ones(n, dtype=dtype), (np.arange(n), labels)), shape=(n, k))
+
+
+def cluster_sums(mat, labels: np.ndarray, k: int, working_memory: float = 16) -> np.ndarray:
+    """
+    sums the rows of each cluster in float64. float32 rows are converted to float64 a block at a time
+    before they are added up, since summing millions of float32 values in float32 loses most of their
+    precision, while converting the whole matrix at once would double its memory
+
+    inputs:
+        mat
+            a 2D matrix (dense or `scipy.sparse`) where the rows are observations and columns are features
+        labels: np.ndarray
+            a 1D array with the cluster of every row, in `[0, k)`
+        k: int
+            the number of clusters
+        working_memory: float
+            the maximum size (in megabytes) of each block of rows converted to float64
+
+    outputs:
+        np.ndarray
+            a `k x m` float64 matrix of summed rows
+    """
+    if sparse.issparse(mat) or mat.dtype == np.float64:
+        #sparse products upcast only the stored values, and float64 rows need no conversion
+        sums = label_indicator(labels, k).T @ mat
+        return sums.toarray() if sparse.issparse(sums) else np.asarray(sums, dtype=np.float64)
+    sums = np.zeros((k, mat.shape[1]))
+    step = chunk_rows(mat.shape[1], working_memory)
+    for start in range(0, mat.shape[0], step):
+        block = np.asarray(mat[start:start + step], dtype=np.float64)
+        sums += label_indicator(labels[start:start + step], k).T @ block
+    return sums
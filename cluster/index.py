@@ -0,0 +1,131 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
+from .distance import assign, chunk_rows, compute_dtype, paired_distances
+
+#minkowski p of each metric a KD-tree can search
+KDTREE_METRICS = {"euclidean": 2, "cityblock": 1, "chebyshev": np.inf}
+
+
+class CentroidIndex:
+    """
+    an exact nearest-centroid search structure, built once over a fixed set of centroids
+
+    "kdtree" uses a KD-tree, which is fastest for low-dimensional data. "blas" expands the squared euclidean
+    distance as |x|^2 - 2 x.c + |c|^2 so a whole block of samples is searched with one matrix product,
+    which suits high-dimensional data. "brute" falls back to `cdist` for any other metric
+    """
+    def __init__(
+            self,
+            centroids: np.ndarray,
+            metric: str = "euclidean",
+            kind: str = "auto",
+            working_memory: float = 64,
+            max_kdtree_dims: int = 16):
+        """
+        inputs:
+            centroids: np.ndarray
+                a `k x m` matrix of centroids
+            metric: str
+                the name of the distance metric to use
+            kind: str
+                "auto", "kdtree", "blas" or "brute". "auto" picks a KD-tree for up to `max_kdtree_dims`
+                features, the matrix product for higher-dimensional euclidean data and brute force otherwise
+            working_memory: float
+                the maximum size (in megabytes) of each block of distances
+            max_kdtree_dims: int
+                the largest number of features for which "auto" picks a KD-tree
+
+        float32 centroids are searched in float32 by the "blas" and "brute" kinds; anything else in float64
+        """
+        self.centroids = np.ascontiguousarray(centroids, dtype=compute_dtype(data_dtype=np.asarray(centroids).dtype))
+        self.metric = metric
+        self.working_memory = working_memory
+        m = self.centroids.shape[1]
+
+        if kind == "auto":
+            if metric in KDTREE_METRICS and m <= max_kdtree_dims:
+                kind = "kdtree"
+            elif metric == "euclidean":
+                kind = "blas"
+            else:
+                kind = "brute"
+        if kind == "kdtree" and metric not in KDTREE_METRICS:
+            raise AttributeError("a kdtree index requires one of the metrics " + ", ".join(KDTREE_METRICS))
+        if kind == "blas" and metric != "euclidean":
+            raise AttributeError("a blas index requires the euclidean metric")
+        if kind not in ("kdtree", "blas", "brute"):
+            raise AttributeError("index must be 'auto', 'kdtree', 'blas' or 'brute'")
+        self.kind = kind
+
+        if kind == "kdtree":
+            self._tree = cKDTree(self.centroids)
+        elif kind == "blas":
+            self._sq_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        #distances computed per searched sample: every centroid for brute force, plus the recomputed winner
+        #for blas. the KD-tree prunes most centroids but doesn't report how many it visits, so it counts
+        #every centroid, an upper bound
+        k = self.centroids.shape[0]
+        self.evals_per_sample = k + 1 if kind == "blas" else k
+
+    def query(self, mat: np.ndarray) -> (np.ndarray, np.ndarray):
+        """
+        finds the closest centroid to every row of a matrix, in blocks of rows
+
+        inputs:
+            mat: np.ndarray
+                A 2D matrix where the rows are observations and columns are features
+
+        outputs:
+            (np.ndarray, np.ndarray)
+                returns a 1D array with the index of the closest centroid for each observation
+                returns a 1D array with the distance from each observation to its closest centroid
+        """
+        if self.kind == "brute":
+            return assign(mat, self.centroids, self.metric, self.working_memory)
+
+        n = mat.shape[0]
+        labels = np.empty(n, dtype=np.int32)
+        distances = np.empty(n, dtype=np.float64)
+        step = chunk_rows(self.centroids.shape[0], self.working_memory)
+        for start in range(0, n, step):
+            stop = min(start + step, n)
+            block = np.asarray(mat[start:stop], dtype=self.centroids.dtype)
+            if self.kind == "kdtree":
+                dist, idx = self._tree.query(block, p=KDTREE_METRICS[self.metric])
+            else:
+                #|c|^2 - 2 x.c ranks the centroids the same as the squared distance, since |x|^2 is shared
+                rank = block @ self.centroids.T
+                rank *= -2
+                rank += self._sq_norms
+                idx = np.argmin(rank, axis=1)
+                #recompute the winning distance directly to avoid the cancellation error of the expansion
+                dist = paired_distances(block, self.centroids[idx], self.metric, self.working_memory)
+            labels[start:stop] = idx
+            distances[start:stop] = dist
+        return labels, distances
+
+    def query_one(self, sample: np.ndarray) -> (int, float):
+        """
+        finds the closest centroid to a single observation, without the overhead of batching
+
+        inputs:
+            sample: np.ndarray
+                a 1D feature vector
+
+        outputs:
+            (int, float)
+                returns the index of the closest centroid
+                returns the distance to it
+        """
+        sample = np.asarray(sample, dtype=self.centroids.dtype).ravel()
+        if self.kind == "kdtree":
+            dist, idx = self._tree.query(sample, p=KDTREE_METRICS[self.metric])
+            return int(idx), float(dist)
+        if self.kind == "blas":
+            idx = int(np.argmin(self._sq_norms - 2 * (self.centroids @ sample)))
+            diff = sample - self.centroids[idx]
+            return idx, float(np.sqrt(np.square(diff).sum(dtype=np.float64)))
+        dist = cdist(sample[np.newaxis, :], self.centroids, self.metric)[0]
+        idx = int(np.argmin(dist))
+        return idx, float(dist[idx])
@@ -1,5 +1,20 @@
+import time
 import numpy as np
+from scipy import sparse
 from scipy.spatial.distance import cdist
+from .distance import (assign, chunk_rows, cluster_sums, compute_dtype, pairwise, paired_distances, row_norms,
+                       PAIRED_METRICS, SPARSE_METRICS)
+from .chunks import data_dtype, is_chunked, iter_chunks, n_features, take_rows, to_dense
+from .seeding import random_init, kmeans_plusplus, kmeans_parallel
+from .parallel import SharedArray, attach, make_executor, resolve_n_jobs
+from .index import CentroidIndex, KDTREE_METRICS
+from .centers import cluster_medians, cluster_members, medoid, resolve_update, spherical_means, unit_rows
+from .persistence import read_arrays, write_arrays
+
+#a minibatch fit stops once its smoothed batch error hasn't reached a new low for this many batches
+MINIBATCH_PATIENCE = 10
+#a minibatch fit over chunks stops once a pass lowers the error by less than this fraction
+MINIBATCH_PASS_TOL = 1e-3
 
 class KMeans:
     def __init__(
@@ -7,7 +22,20 @@ class KMeans:
             k: int,
             metric: str = "euclidean",
             tol: float = 1e-6,
-            max_iter: int = 100):
+            max_iter: int = 100,
+            working_memory: float = 64,
+            algorithm: str = "lloyd",
+            batch_size: int = 1024,
+            init = "k-means++",
+            random_state = None,
+            n_init: int = 1,
+            n_jobs: int = None,
+            executor = None,
+            index: str = None,
+            dtype = None,
+            callback = None,
+            update: str = "auto",
+            medoid_candidates: int = 256):
         """
         inputs:
             k: int
@@ -18,101 +46,338 @@ class KMeans:
                 the minimum error tolerance from previous error during optimization to quit the model fit
             max_iter: int
                 the maximum number of iterations before quitting model fit
+            working_memory: float
+                the maximum size (in megabytes) of each block of sample-to-centroid distances
+            algorithm: str
+                how samples are assigned to centroids during fitting. "lloyd" computes every
+                sample-to-centroid distance in each iteration, while "elkan" and "hamerly" keep
+                triangle-inequality bounds so most distances can be skipped. all three give the
+                same clusters. "elkan" keeps `k` bounds per sample and skips the most distances,
+                "hamerly" keeps a single lower bound per sample and suits lower-dimensional data.
+                "minibatch" updates the centroids from small random batches of samples instead
+            batch_size: int
+                the number of samples in each batch of the "minibatch" algorithm
+            init: str or np.ndarray
+                how the starting centroids are picked. "random" picks `k` random samples, "k-means++"
+                spreads the picks out by drawing samples far from the centroids picked so far, and
+                "k-means||" is a variant of k-means++ that needs only a few passes over large data.
+                a `k x m` array is used as the starting centroids directly
+            random_state: int or np.random.Generator
+                seed or generator for the random draws, so fits can be reproduced. None draws a fresh seed
+            n_init: int
+                the number of fits from different starting centroids; the fit with the lowest error is kept.
+                each restart gets its own seed derived from `random_state`
+            n_jobs: int
+                the number of worker processes that run the restarts at the same time (-1 for one per cpu).
+                the fit matrix is shared with the workers through shared memory
+            executor: concurrent.futures.Executor
+                an existing pool to run the restarts on instead of creating one from `n_jobs`
+            index: str
+                an optional search structure over the fitted centroids that `predict` and `predict_one`
+                query instead of scanning every centroid: "kdtree" for low-dimensional data, "blas" for
+                high-dimensional euclidean data, "brute", or "auto" to pick one. it is built once per fit
+            dtype: np.dtype
+                the floating point type that the centroids and distances are computed in, float32 or float64.
+                None keeps float32 data in float32 (so it is never copied to float64) and computes anything
+                else in float64. the cluster sums and errors are always accumulated in float64
+            callback: callable
+                an optional function called as `callback(model, record)` after every iteration of `fit`,
+                with the record that is appended to `history_`. it isn't called for the individual
+                restarts of `n_init > 1`
+            update: str
+                how the centroids are recomputed from their clusters, which should match the metric for the
+                fit to converge. "mean" takes the mean (for euclidean distances), "median" the feature-wise
+                median (for cityblock), "spherical" the mean scaled to unit length (for cosine) and "medoid"
+                the sample with the smallest summed distance to the rest of its cluster (k-medoids, for any
+                metric). "auto" picks the rule that suits `metric`, using the medoid for metrics other than
+                euclidean, sqeuclidean, cityblock and cosine. the "minibatch" algorithm and chunked input
+                only support means, so "auto" falls back to the mean (the unit-length mean for cosine) there
+            medoid_candidates: int
+                the number of samples of each cluster (chosen at random, along with the current medoid) that
+                are tried as its new medoid, as in CLARA. clusters with fewer samples try all of them
         """
         #raise an error if k=0
         if k==0:
             raise AttributeError("k must be a positive integer greater than zero")
+        #raise an error if the assignment algorithm is unknown or can't use the metric
+        if algorithm not in ("lloyd", "elkan", "hamerly", "minibatch"):
+            raise AttributeError("algorithm must be one of 'lloyd', 'elkan', 'hamerly' or 'minibatch'")
+        if algorithm in ("elkan", "hamerly") and metric not in PAIRED_METRICS:
+            raise AttributeError("the " + algorithm + " algorithm requires one of the metrics " + ", ".join(PAIRED_METRICS))
+        #raise an error if the seeding is unknown or doesn't give k centroids
+        if isinstance(init, str):
+            if init not in ("random", "k-means++", "k-means||"):
+                raise AttributeError("init must be 'random', 'k-means++', 'k-means||' or an array of centroids")
+        else:
+            init = np.array(init, dtype=np.float64)
+            if init.ndim != 2 or init.shape[0] != k:
+                raise AttributeError("init centroids must be a 2D array with k rows")
+        if n_init < 1:
+            raise AttributeError("n_init must be a positive integer")
+        #raise an error if the index is unknown or can't search with the metric, rather than on the first predict
+        if index not in (None, "auto", "kdtree", "blas", "brute"):
+            raise AttributeError("index must be None, 'auto', 'kdtree', 'blas' or 'brute'")
+        if index == "kdtree" and metric not in KDTREE_METRICS:
+            raise AttributeError("a kdtree index requires one of the metrics " + ", ".join(KDTREE_METRICS))
+        if index == "blas" and metric != "euclidean":
+            raise AttributeError("a blas index requires the euclidean metric")
+        compute_dtype(dtype) #raise an error if the dtype isn't float32 or float64
+        #raise an error if the update rule is unknown or can't be applied to batches
+        rule = resolve_update(update, metric)
+        if algorithm == "minibatch" and rule in ("median", "medoid") and update != "auto":
+            raise AttributeError("the minibatch algorithm only supports the 'mean' and 'spherical' updates")
+        if medoid_candidates < 1:
+            raise AttributeError("medoid_candidates must be a positive integer")
         
         #assign initial attributes
         self.k = k
         self.tol = tol
         self.max_iter = max_iter
         self.metric = metric
+        self.working_memory = working_memory
+        self.algorithm = algorithm
+        self.batch_size = batch_size
+        self.init = init
+        self.random_state = random_state
+        self.n_init = n_init
+        self.n_jobs = n_jobs
+        self.executor = executor
+        self.index = index
+        self.dtype = dtype
+        self.callback = callback
+        self.update = update
+        self.medoid_candidates = medoid_candidates
         
         #initialize empty clusters and centroids
-        self.clusters = [[] for i in range(self.k)] #holds data point labels for the current clustering
         self.centroids = [] #holds mean feature vector for each centroid
+        self.labels_ = None #int32 cluster label of each sample in the fit matrix
+        self.counts_ = None #number of samples in each cluster
+        self._cluster_sums = None #summed feature vectors of the samples in each cluster
+        self._error = None #mean-squared error of the latest assignment
+        self._data = None #the fit matrix, only held while fitting
+        self._norms = None #squared row norms of a sparse fit matrix, only held while fitting
+        self._chunked = False #whether the last fit streamed its data in chunks
+        self.n_distance_evals_ = 0 #number of distances computed by the assignment steps of the last fit
+        self.n_predict_evals_ = 0 #number of distances computed by predict calls since the last fit
+        self.n_iter_ = 0 #number of iterations run by the last fit
+        self.converged_ = False #whether the last fit converged before reaching max_iter
+        self.history_ = [] #one record of timings and convergence measures per iteration of the last fit
+        self._absorbed = None #number of samples each centroid has absorbed in minibatch fitting
+        self._index = None #search structure over the current centroids, built on first use
+        self._dtype = compute_dtype(dtype) #dtype of the centroids and distances, resolved from the data when fitting
+        self.medoid_indices_ = None #sample index of each medoid in the fit matrix, for the "medoid" update
+        self._medoid_labels = None #the labels that the medoids were last computed from
         
     
+    @property
+    def clusters(self) -> list:
+        """
+        the indices of the samples in each cluster as a list of lists, built on request from `labels_`.
+        the lists are empty before fitting and after fitting chunked input, which keeps no labels
+
+        outputs:
+            list
+                `k` lists of sample indices, one per cluster
+        """
+        if self.labels_ is None:
+            return [[] for i in range(self.k)]
+        #group the sample indices by label with one stable sort instead of one scan per cluster
+        order = np.argsort(self.labels_, kind="stable")
+        return [idx.tolist() for idx in np.split(order, np.cumsum(self.counts_)[:-1])]
+    
     def fit(self, mat: np.ndarray):
         #this is basically like creation of the clusters, or finding of the centroids, and then in the predict method
         #you will place the data points on top of the fitted clusters based on what the data points are most similar to
         """
         fits the kmeans algorithm onto a provided 2D matrix
 
+        the matrix can also be a `np.memmap` or a re-iterable of 2D chunks of rows (e.g. a list of arrays),
+        so data larger than memory can be fit: each iteration streams through the data one chunk at a time
+        and only keeps the per-cluster sums and counts. the fit matrix is not kept on the model afterwards.
+        chunked input keeps no per-sample labels, so `clusters` stays empty, and it can't be used with the
+        "elkan" or "hamerly" algorithms or with parallel restarts
+
+        afterwards `n_iter_` holds the number of iterations, `converged_` whether the fit converged before
+        `max_iter`, and `history_` one record per iteration with the time spent assigning, updating and
+        checking the error, the error and inertia, the largest centroid shift and the number of samples
+        that changed cluster. the fit also stops as soon as no sample changes cluster
+
+        a `scipy.sparse` matrix (e.g. TF-IDF features) is fit without densifying it, for the metrics in
+        `SPARSE_METRICS`: distances come from sparse-dense dot products and row norms computed once per fit,
+        and the cluster sums are sparse aggregations. only the `k x m` centroids are dense
+
         inputs: 
             mat: np.ndarray
                 A 2D matrix where the rows are observations and columns are features
         """
-        self.fit_mat = mat #matrix for fitting
-        self.n = mat.shape[0] #number of samples in matrix (i.e. number of rows)
-        self.m = mat.shape[1] #number of features in matrix (i.e. number of columns)
+        chunked = is_chunked(mat)
+        if chunked and self.algorithm in ("elkan", "hamerly"):
+            raise AttributeError("the " + self.algorithm + " algorithm needs the full matrix, not chunked input")
+        if chunked and self.update in ("median", "medoid"):
+            raise AttributeError("the " + self.update + " update needs the full matrix, not chunked input")
+        self._chunked = chunked
+        if sparse.issparse(mat):
+            if self.metric not in SPARSE_METRICS:
+                raise AttributeError("sparse input requires one of the metrics " + ", ".join(SPARSE_METRICS))
+            if self.algorithm in ("elkan", "hamerly"):
+                raise AttributeError("the " + self.algorithm + " algorithm needs dense input")
+        self.m = n_features(mat) #number of features in matrix (i.e. number of columns)
+        self.n = None if chunked else mat.shape[0] #number of samples, counted on the first pass for chunked input
         
-        if self.k>self.n:
+        if not chunked and self.k>self.n:
             raise AttributeError("k must be less than the number of observations")
         
-        #for shorter typing:
-        n = self.n
-        k = self.k
-        m = self.m
+        #random draws come from a generator rather than the global numpy state
+        self._rng = np.random.default_rng(self.random_state)
+        self._index = None
+        self.n_predict_evals_ = 0
+        self._dtype = compute_dtype(self.dtype, data_dtype(mat))
+        if not chunked and not isinstance(mat, np.memmap):
+            mat = self._as_compute(mat) #convert in-memory data once rather than chunk by chunk
+        #squared row norms of sparse data, shared by every assignment pass
+        self._norms = row_norms(mat) if sparse.issparse(mat) else None
         
-        #set random seed
-        np.random.seed() #set to 42 for now so results are reproducible
-
-        #initialize centroids by randomly picking k data points as the starting centroids
-        rand_idx = np.random.choice(n, k, replace=False) #generate random indices to pick from the input array
-        self.centroids = [mat[idx] for idx in rand_idx] #assign the samples of those indices to be the initial centroids
+        if self.n_init > 1:
+            self._fit_restarts(mat)
+            return
         
         #initialize variables
-        cur_mse = 0
         last_mse = 0
+        self.n_distance_evals_ = 0
+        self.converged_ = False
+        self.history_ = []
+        self._bounds = None #triangle-inequality bounds used by the elkan and hamerly algorithms
+        self.medoid_indices_ = None
+        self._medoid_labels = None
+        self._data = mat
         
-        
-        #optimization procedure
-        for i in range(0,self.max_iter):
-            #if i=0, initialize centroids randomly
-            if i==0:
-                rand_idx = np.random.choice(n, k, replace=False) #generate random indices to pick from the input array
-                self.centroids = [mat[idx] for idx in rand_idx] #assign the samples of those indices to be the initial centroids
-            #otherwise, get the centroids from the mean of each cluster
-            else:
-                self.centroids = self.get_centroids() #get centroids
-            
-            #now generate clusters from the calculated centroids
-            self.clusters = self._create_clusters(self.centroids)
-            #calculate the mse
-            cur_mse = self.get_error()
+        try:
+            if self.algorithm == "minibatch":
+                self.centroids = self._init_centroids(mat)
+                self._fit_minibatch(mat)
+                return
             
-            if i==0:
+            #optimization procedure
+            for i in range(0,self.max_iter):
+                self.n_iter_ = i + 1
+                tic = time.perf_counter()
+                #if i=0, pick the starting centroids
+                if i==0:
+                    self.centroids = self._init_centroids(mat)
+                    shift = None
+                #otherwise, get the centroids from the mean (or median, or medoid) of each cluster
+                else:
+                    centroids = self._relocate_empty(self.get_centroids()) #get centroids
+                    shift = self._centroid_shift(self.centroids, centroids)
+                    self.centroids = centroids
+                update_time = time.perf_counter() - tic
+                
+                #now generate clusters from the calculated centroids. the elkan and hamerly steps relabel in place
+                previous = None if i==0 or self.labels_ is None else self.labels_.copy()
+                tic = time.perf_counter()
+                self._create_clusters(self.centroids)
+                assign_time = time.perf_counter() - tic
+                
+                #the mse was accumulated from the distances of the assignment step
+                tic = time.perf_counter()
+                cur_mse = self.get_error()
+                n_changed = None if previous is None else int(np.count_nonzero(previous != self.labels_))
+                #no sample changed cluster, so the centroids (and the error) can't change any more
+                if n_changed == 0 or (i > 0 and abs(cur_mse - last_mse) <= self.tol):
+                    self.converged_ = True
                 last_mse = cur_mse
-            #check if convergence has been reached
-            else:
-                if abs(cur_mse - last_mse) <= self.tol:
+                error_time = time.perf_counter() - tic
+                
+                self._record(i, assign_time, update_time, error_time, cur_mse, shift, n_changed)
+                #check if convergence has been reached
+                if self.converged_:
                     break
-                else:
-                    last_mse = cur_mse
+        finally:
+            self._data = None #don't pin the fit matrix on the model
+            self._norms = None
                 
 
 
-    def predict(self, mat: np.ndarray) -> np.ndarray:
+    def partial_fit(self, batch: np.ndarray):
+        """
+        updates the centroids with one batch of samples, so the model can be fit on a stream of batches
+        that never has to be held in memory at once. the first batch picks the starting centroids and
+        must have at least `k` samples. each centroid moves towards the mean of its batch samples with a
+        learning rate of one over the number of samples it has absorbed so far. a model that was already
+        fit (with any algorithm) is refreshed from its fitted centroids, counting the samples of its clusters
+        as absorbed
+
+        inputs: 
+            batch: np.ndarray
+                A 2D matrix where the rows are observations and columns are features
+        """
+        if len(self.centroids) == 0:
+            if self.k>batch.shape[0]:
+                raise AttributeError("k must be less than the number of observations in the first batch")
+            self.m = batch.shape[1]
+            self.n_distance_evals_ = 0
+            self._dtype = compute_dtype(self.dtype, batch.dtype)
+            self._rng = np.random.default_rng(self.random_state)
+            self.centroids = self._init_centroids(batch)
+            self._absorbed = np.zeros(self.k, dtype=np.int64)
+        elif self._absorbed is None:
+            #a model fit on a full matrix carries on from the sizes of its fitted clusters
+            self._absorbed = np.array(self.counts_, dtype=np.int64)
+        
+        if not self.centroids.flags.writeable:
+            self.centroids = np.array(self.centroids) #a memory-mapped model is copied before it is updated
+        #the clusters and error describe the most recent batch
+        self._index = None
+        self.n = batch.shape[0]
+        self._minibatch_step(batch)
+
+    def predict(self, mat: np.ndarray, return_distances: bool = False) -> np.ndarray:
         """
         predicts the cluster labels for a provided 2D matrix
 
         inputs: 
             mat: np.ndarray
                 A 2D matrix where the rows are observations and columns are features
+            return_distances: bool
+                whether to also return the distance from each observation to its centroid
 
         outputs:
             np.ndarray
                 a 1D array with the cluster label for each of the observations in `mat`
+            np.ndarray
+                (only with `return_distances`) a 1D array with the distance of each observation to its centroid
         """
-        labels = [] #create an empty 1D array to fill
-        self.mat = mat
-        clusters = [[] for i in range(self.k)] #create a list of lists that represent empty clusters for now
-        for sample_idx, sample in enumerate(mat):
-            centroid_idx = self._closest_centroid(sample, self.centroids) #find the closest centroid for each sample
-            labels.append(centroid_idx) #append cluster label to 1D array
-        return np.array([labels])
+        if is_chunked(mat):
+            #predict chunk by chunk and join the results
+            results = [self._predict_chunk(chunk) for _, chunk in iter_chunks(mat, 1)]
+            labels = np.concatenate([result[0] for result in results])
+            distances = np.concatenate([result[1] for result in results])
+        else:
+            labels, distances = self._predict_chunk(mat)
+        if return_distances:
+            return labels[np.newaxis, :], distances[np.newaxis, :]
+        return labels[np.newaxis, :]
+
+    def predict_one(self, sample: np.ndarray) -> (int, float):
+        """
+        predicts the cluster label of a single observation with as little overhead as possible
+
+        inputs:
+            sample: np.ndarray
+                a 1D feature vector
+
+        outputs:
+            (int, float)
+                returns the cluster label of the observation
+                returns the distance of the observation to its centroid
+        """
+        if self.index is None or sparse.issparse(sample):
+            labels, distances = self._assign(self._as_row(sample), self.centroids)
+            self.n_predict_evals_ += self.k
+            return int(labels[0]), float(distances[0])
+        index = self._get_index()
+        self.n_predict_evals_ += index.evals_per_sample
+        return index.query_one(sample)
         
 
     def get_error(self) -> float:
@@ -123,58 +388,459 @@ class KMeans:
             float
                 the squared-mean error of the fit model
         """
-        errors = []
-        for i in range(0,len(self.clusters)): #i is the index of the centroid/cluster you want
-            for j in range(0,len(self.clusters[i])): #j is the index of each data point in the current cluster i
-                cur_cluster = self.clusters[i] #get the list of samples in the current cluster
-                cur_idx = cur_cluster[j] #get the index of the current data point since only indices are stored in self.clusters
-                sample = self.fit_mat[cur_idx] #get the feature vector of the current data point from the original matrix
-                
-                #calculate distance between sample and corresponding centroid
-                dist = cdist(np.array([sample]), np.array([self.centroids[i]]), self.metric)
-                errors.append(dist) #append to a list of errors
-                
-        #square the distances
-        squared_errors = [number ** 2 for number in errors]
-        #take mean of squared errors to get MSE
-        return np.mean(squared_errors)
+        #the error is accumulated by the assignment step, so the fit matrix isn't needed again
+        return self._error
         
         
     def get_centroids(self) -> np.ndarray:
         #you will call this within the fit method to get the centroids
         #assign the final centroids as an attribute of the class so that you can use it in the predict method
         """
-        returns the centroid locations of the fit model
+        returns the centroid locations of the fit model, computed from the latest assignment with the
+        `update` rule. medians and medoids need the fit samples, so after fitting they are the fitted centroids
 
         outputs:
             np.ndarray
                 a `k x m` 2D matrix representing the cluster centroids of the fit model
         """
-        centroids = [[] for i in range(self.k)]
-        #for each cluster index and each cluster, get the actual sample values in each cluster and find their mean to get the
-        #overall mean feature values for the centroid
-        for cluster_idx, cluster in enumerate(self.clusters):
-            mean = (np.array(self.fit_mat[cluster])).mean(axis=0)
-            centroids[cluster_idx] = mean
-        return centroids
+        if self._cluster_sums is None:
+            return self.centroids #a loaded model keeps only its centroids
+        rule = self._update_rule()
+        if rule in ("median", "medoid"):
+            if self._data is None or self.labels_ is None:
+                return self.centroids
+            if rule == "median":
+                centroids = cluster_medians(self._data, cluster_members(self.labels_, self.k), self.m)
+            else:
+                centroids = self._cluster_medoids()
+            return centroids.astype(self._dtype, copy=False)
+        #the summed feature vectors and sizes of the clusters are accumulated by the assignment step,
+        #so the mean of each cluster doesn't need another pass over the fit matrix
+        if rule == "spherical":
+            return spherical_means(self._cluster_sums, self.counts_).astype(self._dtype, copy=False)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (self._cluster_sums / self.counts_[:, np.newaxis]).astype(self._dtype, copy=False)
+
+    def save(self, path: str):
+        """
+        saves the fitted centroids and the model options to a single binary file. only the centroids,
+        the cluster sizes and a small JSON header are written, never the fit data or the labels
+
+        inputs:
+            path: str
+                the file to write
+        """
+        if len(self.centroids) == 0:
+            raise AttributeError("the model must be fit before it can be saved")
+        options = self._restart_params()
+        if not isinstance(options["init"], str):
+            options["init"] = "k-means++" #starting centroids aren't kept, the fitted ones are
+        options.update(
+            random_state=self.random_state if isinstance(self.random_state, int) else None,
+            n_init=self.n_init, index=self.index, dtype=None if self.dtype is None else np.dtype(self.dtype).str)
+        header = {
+            "options": options,
+            "error": None if self._error is None else float(self._error),
+            "n_iter": int(self.n_iter_),
+            "converged": bool(self.converged_),
+        }
+        arrays = {"centroids": np.asarray(self.centroids), "counts": np.asarray(self.counts_, dtype=np.int64)}
+        write_arrays(path, header, arrays)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        """
+        loads a model written by `save`, ready to `predict`
+
+        inputs:
+            path: str
+                the file to read
+            mmap: bool
+                memory-map the centroids read-only instead of reading them into memory. loading is then
+                nearly instant, and every process that loads the same file shares one copy of the centroids
+
+        outputs:
+            KMeans
+                the loaded model
+        """
+        header, arrays = read_arrays(path, mmap)
+        model = cls(**header["options"])
+        model.centroids = arrays["centroids"]
+        model.counts_ = np.array(arrays["counts"])
+        model.m = model.centroids.shape[1]
+        model.n = int(model.counts_.sum())
+        model._dtype = model.centroids.dtype
+        model._error = header["error"]
+        model.n_iter_ = header["n_iter"]
+        model.converged_ = header["converged"]
+        model._absorbed = model.counts_.copy() #so `partial_fit` carries on from the saved cluster sizes
+        return model
     
+    def _fit_restarts(self, mat):
+        """
+        fits the model `n_init` times from different seeds, serially or on a pool of workers, and keeps
+        the centroids of the fit with the lowest error
+        
+        input:
+            2D matrix where the rows are observations and columns are features
+        """
+        #derive one independent seed per restart so the restarts are reproducible from random_state
+        entropy = int(self._rng.integers(2**63))
+        seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(entropy).spawn(self.n_init)]
+        params = self._restart_params()
+        
+        executor = self.executor
+        if is_chunked(mat) and (executor is not None or resolve_n_jobs(self.n_jobs) != 1):
+            raise AttributeError("parallel restarts need a matrix or np.memmap, not chunked input")
+        if executor is None and resolve_n_jobs(self.n_jobs) == 1:
+            results = [_fit_restart(params, mat, seed) for seed in seeds]
+        else:
+            own_executor = executor is None
+            if own_executor:
+                executor = make_executor(self.n_jobs)
+            try:
+                with SharedArray(mat, executor) as shared:
+                    futures = [executor.submit(_fit_restart, params, shared.spec, seed) for seed in seeds]
+                    results = [future.result() for future in futures]
+            finally:
+                if own_executor:
+                    executor.shutdown()
+        
+        #keep the restart with the lowest error, taking the earliest one on ties
+        best = min(range(self.n_init), key=lambda i: results[i][1])
+        self.centroids = results[best][0]
+        self.n_distance_evals_ = sum(result[2] for result in results)
+        self.n_iter_, self.converged_, self.history_, self.medoid_indices_ = results[best][3:]
+        self._data = mat
+        try:
+            self._lloyd_pass(self.centroids)
+        finally:
+            self._data = None #like a single fit, don't keep the fit matrix or its row norms
+            self._norms = None
+
+    def _record(self, i, assign_time, update_time, error_time, error, shift, n_changed):
+        """
+        appends the telemetry of one iteration to `history_` and passes it to the callback
+        
+        inputs:
+            i
+                the index of the iteration
+            assign_time, update_time, error_time
+                seconds spent assigning samples, computing the new centroids and checking the error
+                (None for a phase that isn't timed separately)
+            error
+                the mean-squared error after the iteration
+            shift
+                the largest distance any centroid moved in the iteration (None in the first iteration)
+            n_changed
+                the number of samples that changed cluster (None when it isn't known)
+        """
+        record = {
+            "iteration": i + 1,
+            "assign_time": assign_time,
+            "update_time": update_time,
+            "error_time": error_time,
+            "error": float(error),
+            #sum of squared distances to the closest centroid (unknown while a first pass over chunks is counting samples)
+            "inertia": None if self.n is None else float(error) * self.n,
+            "shift": None if shift is None else float(shift),
+            "n_changed": n_changed,
+        }
+        self.history_.append(record)
+        if self.callback is not None:
+            self.callback(self, record)
+
+    def _centroid_shift(self, old_centroids, centroids):
+        """
+        gets the largest distance that any centroid moved
+        
+        inputs:
+            old_centroids
+                `k x m` matrix of the previous centroids
+            centroids
+                `k x m` matrix of the new centroids
+        output:
+            the largest shift (NaN if a cluster is empty)
+        """
+        old_centroids, centroids = np.asarray(old_centroids), np.asarray(centroids)
+        if self.metric in PAIRED_METRICS:
+            shift = paired_distances(old_centroids, centroids, self.metric)
+        else:
+            shift = np.array([cdist(old_centroids[i:i + 1], centroids[i:i + 1], self.metric)[0, 0] for i in range(self.k)])
+        return shift.max()
+
+    def _restart_params(self):
+        """
+        gets the constructor options for a single restart of this model
+        
+        output:
+            dictionary of keyword arguments for KMeans
+        """
+        return dict(
+            k=self.k, metric=self.metric, tol=self.tol, max_iter=self.max_iter,
+            working_memory=self.working_memory, algorithm=self.algorithm,
+            batch_size=self.batch_size, init=self.init, dtype=self.dtype, update=self.update,
+            medoid_candidates=self.medoid_candidates)
+
+    def _get_index(self):
+        """
+        gets the search structure over the current centroids, building it the first time it is needed
+        
+        output:
+            CentroidIndex over the centroids
+        """
+        if self._index is None:
+            self._index = CentroidIndex(self.centroids, self.metric, self.index, self.working_memory)
+        return self._index
+
+    def _init_centroids(self, mat):
+        """
+        picks the starting centroids according to the `init` option
+        
+        input:
+            2D matrix where the rows are observations and columns are features
+        output:
+            `k x m` matrix of starting centroids
+        """
+        if not isinstance(self.init, str):
+            if self.init.shape[1] != self.m:
+                raise AttributeError("init centroids must have the same number of features as the fit matrix")
+            return self.init.astype(self._dtype)
+        if is_chunked(mat):
+            #seed from a random sample of the chunks, as the seeding methods need random access to the samples
+            mat = self._seed_sample(mat)
+        if self.init == "random":
+            centroids = random_init(mat, self.k, self._rng)
+        elif self.init == "k-means++":
+            centroids = kmeans_plusplus(mat, self.k, self._rng, self.metric, self.working_memory)
+        else:
+            centroids = kmeans_parallel(mat, self.k, self._rng, self.metric, self.working_memory)
+        return centroids.astype(self._dtype, copy=False)
+
     def _create_clusters(self, centroids):
         """
-        assigns all samples in the input matrix to the closest centroids
+        assigns all samples in the input matrix to the closest centroids, updating `labels_` and `counts_`
         
         input:
             mean feature vectors defining the centroids
+        """
+        centroids = np.asarray(centroids)
+        if self.algorithm in ("lloyd", "minibatch"):
+            self._lloyd_pass(centroids) #assign, sum and count in a single pass over the data
+            return
+        if self._bounds is None:
+            self._init_bounds(centroids) #the first assignment computes every distance to set up the bounds
+        elif self.algorithm == "elkan":
+            self._elkan_step(centroids)
+        else:
+            self._hamerly_step(centroids)
+        self._cluster_stats(centroids)
+
+    def _lloyd_pass(self, centroids):
+        """
+        streams through the fit data one chunk at a time, assigning each sample to its closest centroid
+        while accumulating the summed feature vectors, sizes and squared errors of the clusters
+        
+        input:
+            `k x m` matrix of centroids (chunked input keeps no per-sample labels, so `labels_` is left as None)
+        """
+        chunked = is_chunked(self._data)
+        sums = np.zeros((self.k, self.m))
+        sizes = np.zeros(self.k, dtype=np.int64)
+        squared = 0.0
+        labels = None if chunked else np.empty(self.n, dtype=np.int32)
+        
+        n = 0
+        for start, chunk in iter_chunks(self._data, chunk_rows(self.k, self.working_memory)):
+            chunk = self._as_compute(chunk)
+            norms = None if self._norms is None else self._norms[start:start + chunk.shape[0]]
+            chunk_labels, distances = self._assign(chunk, centroids, norms)
+            #scatter-add each sample onto its cluster in float64, however large the chunk
+            sums += self._center_sums(chunk, chunk_labels, norms)
+            sizes += np.bincount(chunk_labels, minlength=self.k)
+            squared += np.dot(distances, distances)
+            if labels is not None:
+                labels[start:start + chunk.shape[0]] = chunk_labels
+            n += chunk.shape[0]
+        
+        if chunked:
+            if self.k>n:
+                raise AttributeError("k must be less than the number of observations")
+            self.n = n
+        self.n_distance_evals_ += n * self.k
+        self.labels_ = labels
+        self._cluster_sums, self.counts_, self._error = sums, sizes, squared / n
+
+    def _center_sums(self, chunk, chunk_labels, norms=None):
+        """
+        sums the samples of every cluster in float64. the spherical update averages directions, so its
+        samples are scaled to unit length before they are summed
+
+        input:
+            chunk
+                2D matrix of samples
+            chunk_labels
+                1D array with the cluster of every sample
+            norms
+                1D array of the squared row norms of the chunk, if already known
         output:
-            list of lists containing indices of data samples sorted into which cluster they belong to
+            `k x m` matrix of summed feature vectors
         """
-        clusters = [[] for i in range(self.k)] #create a list of lists that represent empty clusters for now
-        for idx,sample in enumerate(self.fit_mat):
-            centroid_idx = self._closest_centroid(sample, centroids) #find the closest centroid for each sample
-            clusters[centroid_idx].append(idx) #append current sample index to the cluster with the centroid it is closest to
-        return clusters
+        if self._update_rule() == "spherical":
+            chunk = unit_rows(chunk, norms)
+        return cluster_sums(chunk, chunk_labels, self.k)
+
+    def _cluster_stats(self, centroids):
+        """
+        accumulates the summed feature vectors, sizes and squared errors of the clusters from the current
+        labels, streaming through the fit matrix one chunk at a time
+        
+        input:
+            `k x m` matrix of centroids
+        """
+        sums = np.zeros((self.k, self.m))
+        squared = 0.0
+        for start, chunk in iter_chunks(self._data, chunk_rows(self.m, self.working_memory)):
+            chunk = self._as_compute(chunk)
+            chunk_labels = self.labels_[start:start + chunk.shape[0]]
+            norms = None if self._norms is None else self._norms[start:start + chunk.shape[0]]
+            sums += self._center_sums(chunk, chunk_labels, norms)
+            #only the distance of each sample to its own centroid is needed
+            distances = paired_distances(chunk, centroids[chunk_labels], self.metric, self.working_memory)
+            squared += np.dot(distances, distances)
+        self.n_distance_evals_ += self.n
+        self._cluster_sums = sums
+        self.counts_ = np.bincount(self.labels_, minlength=self.k)
+        self._error = squared / self.n
+
+    def _relocate_empty(self, centroids):
+        """
+        moves the centroids of empty clusters, whose means are undefined, onto the samples that are
+        farthest from their closest centroid, so every cluster gets samples again in the next assignment
+        
+        input:
+            `k x m` matrix of cluster means (NaN for the empty clusters)
+        output:
+            `k x m` matrix of centroids without NaN rows
+        """
+        empty = np.flatnonzero(self.counts_ == 0)
+        if len(empty) == 0:
+            return centroids
+        kept = np.flatnonzero(self.counts_ > 0)
+        distances = np.concatenate([
+            self._assign(self._as_compute(chunk), centroids[kept])[1]
+            for _, chunk in iter_chunks(self._data, chunk_rows(len(kept), self.working_memory))])
+        self.n_distance_evals_ += len(distances) * len(kept)
+        
+        #the farthest sample goes to the first empty cluster, the next farthest to the second and so on
+        far = np.argpartition(distances, -len(empty))[-len(empty):]
+        far = far[np.argsort(-distances[far], kind="stable")]
+        order = np.argsort(far)
+        centroids[empty[order]] = to_dense(take_rows(self._data, far[order]))
+        if self.medoid_indices_ is not None:
+            self.medoid_indices_[empty[order]] = far[order] #the new centroids are samples, so they are medoids too
+        return centroids
+
+    def _update_rule(self):
+        """
+        gets the center update rule that the fit uses
+        
+        output:
+            "mean", "median", "spherical" or "medoid"
+        """
+        rule = resolve_update(self.update, self.metric)
+        if (self.algorithm == "minibatch" or self._chunked) and rule in ("median", "medoid"):
+            return "mean" #batches and chunks only move centroids towards running means
+        return rule
+
+    def _cluster_medoids(self):
+        """
+        finds the medoid of every cluster of the current labels. each cluster tries a random sample of
+        `medoid_candidates` of its samples plus its current medoid, and the summed distances of every
+        candidate to the whole cluster are computed block by block. clusters whose samples haven't changed
+        since their medoid was found keep it without computing any distances
+        
+        output:
+            `k x m` matrix of medoids (NaN for empty clusters)
+        """
+        members = cluster_members(self.labels_, self.k)
+        if self.medoid_indices_ is None or self._medoid_labels is None:
+            self.medoid_indices_ = np.full(self.k, -1, dtype=np.int64)
+            stale = np.ones(self.k, dtype=bool)
+        else:
+            #a cluster is stale when a sample moved into or out of it
+            changed = np.flatnonzero(self._medoid_labels != self.labels_)
+            stale = self.medoid_indices_ < 0
+            stale[self.labels_[changed]] = True
+            stale[self._medoid_labels[changed]] = True
+        
+        for label in np.flatnonzero(stale):
+            idx = members[label]
+            if len(idx) == 0:
+                self.medoid_indices_[label] = -1
+                continue
+            candidates = idx
+            if len(idx) > self.medoid_candidates:
+                candidates = self._rng.choice(idx, self.medoid_candidates, replace=False)
+                current = self.medoid_indices_[label]
+                if current >= 0 and self.labels_[current] == label:
+                    candidates = np.append(candidates, current) #so the summed distance never goes up
+                candidates = np.unique(candidates)
+            self.medoid_indices_[label], evals = medoid(self._data, idx, candidates, self.metric, self.working_memory)
+            self.n_distance_evals_ += evals
+        self._medoid_labels = self.labels_.copy()
+        
+        medoids = np.full((self.k, self.m), np.nan)
+        found = np.flatnonzero(self.medoid_indices_ >= 0)
+        medoids[found] = to_dense(take_rows(self._data, self.medoid_indices_[found]))
+        return medoids
+
+    def _seed_sample(self, data):
+        """
+        draws a uniform random sample of chunked input to seed from, in one pass over the chunks. every
+        sample gets a random key and the samples with the smallest keys are kept (a reservoir sample), so
+        data that is ordered on disk, e.g. sorted by cluster, is still seeded from all of its clusters
+        
+        input:
+            re-iterable of 2D chunks of rows
+        output:
+            2D matrix of `max(k, batch_size)` random samples (or all of them, if there are fewer)
+        """
+        size = max(self.k, self.batch_size)
+        sample = None
+        keys = np.empty(0)
+        for _, chunk in iter_chunks(data, 1):
+            chunk_keys = self._rng.random(chunk.shape[0])
+            if len(keys) == size:
+                #only samples that beat the largest kept key can enter the reservoir
+                enter = np.flatnonzero(chunk_keys < keys.max())
+                chunk, chunk_keys = chunk[enter], chunk_keys[enter]
+            chunk = np.asarray(to_dense(chunk), dtype=self._dtype)
+            sample = chunk if sample is None else np.concatenate([sample, chunk])
+            keys = np.concatenate([keys, chunk_keys])
+            if len(keys) > size:
+                keep = np.sort(np.argpartition(keys, size - 1)[:size])
+                sample, keys = sample[keep], keys[keep]
+        if len(keys) < self.k:
+            raise AttributeError("k must be less than the number of observations")
+        return sample
+
+    def _predict_chunk(self, mat):
+        """
+        finds the closest centroid for every sample of one matrix, through the index if there is one
+        
+        input:
+            2D matrix where the rows are observations and columns are features
+        output:
+            1D array of closest centroid indices and 1D array of the distances to those centroids
+        """
+        if self.index is None or sparse.issparse(mat):
+            self.n_predict_evals_ += mat.shape[0] * self.k
+            return self._assign(mat, self.centroids) #find the closest centroid for every sample at once
+        index = self._get_index()
+        self.n_predict_evals_ += mat.shape[0] * index.evals_per_sample
+        return index.query(mat)
 
-    
-    
     def _closest_centroid(self, sample, centroids):
         """
         gets the index of the centroid that is closest to the input data point
@@ -184,15 +850,318 @@ class KMeans:
                 input data point in m dimensions
             centroids
                 list of mean feature vectors representing each centroid
-            metric:string
-                distance metric used to calculate distances between sample and centroids
         output:
             index of centroid closest to sample
         """
-        #convert centroids to an array
-        #calculate the distance between the current sample (i.e. row of the input matrix) and each centroid, and take the min
-        distances = []
-        for i in range(0,len(centroids)):
-            distances.append(cdist(np.array([sample]), np.array([centroids[i]]), self.metric))
-        centroid_idx = np.argmin(distances) #get index of minimum distance--corresponds to closest centroid
-        return centroid_idx
\ No newline at end of file
+        labels, _ = self._assign(self._as_row(sample), centroids)
+        return labels[0]
+
+    def _assign(self, mat, centroids, norms=None):
+        """
+        assigns all samples in a matrix to their closest centroids in bounded-memory chunks
+        
+        inputs:
+            mat
+                2D matrix where the rows are observations and columns are features
+            centroids
+                mean feature vectors defining the centroids
+            norms
+                optional squared row norms of a sparse `mat`
+        output:
+            1D array of closest centroid indices and 1D array of the distances to those centroids
+        """
+        return assign(mat, np.asarray(centroids), self.metric, self.working_memory, norms)
+
+    def _as_compute(self, mat):
+        """
+        converts a matrix or chunk to the compute dtype, without a copy when it already has that dtype.
+        sparse matrices stay sparse (in CSR format, so rows can be sliced)
+        
+        input:
+            2D matrix where the rows are observations and columns are features
+        output:
+            the matrix in the compute dtype
+        """
+        if sparse.issparse(mat):
+            return mat.tocsr().astype(self._dtype, copy=False)
+        return np.asarray(mat, dtype=self._dtype)
+
+    def _as_row(self, sample):
+        """
+        turns a single observation into a one-row matrix
+        
+        input:
+            1D feature vector (or a one-row sparse matrix)
+        output:
+            `1 x m` matrix
+        """
+        return sample if sparse.issparse(sample) else np.atleast_2d(sample)
+
+
+    def _full_distances(self, rows, centroids):
+        """
+        yields chunks of the full distance matrix between some samples of the fit matrix and all centroids
+        
+        inputs:
+            rows
+                1D array of sample indices into the fit matrix
+            centroids
+                `k x m` matrix of centroids
+        output:
+            (start, stop, distances) for each chunk, where `distances` covers rows[start:stop]
+        """
+        step = chunk_rows(self.k, self.working_memory)
+        for start in range(0, len(rows), step):
+            stop = min(start + step, len(rows))
+            self.n_distance_evals_ += (stop - start) * self.k
+            yield start, stop, pairwise(self._rows(rows[start:stop]), centroids, self.metric)
+
+    def _rows(self, rows):
+        """
+        gathers some samples of the fit matrix in the compute dtype
+        
+        input:
+            1D array of sample indices into the fit matrix
+        output:
+            2D matrix of the samples
+        """
+        return np.asarray(self._data[rows], dtype=self._dtype)
+
+    def _init_bounds(self, centroids):
+        """
+        assigns every sample with the full distance matrix and sets up the bounds for elkan or hamerly
+        
+        input:
+            `k x m` matrix of centroids
+        """
+        n, k = self.n, self.k
+        labels = np.empty(n, dtype=np.int32)
+        upper = np.empty(n) #distance from each sample to its own centroid
+        #elkan keeps a lower bound on the distance to every centroid, hamerly only to the second closest one
+        lower = np.empty((n, k)) if self.algorithm == "elkan" else np.full(n, np.inf)
+        
+        for start, stop, dist in self._full_distances(np.arange(n), centroids):
+            idx = np.argmin(dist, axis=1)
+            rows = np.arange(stop - start)
+            labels[start:stop] = idx
+            upper[start:stop] = dist[rows, idx]
+            if self.algorithm == "elkan":
+                lower[start:stop] = dist
+            elif k > 1:
+                lower[start:stop] = np.partition(dist, 1, axis=1)[:, 1]
+        
+        self.labels_ = labels
+        self._bounds = (upper, lower, centroids)
+
+    def _centroid_moves(self, centroids):
+        """
+        calculates how far every centroid moved and half the distance from each centroid to its closest neighbour
+        
+        input:
+            `k x m` matrix of the new centroids
+        output:
+            1D array of centroid shifts, `k x k` matrix of centroid-to-centroid distances and 1D array of half
+            the distance from each centroid to its closest other centroid
+        """
+        old_centroids = self._bounds[2]
+        shift = paired_distances(old_centroids, centroids, self.metric)
+        between = cdist(centroids, centroids, self.metric)
+        self.n_distance_evals_ += self.k + self.k * self.k
+        np.fill_diagonal(between, np.inf)
+        half_closest = 0.5 * between.min(axis=1)
+        return shift, between, half_closest
+
+    def _elkan_step(self, centroids):
+        """
+        reassigns samples to the new centroids using elkan's bounds, skipping every distance that the
+        triangle inequality shows can't change a sample's label
+        
+        input:
+            `k x m` matrix of the new centroids
+        """
+        upper, lower, _ = self._bounds
+        labels = self.labels_
+        shift, between, half_closest = self._centroid_moves(centroids)
+        
+        #move the bounds by how far the centroids moved
+        upper += shift[labels]
+        lower -= shift
+        np.maximum(lower, 0, out=lower)
+        
+        #samples closer to their centroid than half the distance to any other centroid keep their label
+        cand = np.flatnonzero(upper >= half_closest[labels])
+        if len(cand) > 0:
+            own = labels[cand]
+            #tighten the upper bound to the exact distance to the current centroid
+            exact = paired_distances(self._rows(cand), centroids[own], self.metric, self.working_memory)
+            self.n_distance_evals_ += len(cand)
+            upper[cand] = exact
+            lower[cand, own] = exact
+            
+            #only centroids that could be at least as close as the current one need a distance
+            need = (exact[:, np.newaxis] >= lower[cand]) & (exact[:, np.newaxis] >= 0.5 * between[own])
+            need[np.arange(len(cand)), own] = False
+            rows, cols = np.nonzero(need)
+            dist = paired_distances(self._rows(cand[rows]), centroids[cols], self.metric, self.working_memory)
+            self.n_distance_evals_ += len(rows)
+            lower[cand[rows], cols] = dist
+            
+            #pick the closest centroid among the computed distances, breaking ties by lowest index like lloyd
+            known = np.full((len(cand), self.k), np.inf)
+            known[rows, cols] = dist
+            known[np.arange(len(cand)), own] = exact
+            idx = np.argmin(known, axis=1)
+            labels[cand] = idx
+            upper[cand] = known[np.arange(len(cand)), idx]
+        
+        self._bounds = (upper, lower, centroids)
+
+    def _hamerly_step(self, centroids):
+        """
+        reassigns samples to the new centroids using hamerly's bounds, which keep a single lower bound
+        on the distance from each sample to its second closest centroid
+        
+        input:
+            `k x m` matrix of the new centroids
+        """
+        upper, lower, _ = self._bounds
+        labels = self.labels_
+        shift, _, half_closest = self._centroid_moves(centroids)
+        
+        #move the bounds by how far the centroids moved; the lower bound drops by the largest shift of
+        #any other centroid, which is the second largest shift for samples of the centroid that moved the most
+        upper += shift[labels]
+        order = np.argsort(shift)
+        largest = shift[order[-1]]
+        second = shift[order[-2]] if self.k > 1 else 0
+        lower -= np.where(labels == order[-1], second, largest)
+        
+        #samples whose upper bound is below both thresholds keep their label
+        threshold = np.maximum(lower, half_closest[labels])
+        cand = np.flatnonzero(upper >= threshold)
+        if len(cand) > 0:
+            #tighten the upper bound to the exact distance to the current centroid and check again
+            exact = paired_distances(self._rows(cand), centroids[labels[cand]], self.metric, self.working_memory)
+            self.n_distance_evals_ += len(cand)
+            upper[cand] = exact
+            cand = cand[exact >= threshold[cand]]
+        
+        #the remaining samples get a full row of distances
+        for start, stop, dist in self._full_distances(cand, centroids):
+            idx = np.argmin(dist, axis=1)
+            rows = cand[start:stop]
+            labels[rows] = idx
+            upper[rows] = dist[np.arange(stop - start), idx]
+            if self.k > 1:
+                lower[rows] = np.partition(dist, 1, axis=1)[:, 1]
+        
+        self._bounds = (upper, lower, centroids)
+
+    def _fit_minibatch(self, mat):
+        """
+        fits the centroids from random batches of the fit matrix until the smoothed batch error stops
+        improving for `MINIBATCH_PATIENCE` batches. chunked input is passed over whole, one chunk per
+        batch, until a pass lowers the error by less than `MINIBATCH_PASS_TOL` of it (or `tol`)
+        
+        input:
+            2D matrix where the rows are observations and columns are features
+        """
+        self.centroids = np.array(self.centroids, dtype=self._dtype)
+        self._absorbed = np.zeros(self.k, dtype=np.int64)
+        
+        last_mse = None
+        best_mse, stale = np.inf, 0
+        chunked = is_chunked(mat)
+        if not chunked:
+            batch_size = min(self.batch_size, self.n)
+            alpha = min(1.0, 2 * batch_size / (self.n + 1)) #weight of each new batch in the smoothed error
+        for i in range(0,self.max_iter):
+            self.n_iter_ = i + 1
+            previous = self.centroids.copy()
+            tic = time.perf_counter()
+            if chunked:
+                #each iteration is one pass over the chunks, with every chunk used as a batch
+                errors = [self._minibatch_step(chunk) for _, chunk in iter_chunks(mat, self.batch_size)]
+                cur_mse = np.mean(errors)
+            else:
+                batch_idx = np.sort(self._rng.choice(self.n, batch_size, replace=False))
+                batch_mse = self._minibatch_step(mat[batch_idx])
+                #smooth the noisy batch errors before checking for convergence
+                cur_mse = batch_mse if last_mse is None else (1 - alpha) * last_mse + alpha * batch_mse
+            step_time = time.perf_counter() - tic
+            
+            if chunked:
+                #a pass sees every sample, so its error isn't noisy: stop once a pass barely lowers it
+                self.converged_ = last_mse is not None and last_mse - cur_mse <= max(self.tol, MINIBATCH_PASS_TOL * cur_mse)
+            else:
+                #batch errors stay noisy even when smoothed, so stop once they stop reaching new lows
+                if cur_mse < best_mse:
+                    best_mse, stale = cur_mse, 0
+                else:
+                    stale += 1
+                self.converged_ = stale >= MINIBATCH_PATIENCE
+            #each step assigns and updates together, so only the step as a whole is timed
+            self._record(i, step_time, None, None, cur_mse, self._centroid_shift(previous, self.centroids), None)
+            if self.converged_:
+                break
+            last_mse = cur_mse
+        
+        #assign the full data to the final centroids
+        self._create_clusters(self.centroids)
+
+    def _minibatch_step(self, batch):
+        """
+        assigns a batch to the current centroids and moves each centroid to the running mean of all
+        the samples it has absorbed
+        
+        input:
+            2D matrix holding one batch of samples
+        output:
+            mean-squared error of the batch against the centroids it was assigned with
+        """
+        batch = self._as_compute(batch)
+        labels, distances = self._assign(batch, self.centroids)
+        self.n_distance_evals_ += batch.shape[0] * self.k
+        self.labels_ = labels
+        
+        batch_counts = np.bincount(labels, minlength=self.k)
+        sums = self._center_sums(batch, labels)
+        self._absorbed += batch_counts
+        self._cluster_sums, self.counts_ = sums, batch_counts
+        self._error = np.mean(distances ** 2)
+        
+        #a learning rate of 1/count for every sample turns each centroid into the running mean of its samples.
+        #the step is worked out in float64 (from the float64 sums) and only rounded when stored
+        moved = batch_counts > 0
+        self.centroids[moved] += (sums[moved] - batch_counts[moved, np.newaxis] * self.centroids[moved]) / self._absorbed[moved, np.newaxis]
+        if self._update_rule() == "spherical":
+            self.centroids[moved] = spherical_means(self.centroids[moved], batch_counts[moved])
+        return self._error
+
+
+def _fit_restart(params, mat, seed):
+    """
+    runs one restart of a multi-restart fit; module level so process pools can pickle it
+    
+    inputs:
+        params
+            dictionary of keyword arguments for KMeans
+        mat
+            the fit matrix, or the spec of a `SharedArray` holding it
+        seed
+            the random_state of this restart
+    output:
+        tuple of the fitted centroids, their error, the number of distances computed, the number of iterations,
+        whether the restart converged, its per-iteration history and its medoid indices (or None)
+    """
+    shm, mat = attach(mat)
+    try:
+        model = KMeans(random_state=seed, **params)
+        model.fit(mat)
+        result = (np.array(model.centroids), model.get_error(), model.n_distance_evals_,
+                  model.n_iter_, model.converged_, model.history_, model.medoid_indices_)
+        del model, mat #drop every view of the shared block before closing it
+    finally:
+        if shm is not None:
+            shm.close()
+    return result
@@ -0,0 +1,134 @@
+import os
+import mmap
+import tempfile
+import numpy as np
+from scipy import sparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def resolve_n_jobs(n_jobs: int) -> int:
+    """
+    turns an `n_jobs` option into a number of workers
+
+    inputs:
+        n_jobs: int
+            None or 1 for serial work, a positive number of workers, or -1 for one worker per cpu
+
+    outputs:
+        int
+            the number of workers to use
+    """
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    if n_jobs == 0:
+        raise AttributeError("n_jobs must be a positive integer, -1 or None")
+    return n_jobs
+
+
+def make_executor(n_jobs: int, backend: str = "processes"):
+    """
+    creates a pool of workers for an `n_jobs` option
+
+    inputs:
+        n_jobs: int
+            the number of workers, see `resolve_n_jobs`
+        backend: str
+            "processes" for a process pool or "threads" for a thread pool
+
+    outputs:
+        concurrent.futures.Executor
+            the pool, which the caller shuts down
+    """
+    if backend == "threads":
+        return ThreadPoolExecutor(max_workers=resolve_n_jobs(n_jobs))
+    if backend == "processes":
+        return ProcessPoolExecutor(max_workers=resolve_n_jobs(n_jobs))
+    raise AttributeError("backend must be 'processes' or 'threads'")
+
+
+class SharedArray:
+    """
+    copies an array into shared memory once so process workers can map it without pickling it.
+    a thread pool shares the address space already, so there the array is passed through untouched,
+    and a file-backed `np.memmap` is reopened from its file by each worker instead of being copied
+
+    before python 3.8, which has no `multiprocessing.shared_memory`, the array is copied into a temporary
+    file that the workers memory-map instead
+
+    use as a context manager; the shared block (or temporary file) is released on exit
+    """
+    def __init__(self, arr: np.ndarray, executor=None):
+        """
+        inputs:
+            arr: np.ndarray
+                the array to share
+            executor: concurrent.futures.Executor
+                the pool the array is shared with
+        """
+        self._shm = None
+        self._path = None
+        if isinstance(executor, ThreadPoolExecutor):
+            self.spec = arr
+            return
+        if sparse.issparse(arr):
+            raise AttributeError("sparse matrices can only be shared with a thread pool")
+        if isinstance(arr, np.memmap) and isinstance(arr.base, mmap.mmap) and arr.flags.c_contiguous:
+            #only a whole mapping (not a slice of one) starts at the memmap's recorded offset
+            self.spec = ("memmap", arr.filename, arr.offset, arr.shape, arr.dtype.str)
+            return
+        arr = np.ascontiguousarray(arr)
+        try:
+            from multiprocessing import shared_memory #only available from python 3.8
+        except ImportError:
+            shared_memory = None
+        if shared_memory is None:
+            fd, self._path = tempfile.mkstemp(suffix=".dat")
+            os.close(fd)
+            mapped = np.memmap(self._path, dtype=arr.dtype, mode="w+", shape=arr.shape)
+            mapped[...] = arr
+            mapped.flush()
+            del mapped
+            self.spec = ("memmap", self._path, 0, arr.shape, arr.dtype.str)
+            return
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=self._shm.buf)[...] = arr
+        self.spec = (self._shm.name, arr.shape, arr.dtype.str) #picklable description of the block
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+        if self._path is not None:
+            os.remove(self._path)
+            self._path = None
+
+
+def attach(spec):
+    """
+    maps an array shared by `SharedArray` inside a worker
+
+    inputs:
+        spec
+            the `spec` attribute of a `SharedArray`
+
+    outputs:
+        (object, np.ndarray)
+            returns a handle to close once the array is no longer used (None if nothing needs closing)
+            returns the shared array
+    """
+    if not isinstance(spec, tuple):
+        return None, spec #passed through to a thread pool as it is
+    if spec[0] == "memmap":
+        _, filename, offset, shape, dtype = spec
+        return None, np.memmap(filename, dtype=np.dtype(dtype), mode="r", offset=offset, shape=shape)
+    from multiprocessing import shared_memory
+
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
@@ -0,0 +1,96 @@
+import json
+import struct
+import numpy as np
+
+#the first bytes of every saved model: a name and the format version
+MAGIC = b"KMEANS\x00\x01"
+#raw arrays start on multiples of this many bytes, so memory-mapped arrays are aligned
+ALIGNMENT = 64
+
+
+def write_arrays(path: str, header: dict, arrays: dict):
+    """
+    writes a JSON header and some raw arrays into a single file
+
+    the file holds the magic bytes, the length of the header as a little-endian uint64, the JSON header
+    and then each array's raw bytes in C order, starting at an aligned offset. the header records the
+    dtype, shape and offset of every array so they can be memory-mapped without parsing anything else
+
+    inputs:
+        path: str
+            the file to write
+        header: dict
+            JSON-serializable metadata
+        arrays: dict
+            the arrays to store, by name
+    """
+    arrays = {name: np.ascontiguousarray(arr) for name, arr in arrays.items()}
+    layout = {name: {"dtype": arr.dtype.str, "shape": list(arr.shape)} for name, arr in arrays.items()}
+
+    #the offsets depend on the header length and the header holds the offsets, so lay the arrays out
+    #after a header that is padded to an aligned length
+    prefix = len(MAGIC) + 8
+    offsets_fit = False
+    start = 0
+    while not offsets_fit:
+        offset = start
+        for name, arr in arrays.items():
+            layout[name]["offset"] = offset
+            offset = _align(offset + arr.nbytes)
+        encoded = json.dumps({"header": header, "arrays": layout}).encode("utf-8")
+        offsets_fit = prefix + len(encoded) <= start
+        start = _align(prefix + len(encoded))
+    encoded = encoded.ljust(start - prefix) #pad with spaces up to the first array
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(encoded)))
+        f.write(encoded)
+        for name, arr in arrays.items():
+            f.seek(layout[name]["offset"])
+            f.write(arr.tobytes())
+
+
+def read_arrays(path: str, mmap: bool = True) -> (dict, dict):
+    """
+    reads a file written by `write_arrays`
+
+    inputs:
+        path: str
+            the file to read
+        mmap: bool
+            memory-map the arrays read-only instead of reading them into memory, so processes that load
+            the same file share one copy through the page cache
+
+    outputs:
+        (dict, dict)
+            returns the JSON header
+            returns the arrays by name
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise AttributeError(str(path) + " is not a saved model")
+        (length,) = struct.unpack("<Q", f.read(8))
+        contents = json.loads(f.read(length).decode("utf-8"))
+
+        arrays = {}
+        for name, spec in contents["arrays"].items():
+            dtype, shape = np.dtype(spec["dtype"]), tuple(spec["shape"])
+            if mmap and int(np.prod(shape)) > 0:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=spec["offset"], shape=shape)
+            else:
+                f.seek(spec["offset"])
+                arrays[name] = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+    return contents["header"], arrays
+
+
+def _align(offset: int) -> int:
+    """
+    rounds an offset up to the next multiple of `ALIGNMENT`
+
+    input:
+        an offset in bytes
+    output:
+        the aligned offset
+    """
+    return -(-offset // ALIGNMENT) * ALIGNMENT
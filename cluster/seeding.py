@@ -0,0 +1,155 @@
+import numpy as np
+from scipy import sparse
+from .distance import assign, compute_dtype, row_norms
+from .chunks import to_dense
+
+
+def random_init(
+        mat: np.ndarray,
+        k: int,
+        rng: np.random.Generator) -> np.ndarray:
+    """
+    picks `k` distinct random samples as the starting centroids
+
+    inputs:
+        mat: np.ndarray
+            A 2D matrix where the rows are observations and columns are features
+        k: int
+            the number of centroids to pick
+        rng: np.random.Generator
+            the random number generator to draw from
+
+    outputs:
+        np.ndarray
+            a `k x m` 2D matrix of starting centroids
+    """
+    rand_idx = rng.choice(mat.shape[0], k, replace=False)
+    return np.array(to_dense(mat[np.sort(rand_idx)]), dtype=compute_dtype(data_dtype=mat.dtype))
+
+
+def kmeans_plusplus(
+        mat: np.ndarray,
+        k: int,
+        rng: np.random.Generator,
+        metric: str = "euclidean",
+        working_memory: float = 64,
+        weights: np.ndarray = None,
+        centers: np.ndarray = None) -> np.ndarray:
+    """
+    picks the starting centroids with k-means++ seeding. the first centroid is a random sample and every
+    following centroid is a sample drawn with probability proportional to its squared distance from the
+    closest centroid picked so far, which spreads the centroids over the data. given existing `centers`,
+    the seeding carries on from them instead, which warm-starts a fit with more clusters
+
+    inputs:
+        mat: np.ndarray
+            A 2D matrix where the rows are observations and columns are features
+        k: int
+            the number of centroids to pick
+        rng: np.random.Generator
+            the random number generator to draw from
+        metric: str
+            the name of the distance metric to use
+        working_memory: float
+            the maximum size (in megabytes) of each block of distances
+        weights: np.ndarray
+            an optional 1D array of sample weights that scale the drawing probabilities
+        centers: np.ndarray
+            an optional matrix of fewer than `k` centroids that are kept as the first centroids
+
+    outputs:
+        np.ndarray
+            a `k x m` 2D matrix of starting centroids
+    """
+    n = mat.shape[0]
+    weights = np.ones(n) if weights is None else np.asarray(weights, dtype=np.float64)
+    centroids = np.empty((k, mat.shape[1]), dtype=compute_dtype(data_dtype=mat.dtype))
+    norms = row_norms(mat) if sparse.issparse(mat) else None #computed once for every pass over sparse data
+
+    if centers is None or len(centers) == 0:
+        idx = rng.choice(n, p=weights / weights.sum())
+        centroids[0] = to_dense(mat[idx:idx + 1])
+        first = 1
+    else:
+        first = len(centers)
+        centroids[:first] = centers
+    _, closest = assign(mat, centroids[:first], metric, working_memory, norms)
+    closest = closest ** 2 #squared distance from each sample to its closest centroid so far
+
+    for i in range(first, k):
+        prob = weights * closest
+        total = prob.sum()
+        if total > 0:
+            idx = rng.choice(n, p=prob / total)
+        else:
+            #every sample sits on a centroid already, so fall back to a uniform draw
+            idx = rng.choice(n, p=weights / weights.sum())
+        centroids[i] = to_dense(mat[idx:idx + 1])
+        _, dist = assign(mat, centroids[i:i + 1], metric, working_memory, norms)
+        np.minimum(closest, dist ** 2, out=closest)
+    return centroids
+
+
+def kmeans_parallel(
+        mat: np.ndarray,
+        k: int,
+        rng: np.random.Generator,
+        metric: str = "euclidean",
+        working_memory: float = 64,
+        oversampling: float = 2,
+        n_rounds: int = 5) -> np.ndarray:
+    """
+    picks the starting centroids with k-means|| seeding, which suits large `n` because it only makes a
+    few passes over the data. each round samples every point independently with probability proportional
+    to its squared distance from the current candidates, and the candidates are then reduced to `k`
+    centroids by running weighted k-means++ on them
+
+    inputs:
+        mat: np.ndarray
+            A 2D matrix where the rows are observations and columns are features
+        k: int
+            the number of centroids to pick
+        rng: np.random.Generator
+            the random number generator to draw from
+        metric: str
+            the name of the distance metric to use
+        working_memory: float
+            the maximum size (in megabytes) of each block of distances
+        oversampling: float
+            the expected number of candidates drawn per round, as a multiple of `k`
+        n_rounds: int
+            the number of sampling rounds
+
+    outputs:
+        np.ndarray
+            a `k x m` 2D matrix of starting centroids
+    """
+    n = mat.shape[0]
+    norms = row_norms(mat) if sparse.issparse(mat) else None
+    chosen = np.zeros(n, dtype=bool)
+    chosen[rng.integers(n)] = True
+    _, closest = assign(mat, to_dense(mat[np.flatnonzero(chosen)]), metric, working_memory, norms)
+    closest = closest ** 2
+
+    for _ in range(n_rounds):
+        cost = closest.sum()
+        if cost == 0:
+            break
+        #sample every point independently, favouring points far from the current candidates
+        new = (rng.random(n) < oversampling * k * closest / cost) & ~chosen
+        if not new.any():
+            continue
+        chosen |= new
+        _, dist = assign(mat, to_dense(mat[np.flatnonzero(new)]), metric, working_memory, norms)
+        np.minimum(closest, dist ** 2, out=closest)
+
+    if chosen.sum() < k:
+        #too few candidates were drawn, so top up with random samples
+        extra = rng.choice(np.flatnonzero(~chosen), k - chosen.sum(), replace=False)
+        chosen[extra] = True
+
+    #weight each candidate by the number of samples closest to it and reduce to k centroids
+    candidates = np.array(to_dense(mat[np.flatnonzero(chosen)]), dtype=compute_dtype(data_dtype=mat.dtype))
+    labels, _ = assign(mat, candidates, metric, working_memory, norms)
+    weights = np.bincount(labels, minlength=candidates.shape[0])
+    return kmeans_plusplus(candidates, k, rng, metric, working_memory, weights=weights)
@@ -0,0 +1,104 @@
+import numpy as np
+from scipy import sparse
+from .kmeans import KMeans
+from .silhouette import Silhouette
+from .distance import chunk_rows, label_indicator, pairwise, row_norms
+from .seeding import kmeans_plusplus
+
+
+def select_k(
+        X: np.ndarray,
+        ks = range(2, 11),
+        metric: str = "euclidean",
+        working_memory: float = 64,
+        random_state = None,
+        **kmeans_options) -> dict:
+    """
+    fits KMeans for every candidate number of clusters and scores each fit, to help pick `k`
+
+    each fit is warm-started from the centroids of the previous (smaller) k, with the extra centroids
+    seeded by k-means++. the silhouette scores of every fit are then calculated together in a single
+    blockwise pass over the pairwise distances, so each block of distances is computed once and reused
+    for every k rather than once per k
+
+    inputs:
+        X: np.ndarray
+            A 2D matrix where the rows are observations and columns are features
+        ks: iterable
+            the candidate numbers of clusters (each at least 2)
+        metric: str
+            the name of the distance metric to use
+        working_memory: float
+            the maximum size (in megabytes) of each block of pairwise distances
+        random_state: int or np.random.Generator
+            seed or generator for the seeding of every fit
+        kmeans_options
+            any other KMeans options (e.g. tol, max_iter, algorithm)
+
+    outputs:
+        dict
+            "ks": 1D array of the candidate numbers of clusters, in increasing order
+            "inertia": 1D array with the summed squared distance of the samples to their centroids for each k
+            "silhouette": 1D array with the mean silhouette score for each k
+            "centroids": list with the fitted `k x m` centroids for each k
+    """
+    ks = np.array(sorted(set(ks)))
+    if len(ks) == 0 or ks[0] < 2:
+        raise AttributeError("every candidate k must be at least 2")
+    rng = np.random.default_rng(random_state)
+    n = X.shape[0]
+
+    inertia = np.empty(len(ks))
+    centroids = []
+    labels = []
+    previous = None
+    for i, k in enumerate(ks):
+        #carry the previous centroids over and seed the extra ones around them
+        init = "k-means++" if previous is None else kmeans_plusplus(X, k, rng, metric, working_memory, centers=previous)
+        model = KMeans(k=int(k), metric=metric, working_memory=working_memory, init=init, random_state=rng, **kmeans_options)
+        model.fit(X)
+        previous = np.array(model.centroids)
+        centroids.append(previous)
+        labels.append(model.labels_)
+        inertia[i] = model.get_error() * n
+
+    silhouette = _mean_silhouettes(X, labels, metric, working_memory)
+    return {"ks": ks, "inertia": inertia, "silhouette": silhouette, "centroids": centroids}
+
+
+def _mean_silhouettes(X, labels, metric, working_memory):
+    """
+    calculates the mean silhouette score of several labelings of the same points in one pass over the
+    pairwise distances
+
+    inputs:
+        X
+            2D matrix where the rows are observations and columns are features
+        labels
+            list of 1D label arrays, one per labeling
+        metric
+            the name of the distance metric to use
+        working_memory
+            the maximum size (in megabytes) of each block of pairwise distances
+    output:
+        1D array with the mean silhouette score of each labeling
+    """
+    scorer = Silhouette(metric=metric)
+    encoded = [scorer._encode_labels(y) for y in labels]
+    indicators = None
+    norms = row_norms(X) if sparse.issparse(X) else None #squared row norms of sparse data, computed once
+
+    n = X.shape[0]
+    totals = np.zeros(len(labels))
+    step = chunk_rows(n, working_memory)
+    for start in range(0, n, step):
+        stop = min(start + step, n)
+        #computed once and shared by every labeling
+        dist = pairwise(X[start:stop], X, metric, None if norms is None else norms[start:stop], norms)
+        if indicators is None:
+            #built in the dtype of the distances so the products don't convert the block
+            indicators = [label_indicator(codes, len(counts), dist.dtype) for codes, counts in encoded]
+        for i, ((codes, counts), indicator) in enumerate(zip(encoded, indicators)):
+            sums = np.asarray(dist @ indicator)
+            totals[i] += scorer._score_block(sums, codes[start:stop], counts).sum()
+    return totals / n
@@ -1,23 +1,57 @@
 import numpy as np
-from scipy.spatial.distance import cdist
+from scipy import sparse
+from scipy.stats import norm
+from .distance import chunk_rows, cluster_sums, compute_dtype, label_indicator, pairwise, row_norms
+from .chunks import is_chunked, iter_chunks, n_features, take_rows
+from .parallel import SharedArray, attach, make_executor, resolve_n_jobs
 
 class Silhouette:
-    def __init__(self, metric: str = "euclidean"):
+    def __init__(
+            self,
+            metric: str = "euclidean",
+            working_memory: float = 64,
+            n_jobs: int = None,
+            backend: str = "threads",
+            dtype = None):
         """
         inputs:
             metric: str
                 the name of the distance metric to use
+            working_memory: float
+                the maximum size (in megabytes) of the blocks of pairwise distances, shared between all workers
+            n_jobs: int
+                the number of workers that score blocks of rows at the same time (-1 for one per cpu)
+            backend: str
+                "threads" runs the workers in a thread pool, which works because the distance calculations
+                release the GIL. "processes" runs them in a process pool that maps the data from shared memory
+            dtype: np.dtype
+                the floating point type that distances are computed in, float32 or float64. None keeps float32
+                data in float32 and computes anything else in float64. per-cluster distance totals are always
+                accumulated in float64
         """
+        if backend not in ("threads", "processes"):
+            raise AttributeError("backend must be 'threads' or 'processes'")
+        compute_dtype(dtype) #raise an error if the dtype isn't float32 or float64
         #assign initial attribute
         self.metric = metric
+        self.working_memory = working_memory
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.dtype = dtype
+        self.n_distance_evals_ = 0 #number of distances computed by the scoring calls so far
 
     def score(self, X: np.ndarray, y: np.ndarray) -> np.ndarray:
         """
         calculates the silhouette score for each of the observations
 
+        `X` can also be a `np.memmap` or a re-iterable of 2D chunks of rows; the distances are then
+        computed tile by tile so only a few chunks of `X` are in memory at once. a `scipy.sparse` matrix
+        is scored tile by tile from sparse dot products without densifying it (for the euclidean,
+        sqeuclidean and cosine metrics)
+
         inputs:
             X: np.ndarray
-                A 2D matrix where the rows are observations and columns are features. 
+                A 2D matrix where the rows are observations and columns are features.
 
             y: np.ndarray
                 a 1D array representing the cluster labels for each of the observations in `X`
@@ -26,46 +60,357 @@ class Silhouette:
             np.ndarray
                 a 1D array with the silhouette scores for each of the observations in `X`
         """
-        
-        k = len(np.unique(y)) #get number of clusters
-        all_point_distances = [] #will hold distance lists for each point
-        scores=np.zeros((1,X.shape[0]))
-        
-        for sample_idx,sample in enumerate(X):
-            #create a list of lists that holds dist. vals betw cur_point and other cluster points
-            cur_point_dist = [[] for i in range(k)]
-            
-            for label_idx in range(0,y.shape[1]):
-                #distance between current point and all other points
-                dist = cdist(np.array([X[sample_idx]]), np.array([X[label_idx]]), self.metric)
-                dist = dist[0][0] #unlist the current distance value
-                (cur_point_dist[y[0][label_idx]]).append(dist) #add dist to list in l corresponding to the current label
-            
-            all_point_distances.append(cur_point_dist) #append to keep track of distance lists for each point
-            #print(cur_point_dist)
-            
-            a = None #will hold avg dist from current point to other points in its cluster
-            b = [] #will hold avg dist from current point to other clusters
-            
-            for i in range(0,len(cur_point_dist)):
-
-                #if the current point and the current list of distances were calculated from points in the same cluster,
-                #subtract one from the length of the current list
-                if i == (y[0][sample_idx]):
-                    #average of distances between current point and points in its cluster
-                    #subtract 1 because the list also includes a zero for the distance between the current point and itself
-                    a = sum(cur_point_dist[i])/(len(cur_point_dist[i])-1)
-                    
-                #otherwise calculate the average as normal
+        codes, counts = self._encode_labels(y)
+        scores = np.zeros((1, len(codes)))
+        scores[0] = self._silhouettes(X, codes, X, codes, counts)
+        return scores
+
+    def sample_score(
+            self,
+            X: np.ndarray,
+            y: np.ndarray,
+            sample_size: int = 1000,
+            reference: str = "full",
+            confidence: float = 0.95,
+            random_state = None) -> (float, tuple):
+        """
+        estimates the mean silhouette score from a stratified sample of the observations, which costs
+        `sample_size x n` distances (or `sample_size x sample_size` against the sample) instead of `n x n`
+
+        every cluster is sampled in proportion to its size (and at least twice when it has two points),
+        and the estimate and its confidence interval weight each cluster by its share of the data
+
+        inputs:
+            X: np.ndarray
+                A 2D matrix where the rows are observations and columns are features.
+            y: np.ndarray
+                a 1D array representing the cluster labels for each of the observations in `X`
+            sample_size: int
+                the approximate number of observations to score
+            reference: str
+                "full" scores the sample against every observation, "sample" scores it against the
+                sample only, which is much cheaper but adds bias for small samples
+            confidence: float
+                the coverage of the confidence interval
+            random_state: int or np.random.Generator
+                seed or generator for drawing the sample
+
+        outputs:
+            (float, tuple)
+                returns the estimated mean silhouette score
+                returns the (lower, upper) bounds of its confidence interval
+        """
+        if reference not in ("full", "sample"):
+            raise AttributeError("reference must be 'full' or 'sample'")
+        codes, counts = self._encode_labels(y)
+        n = len(codes)
+        rng = np.random.default_rng(random_state)
+
+        #draw a proportional sample from each cluster
+        members = np.split(np.argsort(codes, kind="stable"), np.cumsum(counts)[:-1])
+        sizes = np.clip(np.round(sample_size * counts / n).astype(int), np.minimum(counts, 2), counts)
+        picks = [np.sort(rng.choice(idx, size, replace=False)) for idx, size in zip(members, sizes)]
+        sample_idx = np.concatenate(picks)
+
+        sample = take_rows(X, sample_idx)
+        if reference == "full":
+            scores = self._silhouettes(sample, codes[sample_idx], X, codes, counts)
+        else:
+            sample_codes = codes[sample_idx]
+            scores = self._silhouettes(sample, sample_codes, sample, sample_codes, sizes)
+
+        #stratified mean and variance, with a finite population correction per cluster
+        weights = counts / n
+        bounds = np.cumsum(sizes)[:-1]
+        strata = np.split(scores, bounds)
+        mean = sum(w * s.mean() for w, s in zip(weights, strata))
+        var = sum(w**2 * (1 - len(s) / c) * (s.var(ddof=1) if len(s) > 1 else 0) / len(s)
+                  for w, s, c in zip(weights, strata, counts))
+        return mean, self._interval(mean, np.sqrt(var), confidence)
+
+    def simplified_score(
+            self,
+            X: np.ndarray,
+            y: np.ndarray,
+            centroids: np.ndarray = None,
+            confidence: float = 0.95) -> (float, tuple):
+        """
+        calculates the simplified silhouette score, which replaces the average distance to the points of
+        each cluster with the distance to the cluster centroid. this costs `n x k` distances instead of `n x n`
+
+        inputs:
+            X: np.ndarray
+                A 2D matrix where the rows are observations and columns are features.
+            y: np.ndarray
+                a 1D array representing the cluster labels for each of the observations in `X`
+            centroids: np.ndarray
+                a `k x m` matrix of centroids indexed by label, such as `KMeans.centroids`. if not
+                given, the mean of each cluster is used
+            confidence: float
+                the coverage of the confidence interval
+
+        outputs:
+            (float, tuple)
+                returns the mean simplified silhouette score
+                returns the (lower, upper) bounds of the confidence interval for the mean of the
+                per-observation scores
+        """
+        if centroids is None:
+            codes, counts = self._encode_labels(y)
+            sums = np.zeros((len(counts), n_features(X)))
+            for start, chunk in iter_chunks(X, chunk_rows(n_features(X), self.working_memory)):
+                chunk = self._as_compute(chunk)
+                sums += cluster_sums(chunk, codes[start:start + chunk.shape[0]], len(counts))
+            centroids = sums / counts[:, np.newaxis]
+        else:
+            #the labels index the centroids directly
+            codes = np.ravel(y).astype(np.intp)
+            centroids = np.asarray(centroids)
+            if len(centroids) < 2:
+                raise AttributeError("silhouette scores need at least two clusters")
+
+        n = len(codes)
+        scores = np.empty(n)
+        self.n_distance_evals_ += n * len(centroids)
+        for start, chunk in iter_chunks(X, chunk_rows(len(centroids), self.working_memory)):
+            stop = start + chunk.shape[0]
+            chunk = self._as_compute(chunk)
+            dist = pairwise(chunk, centroids.astype(chunk.dtype, copy=False), self.metric)
+            rows = np.arange(stop - start)
+            own = codes[start:stop]
+            a = dist[rows, own]
+            dist[rows, own] = np.inf
+            b = dist.min(axis=1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                block = (b - a) / np.maximum(a, b)
+            block[~np.isfinite(block)] = 0
+            scores[start:stop] = block
+
+        mean = scores.mean()
+        return mean, self._interval(mean, scores.std(ddof=1) / np.sqrt(n), confidence)
+
+    def _encode_labels(self, y):
+        """
+        maps arbitrary cluster labels onto `0..k-1` and counts the points in each cluster
+
+        input:
+            1D (or `1 x n`) array of cluster labels
+        output:
+            1D array of label codes and 1D array of cluster sizes
+        """
+        _, codes, counts = np.unique(np.ravel(y), return_inverse=True, return_counts=True)
+        if len(counts) < 2:
+            raise AttributeError("silhouette scores need at least two clusters")
+        return codes, counts
+
+    def _silhouettes(self, X, codes, ref, ref_codes, ref_counts):
+        """
+        calculates silhouette scores for the rows of `X` against a set of reference points that contains them,
+        working through blocks of rows so only a `block x n_ref` matrix of distances is held at once
+
+        inputs:
+            X
+                2D matrix of the points to score
+            codes
+                1D array with the cluster code of each point in `X`
+            ref
+                2D matrix of reference points
+            ref_codes
+                1D array with the cluster code of each reference point
+            ref_counts
+                1D array with the number of reference points in each cluster
+        output:
+            1D array of silhouette scores
+        """
+        #every point is compared with every reference point, whichever worker scores it
+        self.n_distance_evals_ += len(codes) * len(ref_codes)
+        n_workers = resolve_n_jobs(self.n_jobs)
+        if n_workers == 1:
+            return self._score_rows(X, codes, ref, ref_codes, ref_counts, self.working_memory)
+        if is_chunked(X) or is_chunked(ref):
+            raise AttributeError("parallel scoring needs a matrix or np.memmap, not chunked input")
+
+        #every point is scored independently, so contiguous ranges of rows can go to different workers.
+        #the memory budget is split between the workers that run at once
+        bounds = np.linspace(0, X.shape[0], 4 * n_workers + 1).astype(int)
+        working_memory = self.working_memory / n_workers
+        scores = np.empty(X.shape[0])
+        with make_executor(n_workers, self.backend) as executor:
+            with SharedArray(X, executor) as shared_X, SharedArray(codes, executor) as shared_codes:
+                if ref is X:
+                    specs = (shared_X.spec, shared_codes.spec, shared_X.spec, shared_codes.spec)
+                    futures = self._submit_ranges(executor, specs, ref_counts, working_memory, bounds)
+                    results = [future.result() for future in futures]
                 else:
-                    #average of the distances from the current point to other cluster points
-                    b.append(sum(cur_point_dist[i])/len(cur_point_dist[i]))
-                #print(a)
-                #print(b)
-                
-            scores[0][sample_idx] = (min(b)-a)/max(min(b),a)
-            
+                    with SharedArray(ref, executor) as shared_ref, SharedArray(ref_codes, executor) as shared_ref_codes:
+                        specs = (shared_X.spec, shared_codes.spec, shared_ref.spec, shared_ref_codes.spec)
+                        futures = self._submit_ranges(executor, specs, ref_counts, working_memory, bounds)
+                        results = [future.result() for future in futures]
+        for start, stop, result in zip(bounds[:-1], bounds[1:], results):
+            scores[start:stop] = result
+        return scores
+
+    def _submit_ranges(self, executor, specs, ref_counts, working_memory, bounds):
+        """
+        submits one scoring task per range of rows
+
+        inputs:
+            executor
+                the pool to submit to
+            specs
+                shared specs of the points, their codes, the reference points and their codes
+            ref_counts
+                1D array with the number of reference points in each cluster
+            working_memory
+                the memory budget of each task in megabytes
+            bounds
+                1D array of row boundaries between the tasks
+        output:
+            list of futures, one per range
+        """
+        return [executor.submit(_score_range, self, specs, ref_counts, working_memory, start, stop)
+                for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def _score_rows(self, X, codes, ref, ref_codes, ref_counts, working_memory):
+        """
+        scores the rows of `X` serially, one tile of distances at a time. the reference points are split
+        into chunks whose size depends only on `self.working_memory` (not on the per-worker budget), so the
+        distances of each point are always summed in the same order
+
+        inputs:
+            X, codes, ref, ref_codes, ref_counts
+                as in `_silhouettes`
+            working_memory
+                the maximum size (in megabytes) of each tile of distances
+        output:
+            1D array of silhouette scores
+        """
+        k = len(ref_counts)
+        ref_step = self._ref_step(ref)
+        n_ref = len(ref_codes)
+        indicators = {} #sparse label indicator of each chunk of reference points, built once
+        ref_norms = {} #squared row norms of each chunk of sparse reference points, computed once
+        scores = np.empty(len(codes))
+        for start, block in iter_chunks(X, chunk_rows(min(ref_step, n_ref), working_memory)):
+            stop = start + block.shape[0]
+            block = self._as_compute(block)
+            block_norms = row_norms(block) if sparse.issparse(block) else None
+            sums = np.zeros((stop - start, k))
+            for ref_start, ref_chunk in iter_chunks(ref, ref_step):
+                ref_chunk = self._as_compute(ref_chunk)
+                if sparse.issparse(ref_chunk) and ref_start not in ref_norms:
+                    ref_norms[ref_start] = row_norms(ref_chunk)
+                #distances from the block to a chunk of reference points
+                dist = pairwise(block, ref_chunk, self.metric, block_norms, ref_norms.get(ref_start))
+                if ref_start not in indicators:
+                    #built in the dtype of the distances so the product doesn't convert the tile
+                    indicators[ref_start] = label_indicator(ref_codes[ref_start:ref_start + ref_chunk.shape[0]], k, dist.dtype)
+                #summed distances from each block point to each cluster, totalled over the chunks in float64
+                sums += dist @ indicators[ref_start]
+            scores[start:stop] = self._score_block(sums, codes[start:stop], ref_counts)
+        return scores
+
+    def _ref_step(self, ref):
+        """
+        gets the number of reference points per chunk, keeping each chunk of reference features within a
+        quarter of the memory budget and leaving room for tiles of at least 16 rows
+
+        input:
+            the reference points
+        output:
+            the number of reference rows per chunk
+        """
+        if sparse.issparse(ref):
+            #a sparse row takes about 12 bytes (1.5 float64 values) per nonzero entry
+            width = int(np.ceil(1.5 * ref.nnz / max(1, ref.shape[0])))
+        else:
+            width = n_features(ref)
+        return max(1, min(chunk_rows(width, self.working_memory / 4), chunk_rows(16, self.working_memory)))
+
+    def _as_compute(self, chunk):
+        """
+        converts a chunk of points to the compute dtype, without a copy when it already has that dtype
+
+        input:
+            2D matrix of points
+        output:
+            2D matrix of points in the compute dtype
+        """
+        if sparse.issparse(chunk):
+            return chunk.tocsr().astype(compute_dtype(self.dtype, chunk.dtype), copy=False)
+        return np.asarray(chunk, dtype=compute_dtype(self.dtype, chunk.dtype))
+
+    def _interval(self, mean, std_error, confidence):
+        """
+        builds a normal-approximation confidence interval around a mean
 
+        inputs:
+            mean
+                the estimated mean
+            std_error
+                the standard error of the mean
+            confidence
+                the coverage of the interval
+        output:
+            tuple of the lower and upper bounds
+        """
+        z = norm.ppf(0.5 + confidence / 2)
+        return (mean - z * std_error, mean + z * std_error)
+
+    def _score_block(self, sums, own, counts):
+        """
+        turns the summed distances from a block of points to every cluster into silhouette scores
+
+        inputs:
+            sums
+                `block x k` matrix of summed distances from each point to the points of each cluster
+            own
+                1D array with the cluster code of each point in the block
+            counts
+                1D array with the size of each cluster
+        output:
+            1D array of silhouette scores for the block
+        """
+        rows = np.arange(len(own))
+        #average distance to the other points in the same cluster; subtract 1 so the point itself isn't counted
+        own_size = counts[own] - 1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            a = sums[rows, own] / own_size
+            #average distance to the points of each other cluster, keeping the closest one
+            means = sums / counts
+            means[rows, own] = np.inf
+            b = means.min(axis=1)
+            scores = (b - a) / np.maximum(a, b)
+        #points alone in their cluster (and points with every distance zero) score 0
+        scores[(own_size == 0) | ~np.isfinite(scores)] = 0
         return scores
 
 
+def _score_range(scorer, specs, ref_counts, working_memory, start, stop):
+    """
+    scores one range of rows inside a worker; module level so process pools can pickle it
+
+    inputs:
+        scorer
+            the Silhouette doing the scoring
+        specs
+            shared specs of the points, their codes, the reference points and their codes
+        ref_counts
+            1D array with the number of reference points in each cluster
+        working_memory
+            the maximum size (in megabytes) of each block of distances
+        start, stop
+            the range of rows to score
+    output:
+        1D array of silhouette scores for the range
+    """
+    handles, arrays = zip(*[attach(spec) for spec in specs])
+    try:
+        X, codes, ref, ref_codes = arrays
+        scores = scorer._score_rows(X[start:stop], codes[start:stop], ref, ref_codes, ref_counts, working_memory)
+        del X, codes, ref, ref_codes, arrays #drop every view of the shared blocks before closing them
+    finally:
+        for handle in handles:
+            if handle is not None:
+                handle.close()
+    return scores
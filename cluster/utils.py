@@ -1,5 +1,6 @@
 import numpy as np
 import matplotlib.pyplot as plt
+from .parallel import make_executor, resolve_n_jobs
 
 def make_clusters(
         n: int = 500, 
@@ -30,13 +31,14 @@ def make_clusters(
             returns a 2D matrix of `n` observations and `m` features that are clustered into `k` groups
             returns a 1D array of `n` size that defines the cluster origin for each observation
     """
-    np.random.seed(seed)
+    #a local RandomState gives the same draws as seeding the global state, without touching it
+    rng = np.random.RandomState(seed)
     assert k <= n
 
-    labels = np.sort(np.random.randint(0, k, size=n))
-    centers = np.random.uniform(bounds[0], bounds[1], size=(k,m))
+    labels = np.sort(rng.randint(0, k, size=n))
+    centers = rng.uniform(bounds[0], bounds[1], size=(k,m))
     mat = np.vstack([
-        np.random.normal(
+        rng.normal(
             loc=centers[idx], 
             scale=scale, 
             size=(np.sum(labels==idx), m))
@@ -45,6 +47,188 @@ def make_clusters(
     return mat, labels
 
 
+def iter_clusters(
+        n: int = 500,
+        m: int = 2,
+        k: int = 3,
+        bounds: tuple = (-10, 10),
+        scale: float = 1,
+        seed: int = 42,
+        chunk_size: int = 65536,
+        dtype = np.float64):
+    """
+    creates clustered data like `make_clusters`, one chunk of rows at a time, so datasets far larger
+    than memory can be generated
+
+    the data has the same distribution as `make_clusters`: the cluster sizes are multinomial with equal
+    probabilities, the centers are uniform within `bounds`, the samples are normal around their center and
+    the rows are sorted by label. the draws come from `np.random.Generator`s instead of the global state:
+    the centers and sizes from one seed and every chunk from its own seed derived from `seed` and the
+    chunk's index, so any chunk can be generated on its own (and in parallel) and the same `seed` and
+    `chunk_size` always give the same data. the values differ from `make_clusters` with the same seed
+
+    inputs:
+        n: int
+            number of observations
+        m: int
+            number of features
+        k: int
+            number of clusters
+        bounds: tuple
+            minimum and maximum bounds for cluster grid
+        scale: float
+            standard deviation of normal distribution
+        seed: int
+            random seed (None for fresh entropy)
+        chunk_size: int
+            number of observations per chunk
+        dtype: np.dtype
+            the dtype of the observations
+
+    outputs:
+        generator
+            yields (np.ndarray, np.ndarray) pairs of a `chunk_size x m` matrix of observations (the last
+            chunk may be shorter) and a 1D int32 array with the cluster of each observation
+    """
+    assert k <= n
+    entropy = np.random.SeedSequence(seed).entropy #fixed once, so every chunk derives from the same entropy
+    centers, ends = _cluster_layout(n, m, k, bounds, entropy)
+    for index, start in enumerate(range(0, n, chunk_size)):
+        yield _cluster_chunk(centers, ends, scale, entropy, index, start, min(start + chunk_size, n), dtype)
+
+
+def write_clusters(
+        path: str,
+        n: int = 500,
+        m: int = 2,
+        k: int = 3,
+        bounds: tuple = (-10, 10),
+        scale: float = 1,
+        seed: int = 42,
+        chunk_size: int = 65536,
+        dtype = np.float64,
+        labels_path: str = None,
+        n_jobs: int = None) -> (np.ndarray, np.ndarray):
+    """
+    writes the chunks of `iter_clusters` straight into a `.npy` file, without holding the dataset in
+    memory. with `n_jobs`, the chunks are generated and written by several processes at once, and the
+    file is identical to a serial run
+
+    inputs:
+        path: str
+            the `.npy` file to write the observations to
+        n, m, k, bounds, scale, seed, chunk_size, dtype
+            as in `iter_clusters`
+        labels_path: str
+            an optional `.npy` file to write the int32 cluster labels to
+        n_jobs: int
+            the number of worker processes (-1 for one per cpu)
+
+    outputs:
+        (np.ndarray, np.ndarray)
+            returns the observations, memory-mapped read-only from `path`
+            returns the labels memory-mapped read-only from `labels_path`, or None without a `labels_path`
+    """
+    assert k <= n
+    entropy = np.random.SeedSequence(seed).entropy
+    layout = _cluster_layout(n, m, k, bounds, entropy)
+
+    #create the files at full size, then fill them chunk by chunk
+    np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(n, m)).flush()
+    if labels_path is not None:
+        np.lib.format.open_memmap(labels_path, mode="w+", dtype=np.int32, shape=(n,)).flush()
+
+    n_chunks = -(-n // chunk_size)
+    args = (path, labels_path, layout, scale, entropy, chunk_size, dtype)
+    n_workers = min(resolve_n_jobs(n_jobs), n_chunks)
+    if n_workers == 1:
+        _write_chunks(*args, range(n_chunks))
+    else:
+        with make_executor(n_workers) as executor:
+            futures = [executor.submit(_write_chunks, *args, range(worker, n_chunks, n_workers))
+                       for worker in range(n_workers)]
+            for future in futures:
+                future.result()
+
+    labels = None if labels_path is None else np.load(labels_path, mmap_mode="r")
+    return np.load(path, mmap_mode="r"), labels
+
+
+def _cluster_layout(n, m, k, bounds, entropy):
+    """
+    draws the cluster centers and sizes of a generated dataset
+
+    inputs:
+        n, m, k, bounds
+            as in `iter_clusters`
+        entropy
+            the entropy of the dataset's seed sequence
+    output:
+        `k x m` matrix of centers and 1D array with the index one past the last row of each cluster
+    """
+    rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(0,)))
+    centers = rng.uniform(bounds[0], bounds[1], size=(k, m))
+    sizes = rng.multinomial(n, np.full(k, 1 / k)) #the cluster sizes of k uniform labels
+    return centers, np.cumsum(sizes)
+
+
+def _cluster_chunk(centers, ends, scale, entropy, index, start, stop, dtype):
+    """
+    generates one chunk of rows of a dataset
+
+    inputs:
+        centers, ends
+            the output of `_cluster_layout`
+        scale
+            standard deviation of normal distribution
+        entropy
+            the entropy of the dataset's seed sequence
+        index
+            the index of the chunk, which picks its seed
+        start, stop
+            the rows of the chunk
+        dtype
+            the dtype of the observations
+    output:
+        `stop - start x m` matrix of observations and 1D int32 array of their clusters
+    """
+    rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(1, index)))
+    labels = np.searchsorted(ends, np.arange(start, stop), side="right").astype(np.int32)
+    mat = rng.normal(scale=scale, size=(stop - start, centers.shape[1]))
+    mat += centers[labels]
+    return mat.astype(dtype, copy=False), labels
+
+
+def _write_chunks(path, labels_path, layout, scale, entropy, chunk_size, dtype, indices):
+    """
+    generates some chunks of a dataset and writes them into the `.npy` files; module level so process
+    pools can pickle it
+
+    inputs:
+        path, labels_path
+            the files to write into
+        layout
+            the output of `_cluster_layout`
+        scale, entropy, chunk_size, dtype
+            as in `write_clusters`
+        indices
+            the indices of the chunks to write
+    """
+    mat = np.load(path, mmap_mode="r+")
+    labels = None if labels_path is None else np.load(labels_path, mmap_mode="r+")
+    n = mat.shape[0]
+    for index in indices:
+        start = index * chunk_size
+        stop = min(start + chunk_size, n)
+        chunk, chunk_labels = _cluster_chunk(*layout, scale, entropy, index, start, stop, dtype)
+        mat[start:stop] = chunk
+        if labels is not None:
+            labels[start:stop] = chunk_labels
+    mat.flush()
+    if labels is not None:
+        labels.flush()
+
+
 def plot_clusters(
         mat: np.ndarray, 
         labels: np.ndarray, 
@@ -1,13 +1,53 @@
+"""
+command-line entry point for clustering data that lives in files
+
+    python main.py                          # the plotting demo
+    python main.py generate data.npy --n 1000000 --m 16 --k 8 --labels truth.npy
+    python main.py fit data.npy --k 8 --model model.km --labels labels.npy
+    python main.py predict model.km data.csv --output labels.csv --distances distances.csv
+    python main.py score data.npy labels.npy --method sample --sample-size 5000
+    python main.py select-k data.npy --ks 2 3 4 5 6 --output scores.csv
+
+inputs are `.npy` files (memory-mapped, never loaded whole) or delimited text files (parsed
+`--chunk-size` rows at a time). labels, distances and scores are written chunk by chunk to `.npy`
+files (through a memory map) or to text files. every command reports its timings on stderr
+"""
+import sys
+import time
+import argparse
+import collections
 import numpy as np
+from numpy.lib.format import open_memmap
 from cluster import (
-        KMeans, 
-        Silhouette, 
+        KMeans,
+        BisectingKMeans,
+        Silhouette,
+        select_k,
         make_clusters,
+        write_clusters,
         plot_clusters,
         plot_multipanel)
+from cluster.chunks import CsvChunks, is_chunked, iter_chunks
+from cluster.parallel import make_executor, resolve_n_jobs
+
 
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None or args.command == "demo":
+        demo()
+        return 0
+    timer = Timer()
+    try:
+        args.run(args, timer)
+    except AttributeError as error:
+        #invalid options are reported by the models, so they're shown as usage errors rather than tracebacks
+        parser.error(str(error))
+    timer.report()
+    return 0
 
-def main():
+
+def demo():
 
     # create tight clusters
     clusters, labels = make_clusters(scale=0.3)
@@ -26,7 +66,433 @@ def main():
     # pred = km.predict(clusters)
     # scores = Silhouette().score(clusters, pred)
     # plot_multipanel(clusters, labels, pred, scores)
-    
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    builds the parser for the command line, with one subcommand per operation
+
+    outputs:
+        argparse.ArgumentParser
+            the parser; every subcommand sets `run` to the function that carries it out
+    """
+    parser = argparse.ArgumentParser(description="k-means clustering and silhouette scoring of data files")
+    commands = parser.add_subparsers(dest="command")
+
+    commands.add_parser("demo", help="plot example clusters (the default without a command)")
+
+    generate = commands.add_parser("generate", help="write clustered test data to a .npy file")
+    generate.add_argument("output", help="the .npy file for the data")
+    generate.add_argument("--labels", help="the .npy file for the true cluster labels")
+    generate.add_argument("--n", type=int, default=500, help="the number of observations")
+    generate.add_argument("--m", type=int, default=2, help="the number of features")
+    generate.add_argument("--k", type=int, default=3, help="the number of clusters")
+    generate.add_argument("--scale", type=float, default=1, help="the spread of the clusters")
+    generate.add_argument("--seed", type=int, default=42, help="the random seed")
+    generate.add_argument("--chunk-size", type=int, default=65536, help="rows generated per chunk")
+    generate.add_argument("--n-jobs", type=int, help="processes that generate chunks (-1 for one per cpu)")
+    generate.add_argument("--dtype", default="float64", help="float32 or float64")
+    generate.set_defaults(run=run_generate)
+
+    fit = commands.add_parser("fit", help="fit a model and save it")
+    _add_input(fit)
+    fit.add_argument("--k", type=int, required=True, help="the number of clusters")
+    fit.add_argument("--model", required=True, help="the file to save the fitted model to")
+    fit.add_argument("--labels", help="write the cluster label of every observation to this file")
+    fit.add_argument("--metric", default="euclidean", help="the distance metric")
+    fit.add_argument("--algorithm", default="lloyd", help="lloyd, elkan, hamerly or minibatch")
+    fit.add_argument("--bisecting", action="store_true", help="fit a bisecting k-means cluster tree")
+    fit.add_argument("--init", default="k-means++", help="the seeding method")
+    fit.add_argument("--update", default="auto", help="the center update: auto, mean, median, spherical or medoid")
+    fit.add_argument("--n-init", type=int, default=1, help="the number of restarts")
+    fit.add_argument("--max-iter", type=int, default=100, help="the maximum number of iterations")
+    fit.add_argument("--tol", type=float, default=1e-6, help="the convergence tolerance")
+    fit.add_argument("--batch-size", type=int, default=1024, help="the minibatch size")
+    fit.add_argument("--random-state", type=int, help="the random seed")
+    _add_compute(fit, "the number of processes that run the restarts of --n-init")
+    fit.set_defaults(run=run_fit)
+
+    predict = commands.add_parser("predict", help="label observations with a saved model")
+    predict.add_argument("model", help="the saved model")
+    _add_input(predict)
+    predict.add_argument("--output", required=True, help="the file for the cluster labels")
+    predict.add_argument("--distances", help="the file for the distances to the centroids")
+    predict.add_argument("--n-jobs", type=int, help="the number of threads that predict chunks at the same time (-1 for one per cpu)")
+    predict.add_argument("--working-memory", type=float, help="the memory budget per block, in megabytes")
+    predict.set_defaults(run=run_predict)
+
+    score = commands.add_parser("score", help="calculate silhouette scores for labelled observations")
+    _add_input(score)
+    score.add_argument("labels", help="the cluster labels (.npy or text)")
+    score.add_argument("--method", default="exact", choices=("exact", "sample", "simplified"),
+                       help="exact scores every observation against all others; sample and simplified estimate the mean")
+    score.add_argument("--output", help="the file for the per-observation scores (--method exact)")
+    score.add_argument("--metric", default="euclidean", help="the distance metric")
+    score.add_argument("--sample-size", type=int, default=1000, help="the sample size for --method sample")
+    score.add_argument("--model", help="a saved model whose centroids --method simplified uses")
+    score.add_argument("--random-state", type=int, help="the random seed for --method sample")
+    score.add_argument("--backend", default="threads", choices=("threads", "processes"), help="how workers run")
+    _add_compute(score, "the number of workers that score blocks of rows for --method exact and sample")
+    score.set_defaults(run=run_score)
+
+    choose = commands.add_parser("select-k", help="fit and score a range of cluster counts")
+    _add_input(choose)
+    choose.add_argument("--ks", type=int, nargs="+", default=list(range(2, 11)), help="the candidate numbers of clusters")
+    choose.add_argument("--output", help="write the table of k, inertia and silhouette to this CSV file")
+    choose.add_argument("--metric", default="euclidean", help="the distance metric")
+    choose.add_argument("--algorithm", default="lloyd", help="lloyd, elkan or hamerly")
+    choose.add_argument("--random-state", type=int, help="the random seed")
+    _add_compute(choose)
+    choose.set_defaults(run=run_select_k)
+    return parser
+
+
+def _add_input(parser):
+    """
+    adds the data file and the options for reading it to a subcommand
+
+    input:
+        the subcommand's parser
+    """
+    parser.add_argument("input", help="the data: a .npy file or a delimited text file with one observation per row")
+    parser.add_argument("--chunk-size", type=int, default=65536, help="rows read and written per chunk")
+    parser.add_argument("--delimiter", default=",", help="the column separator of text input")
+    parser.add_argument("--skip-header", type=int, default=0, help="lines to skip at the start of text input")
+
+
+def _add_compute(parser, n_jobs: str = None):
+    """
+    adds the parallelism, memory and precision options to a subcommand
+
+    inputs:
+        parser
+            the subcommand's parser
+        n_jobs: str
+            what the workers of `--n-jobs` do, or None for a subcommand that runs serially
+    """
+    if n_jobs is not None:
+        parser.add_argument("--n-jobs", type=int, help=n_jobs + " (-1 for one per cpu)")
+    parser.add_argument("--working-memory", type=float, default=64, help="the memory budget per block, in megabytes")
+    parser.add_argument("--dtype", help="compute in float32 or float64 (default: float32 for float32 data, else float64)")
+
+
+class Timer:
+    """
+    records how long each step of a command takes
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.steps = []
+
+    def time(self, name: str, func, *args, **kwargs):
+        """
+        runs a function and records its wall time
+
+        inputs:
+            name: str
+                the name of the step
+            func
+                the function to run
+            *args, **kwargs
+                the arguments of the function
+
+        outputs:
+            the return value of the function
+        """
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.steps.append((name, time.perf_counter() - start))
+        return result
+
+    def report(self, stream=None):
+        """
+        prints the time of every step and the total
+
+        inputs:
+            stream
+                the file to print to (`sys.stderr` at the time of the call by default)
+        """
+        stream = sys.stderr if stream is None else stream
+        for name, seconds in self.steps:
+            print("{:<20}{:>10.3f}s".format(name, seconds), file=stream)
+        print("{:<20}{:>10.3f}s".format("total", time.perf_counter() - self.start), file=stream)
+
+
+def open_input(path: str, chunk_size: int = 65536, delimiter: str = ",", skip_header: int = 0):
+    """
+    opens a data file without reading it into memory
+
+    inputs:
+        path: str
+            a `.npy` file, which is memory-mapped, or a delimited text file, which is parsed in chunks
+        chunk_size: int
+            the number of rows per chunk of text input
+        delimiter: str
+            the column separator of text input
+        skip_header: int
+            the number of lines to skip at the start of text input
+
+    outputs:
+        a read-only `np.memmap` or a re-iterable of 2D chunks
+    """
+    if path.endswith(".npy"):
+        mat = np.load(path, mmap_mode="r")
+        return mat[:, np.newaxis] if mat.ndim == 1 else mat
+    return CsvChunks(path, chunk_size, delimiter, skip_header)
+
+
+def read_labels(path: str) -> np.ndarray:
+    """
+    reads a 1D array of cluster labels from a `.npy` or text file
+
+    inputs:
+        path: str
+            the file to read
+
+    outputs:
+        np.ndarray
+            a 1D array of labels
+    """
+    if path.endswith(".npy"):
+        return np.ravel(np.load(path))
+    return np.ravel(np.loadtxt(path, dtype=np.int64, ndmin=1))
+
+
+def count_rows(data) -> int:
+    """
+    counts the observations of a matrix or of an iterable of chunks
+
+    inputs:
+        data
+            a 2D matrix or a re-iterable of 2D chunks
+
+    outputs:
+        int
+            the number of rows
+    """
+    if not is_chunked(data):
+        return data.shape[0]
+    return sum(chunk.shape[0] for chunk in data)
+
+
+class Output:
+    """
+    writes a 1D result in consecutive chunks, either into a `.npy` file through a memory map (which
+    needs the final length up front) or as one value per line of a text file
+    """
+    def __init__(self, path: str, n: int, dtype, fmt: str = "%.8g"):
+        """
+        inputs:
+            path: str
+                the file to write; `.npy` files are memory-mapped, anything else is written as text
+            n: int
+                the total number of values (only used for `.npy` files)
+            dtype: np.dtype
+                the dtype of `.npy` output
+            fmt: str
+                the format of each value in text output
+        """
+        self.path = path
+        self.fmt = fmt
+        self.position = 0
+        if path.endswith(".npy"):
+            self._memmap = open_memmap(path, mode="w+", dtype=dtype, shape=(n,))
+            self._file = None
+        else:
+            self._memmap = None
+            self._file = open(path, "w")
+
+    def write(self, values: np.ndarray):
+        """
+        appends a chunk of values
+
+        inputs:
+            values: np.ndarray
+                the next values, in order
+        """
+        values = np.ravel(values)
+        if self._memmap is not None:
+            self._memmap[self.position:self.position + len(values)] = values
+        else:
+            np.savetxt(self._file, values, fmt=self.fmt)
+        self.position += len(values)
+
+    def close(self):
+        """
+        flushes the output to disk
+        """
+        if self._memmap is not None:
+            self._memmap.flush()
+            self._memmap = None
+        else:
+            self._file.close()
+
+
+def write_predictions(
+        model: KMeans,
+        data,
+        labels_path: str,
+        distances_path: str = None,
+        chunk_size: int = 65536,
+        n_jobs: int = None) -> int:
+    """
+    predicts the cluster of every observation chunk by chunk, writing each chunk's labels (and
+    distances) in order as soon as they are ready. with several threads, at most two chunks per thread
+    are read ahead, so only a few chunks of data and results are ever in memory
+
+    inputs:
+        model: KMeans
+            a fitted model
+        data
+            a 2D matrix or a re-iterable of 2D chunks
+        labels_path: str
+            the file for the labels
+        distances_path: str
+            the file for the distances to the centroids, or None to skip them
+        chunk_size: int
+            the number of rows predicted at once when `data` is a matrix
+        n_jobs: int
+            the number of threads that predict chunks at the same time (-1 for one per cpu); the
+            distance calculations release the GIL
+
+    outputs:
+        int
+            the number of observations written
+    """
+    n = count_rows(data) if labels_path.endswith(".npy") or (distances_path or "").endswith(".npy") else None
+    labels_out = Output(labels_path, n, np.int32, fmt="%d")
+    distances_out = Output(distances_path, n, np.float64) if distances_path else None
+    n_workers = resolve_n_jobs(n_jobs)
+    executor = make_executor(n_workers, "threads") if n_workers > 1 else None
+
+    def write(result):
+        labels, distances = result
+        labels_out.write(labels)
+        if distances_out is not None:
+            distances_out.write(distances)
+
+    try:
+        pending = collections.deque()
+        for _, chunk in iter_chunks(data, chunk_size):
+            if executor is None:
+                write(model.predict(chunk, return_distances=True))
+                continue
+            pending.append(executor.submit(model.predict, chunk, return_distances=True))
+            if len(pending) >= 2 * n_workers:
+                write(pending.popleft().result())
+        while pending:
+            write(pending.popleft().result())
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        labels_out.close()
+        if distances_out is not None:
+            distances_out.close()
+    return labels_out.position
+
+
+def run_generate(args, timer: Timer):
+    """
+    carries out the `generate` command
+    """
+    mat, _ = timer.time("generate", write_clusters, args.output, n=args.n, m=args.m, k=args.k, scale=args.scale,
+                        seed=args.seed, chunk_size=args.chunk_size, dtype=args.dtype, labels_path=args.labels,
+                        n_jobs=args.n_jobs)
+    print("wrote {} x {} observations to {}".format(mat.shape[0], mat.shape[1], args.output))
+
+
+def run_fit(args, timer: Timer):
+    """
+    carries out the `fit` command
+    """
+    data = open_input(args.input, args.chunk_size, args.delimiter, args.skip_header)
+    options = dict(metric=args.metric, tol=args.tol, max_iter=args.max_iter, working_memory=args.working_memory,
+                   algorithm=args.algorithm, batch_size=args.batch_size, init=args.init, update=args.update,
+                   random_state=args.random_state, n_init=args.n_init, n_jobs=args.n_jobs, dtype=args.dtype)
+    if is_chunked(data) and (args.bisecting or args.algorithm in ("elkan", "hamerly") or args.update in ("median", "medoid")
+                             or (args.n_init > 1 and resolve_n_jobs(args.n_jobs) > 1)):
+        #the tree, the bounded algorithms, the median and medoid updates and parallel restarts are fit on a matrix
+        data = timer.time("read", lambda: np.concatenate(list(data)))
+    if args.bisecting:
+        model = BisectingKMeans(args.k, **options)
+    else:
+        model = KMeans(args.k, **options)
+    timer.time("fit", model.fit, data)
+    timer.time("save", model.save, args.model)
+    print("k={} iterations={} converged={} error={:.6g}".format(model.k, model.n_iter_, model.converged_, model.get_error()))
+
+    if args.labels:
+        if model.labels_ is not None and args.labels.endswith(".npy"):
+            timer.time("write labels", np.save, args.labels, model.labels_)
+        else:
+            timer.time("write labels", write_predictions, model, data, args.labels, None, args.chunk_size)
+
+
+def run_predict(args, timer: Timer):
+    """
+    carries out the `predict` command
+    """
+    model = timer.time("load", KMeans.load, args.model)
+    if args.working_memory is not None:
+        model.working_memory = args.working_memory
+    data = open_input(args.input, args.chunk_size, args.delimiter, args.skip_header)
+    n = timer.time("predict", write_predictions, model, data, args.output, args.distances, args.chunk_size, args.n_jobs)
+    print("labelled {} observations".format(n))
+
+
+def run_score(args, timer: Timer):
+    """
+    carries out the `score` command
+    """
+    data = open_input(args.input, args.chunk_size, args.delimiter, args.skip_header)
+    labels = read_labels(args.labels)
+    scorer = Silhouette(args.metric, args.working_memory, args.n_jobs, args.backend, args.dtype)
+
+    if args.method == "exact":
+        if is_chunked(data) and resolve_n_jobs(args.n_jobs) > 1:
+            data = timer.time("read", lambda: np.concatenate(list(data))) #the workers share one matrix
+        scores = timer.time("score", scorer.score, data, labels)[0]
+        print("mean silhouette score {:.6f}".format(scores.mean()))
+    elif args.method == "sample":
+        if is_chunked(data):
+            data = timer.time("read", lambda: np.concatenate(list(data))) #samples are drawn by row index
+        mean, interval = timer.time("score", scorer.sample_score, data, labels, args.sample_size,
+                                    random_state=args.random_state)
+        print("mean silhouette score {:.6f} ({:.6f} to {:.6f})".format(mean, *interval))
+        scores = None
+    else:
+        centroids = KMeans.load(args.model).centroids if args.model else None
+        mean, interval = timer.time("score", scorer.simplified_score, data, labels, centroids)
+        print("mean simplified silhouette score {:.6f} ({:.6f} to {:.6f})".format(mean, *interval))
+        scores = None
+
+    if args.output:
+        if scores is None:
+            raise AttributeError("--output needs --method exact")
+        output = Output(args.output, len(scores), np.float64)
+        try:
+            for start in range(0, len(scores), args.chunk_size):
+                output.write(scores[start:start + args.chunk_size])
+        finally:
+            output.close()
+
+
+def run_select_k(args, timer: Timer):
+    """
+    carries out the `select-k` command
+    """
+    data = open_input(args.input, args.chunk_size, args.delimiter, args.skip_header)
+    if is_chunked(data):
+        data = timer.time("read", lambda: np.concatenate(list(data))) #every candidate fit needs the whole matrix
+    results = timer.time("select k", select_k, data, args.ks, args.metric, args.working_memory, args.random_state,
+                         algorithm=args.algorithm, dtype=args.dtype)
+    table = np.column_stack([results["ks"], results["inertia"], results["silhouette"]])
+    print("{:>6}{:>16}{:>12}".format("k", "inertia", "silhouette"))
+    for k, inertia, silhouette in table:
+        print("{:>6d}{:>16.6g}{:>12.6f}".format(int(k), inertia, silhouette))
+    if args.output:
+        np.savetxt(args.output, table, fmt=("%d", "%.8g", "%.8g"), delimiter=",", header="k,inertia,silhouette", comments="")
+
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,121 @@
+#Importing Dependencies
+import pytest
+import numpy as np
+from scipy import sparse
+from scipy.spatial.distance import cdist
+from cluster import (KMeans, BisectingKMeans, make_clusters)
+
+def test_bisecting_kmeans():
+    t_clusters, t_labels = make_clusters(n=2000, m=4, k=16, scale=0.3)
+    
+    #-----------------------------------------------------------
+    #unknown strategies, k above the number of samples and chunked input raise an AttributeError
+    try:
+        BisectingKMeans(k=4, strategy="smallest")
+        assert False
+    except AttributeError:
+        assert True
+    try:
+        BisectingKMeans(k=10).fit(t_clusters[:5])
+        assert False
+    except AttributeError:
+        assert True
+    try:
+        BisectingKMeans(k=4).fit([t_clusters[:1000], t_clusters[1000:]])
+        assert False
+    except AttributeError:
+        assert True
+    
+    #-----------------------------------------------------------
+    #the fit gives k non-empty clusters whose centroids are the cluster means
+    kmeans = BisectingKMeans(k=16, random_state=0)
+    kmeans.fit(t_clusters)
+    assert kmeans.centroids.shape == (16, 4)
+    assert np.all(kmeans.counts_ > 0)
+    assert np.array_equal(kmeans.counts_, np.bincount(kmeans.labels_, minlength=16))
+    for label in range(16):
+        assert np.allclose(kmeans.centroids[label], t_clusters[kmeans.labels_ == label].mean(axis=0))
+    assert np.allclose(kmeans.get_centroids(), kmeans.centroids)
+    assert np.isclose(kmeans.get_error(), np.mean(np.sum((t_clusters - kmeans.centroids[kmeans.labels_]) ** 2, axis=1)))
+    #a tree of k leaves has k - 1 inner nodes
+    assert len(kmeans.children_) == 31
+    assert np.sum(kmeans.leaf_labels_ >= 0) == 16
+    
+    #splitting only one cluster at a time needs far fewer distances than flat k-means
+    flat = KMeans(k=16, random_state=0)
+    flat.fit(t_clusters)
+    assert kmeans.n_distance_evals_ < flat.n_distance_evals_
+    
+    #-----------------------------------------------------------
+    #descending the tree puts the fit samples back in their clusters
+    labels, distances = kmeans.predict(t_clusters, return_distances=True)
+    assert np.array_equal(labels[0], kmeans.labels_)
+    assert np.allclose(distances[0], np.sqrt(np.sum((t_clusters - kmeans.centroids[labels[0]]) ** 2, axis=1)))
+    assert kmeans.predict_one(t_clusters[7])[0] == kmeans.labels_[7]
+    #every level of the descent compares each sample with the two children of its node
+    evals = kmeans.n_predict_evals_
+    kmeans.predict(t_clusters)
+    assert 2 * 2000 <= kmeans.n_predict_evals_ - evals < 2000 * 16
+    #an index searches the leaf centroids exactly instead
+    exact = BisectingKMeans(k=16, random_state=0, index="brute")
+    exact.fit(t_clusters)
+    assert np.array_equal(exact.predict(t_clusters)[0], np.argmin(cdist(t_clusters, exact.centroids), axis=1))
+    #other metrics descend the tree as well
+    cosine = BisectingKMeans(k=4, metric="cosine", random_state=0)
+    cosine.fit(t_clusters)
+    assert cosine.predict(t_clusters).shape == (1, 2000)
+    t_unit = t_clusters / np.linalg.norm(t_clusters, axis=1)[:, np.newaxis]
+    for label in range(4):
+        direction = t_unit[cosine.labels_ == label].mean(axis=0)
+        assert np.allclose(cosine.centroids[label], direction / np.linalg.norm(direction))
+    #and the node centroids follow the update rule of the metric, so the tree matches the fit labels
+    for metric in ["cityblock", "chebyshev"]:
+        other = BisectingKMeans(k=8, metric=metric, random_state=0)
+        other.fit(t_clusters)
+        assert np.array_equal(other.predict(t_clusters)[0], other.labels_)
+        if metric == "cityblock":
+            for label in range(8):
+                assert np.allclose(other.centroids[label], np.median(t_clusters[other.labels_ == label], axis=0))
+    
+    #sparse input gives the same tree as the dense matrix
+    sparse_fit = BisectingKMeans(k=16, random_state=0)
+    sparse_fit.fit(sparse.csr_matrix(t_clusters))
+    assert np.array_equal(sparse_fit.labels_, kmeans.labels_)
+    assert np.array_equal(sparse_fit.predict(sparse.csr_matrix(t_clusters)), kmeans.predict(t_clusters))
+    
+    #-----------------------------------------------------------
+    #cutting the tree gives coarser clusterings that nest inside each other
+    for n_clusters in [1, 2, 5, 16]:
+        mapping, centroids = kmeans.cut(n_clusters)
+        assert centroids.shape == (n_clusters, 4)
+        coarse = mapping[kmeans.labels_]
+        assert len(np.unique(coarse)) == n_clusters
+        for label in range(n_clusters):
+            assert np.allclose(centroids[label], t_clusters[coarse == label].mean(axis=0))
+    assert np.array_equal(kmeans.cut(16)[0], np.arange(16))
+    two, _ = kmeans.cut(2)
+    five, _ = kmeans.cut(5)
+    for label in range(5):
+        assert len(np.unique(two[five == label])) == 1
+    try:
+        kmeans.cut(17)
+        assert False
+    except AttributeError:
+        assert True
+    
+    #-----------------------------------------------------------
+    #identical samples can't be split into more clusters than there are distinct points
+    repeated = np.repeat(t_clusters[:3], 10, axis=0)
+    try:
+        BisectingKMeans(k=4, random_state=0).fit(repeated)
+        assert False
+    except AttributeError:
+        assert True
+    
+    #the tree can't be updated in place
+    try:
+        kmeans.partial_fit(t_clusters)
+        assert False
+    except AttributeError:
+        assert True
+
@@ -0,0 +1,70 @@
+#Importing dependencies
+import pytest
+import numpy as np
+from scipy.spatial.distance import cdist
+from cluster import (KMeans, make_clusters)
+from cluster.index import CentroidIndex
+
+def test_centroid_index():
+    #every kind of index should find the same closest centroids as a full distance matrix
+    for m, metric, kinds in [(2, "euclidean", ["kdtree", "blas", "brute"]),
+                             (50, "euclidean", ["kdtree", "blas", "brute"]),
+                             (3, "cityblock", ["kdtree", "brute"]),
+                             (3, "cosine", ["brute"])]:
+        t_clusters, t_labels = make_clusters(n=400, m=m, k=3)
+        centroids = np.random.RandomState(0).normal(size=(200, m)) * 5
+        dist = cdist(t_clusters, centroids, metric)
+        for kind in kinds + ["auto"]:
+            index = CentroidIndex(centroids, metric, kind, working_memory=0.01)
+            labels, distances = index.query(t_clusters)
+            assert np.array_equal(labels, dist.argmin(axis=1))
+            assert np.allclose(distances, dist.min(axis=1))
+            label, distance = index.query_one(t_clusters[7])
+            assert label == labels[7]
+            assert np.isclose(distance, distances[7])
+    
+    #auto picks a tree for low dimensions and the matrix product for high dimensions
+    assert CentroidIndex(np.zeros((5, 2))).kind == "kdtree"
+    assert CentroidIndex(np.zeros((5, 100))).kind == "blas"
+    assert CentroidIndex(np.zeros((5, 2)), metric="cosine").kind == "brute"
+    
+    #a tree can't search with metrics other than minkowski ones
+    try:
+        CentroidIndex(np.zeros((5, 2)), metric="cosine", kind="kdtree")
+        assert False
+    except AttributeError:
+        assert True
+    
+    #unknown indexes and indexes that can't search with the metric are rejected when the model is made
+    for options in [dict(index="ball_tree"), dict(index="kdtree", metric="cosine"), dict(index="blas", metric="cityblock")]:
+        try:
+            KMeans(k=3, **options)
+            assert False
+        except AttributeError:
+            assert True
+
+
+def test_kmeans_index_predict():
+    t_clusters, t_labels = make_clusters(n=2000, m=3, k=50, scale=0.3)
+    plain = KMeans(k=50, random_state=0)
+    plain.fit(t_clusters)
+    indexed = KMeans(k=50, random_state=0, index="auto")
+    indexed.fit(t_clusters)
+    
+    #predicting through the index should agree with the linear scan
+    labels, distances = indexed.predict(t_clusters, return_distances=True)
+    assert np.array_equal(labels, plain.predict(t_clusters))
+    assert labels.shape == distances.shape == (1, 2000)
+    assert np.isclose(np.mean(distances ** 2), indexed.get_error())
+    
+    #and so should the single-sample path
+    for idx in [0, 500, 1999]:
+        assert indexed.predict_one(t_clusters[idx])[0] == labels[0][idx]
+        assert plain.predict_one(t_clusters[idx])[0] == labels[0][idx]
+    
+    #predictions count their distances separately from the fit: every centroid for the linear scan,
+    #and at most that many through the index
+    assert plain.n_predict_evals_ == 2000 * 50 + 3 * 50
+    assert 0 < indexed.n_predict_evals_ <= plain.n_predict_evals_
+    plain.fit(t_clusters)
+    assert plain.n_predict_evals_ == 0
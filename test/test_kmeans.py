@@ -1,7 +1,13 @@
 #Importing Dependencies
+import sys
+import multiprocessing
 import pytest
 import numpy as np
+from scipy import sparse
+from scipy.spatial.distance import cdist
 from cluster import (KMeans, Silhouette, make_clusters)
+from concurrent.futures import ThreadPoolExecutor
+from cluster.distance import assign
 
 def test_kmeans():
     #test things like k=0, samples<k, large dimensionality (m), low dimensionality (m=1), very high k
@@ -79,3 +85,539 @@ def test_kmeans():
     assert pred_labels[0][300]==pred_labels[0][250]
     assert len(kmeans6.centroids[0])==200 #check that the centroids have 200 dimensions
 
+
+
+def test_kmeans_chunked_assignment():
+    #the chunked assignment engine should give the same labels as a brute-force distance matrix
+    t_clusters, t_labels = make_clusters(k=5, scale=1)
+    kmeans = KMeans(k=5)
+    kmeans.fit(t_clusters)
+    brute = cdist(t_clusters, kmeans.centroids).argmin(axis=1)
+    assert np.array_equal(kmeans.predict(t_clusters)[0], brute)
+    
+    #a tiny memory budget forces one row per chunk, which should not change the result
+    labels, distances = assign(t_clusters, kmeans.centroids, working_memory=1e-6)
+    assert np.array_equal(labels, brute)
+    assert np.allclose(distances, cdist(t_clusters, kmeans.centroids).min(axis=1))
+    
+    #the error should be the mean squared distance of each sample to its centroid
+    assert np.isclose(kmeans.get_error(), np.mean(distances ** 2))
+
+
+def test_kmeans_bounded_algorithms():
+    #elkan and hamerly should give exactly the same clusters as lloyd from the same starting centroids
+    m_clusters, m_labels = make_clusters(n=2000, k=100, scale=1)
+    
+    fits = {}
+    for algorithm in ["lloyd", "elkan", "hamerly"]:
+        kmeans = KMeans(k=100, algorithm=algorithm, init="random", random_state=0)
+        kmeans.fit(m_clusters)
+        fits[algorithm] = kmeans
+    
+    for algorithm in ["elkan", "hamerly"]:
+        assert fits[algorithm].clusters == fits["lloyd"].clusters
+        assert np.allclose(fits[algorithm].centroids, fits["lloyd"].centroids)
+        assert np.isclose(fits[algorithm].get_error(), fits["lloyd"].get_error())
+    #elkan should skip most of the distance computations
+    assert fits["elkan"].n_distance_evals_ * 5 < fits["lloyd"].n_distance_evals_
+    #while still counting the distance of every sample to its own centroid, which each iteration's error needs
+    t_clusters, t_labels = make_clusters(n=2000, k=3, scale=0.3)
+    for algorithm in ["elkan", "hamerly"]:
+        kmeans = KMeans(k=3, algorithm=algorithm, random_state=0)
+        kmeans.fit(t_clusters)
+        #(the first assignment computes every distance to set up the bounds)
+        assert kmeans.n_distance_evals_ >= 2000 * 3 + 2000 * kmeans.n_iter_
+    
+    #the bounds only hold for true metrics that can be computed row by row
+    try:
+        KMeans(k=3, metric="cosine", algorithm="elkan")
+        assert False
+    except AttributeError:
+        assert True
+
+
+def test_kmeans_minibatch():
+    t_clusters, t_labels = make_clusters(n=3000, k=3, scale=0.3, seed=1)
+    
+    #a minibatch fit should recover the same tight clusters as the full fit
+    kmeans = KMeans(k=3, algorithm="minibatch", batch_size=200, random_state=0)
+    kmeans.fit(t_clusters)
+    pred_labels = kmeans.predict(t_clusters)
+    assert len(np.unique(pred_labels)) == 3
+    for label in range(3):
+        assert len(np.unique(pred_labels[0][t_labels == label])) == 1
+    
+    #noisy batches still converge, once the smoothed batch error stops improving, before max_iter
+    loose, _ = make_clusters(n=20000, m=4, k=5, scale=1, seed=3)
+    noisy = KMeans(k=5, algorithm="minibatch", random_state=1)
+    noisy.fit(loose)
+    assert noisy.converged_ and noisy.n_iter_ < noisy.max_iter
+    #over chunks, every iteration is a full pass, and the fit stops after a few passes
+    chunked = KMeans(k=5, algorithm="minibatch", random_state=1)
+    chunked.fit([loose[i:i + 2000] for i in range(0, 20000, 2000)])
+    assert chunked.converged_ and chunked.n_iter_ <= 15
+    assert np.isclose(chunked.get_error(), noisy.get_error(), rtol=0.05)
+    
+    #streaming the data in batches through partial_fit should do the same without fitting the full matrix
+    stream = KMeans(k=3, random_state=0)
+    shuffled = np.random.RandomState(0).permutation(t_clusters.shape[0])
+    for start in range(0, len(shuffled), 300):
+        stream.partial_fit(t_clusters[shuffled[start:start + 300]])
+    assert len(stream.clusters) == 3
+    assert sum(len(cluster) for cluster in stream.clusters) == 300 #the clusters describe the latest batch
+    pred_labels = stream.predict(t_clusters)
+    for label in range(3):
+        assert len(np.unique(pred_labels[0][t_labels == label])) == 1
+    
+    #a model fit on the full matrix (with any algorithm or restarts) is refreshed from its fitted centroids
+    for options in [dict(), dict(algorithm="elkan"), dict(algorithm="hamerly"), dict(n_init=2)]:
+        refreshed = KMeans(k=3, random_state=0, **options)
+        refreshed.fit(t_clusters)
+        fitted, sizes = np.array(refreshed.centroids), refreshed.counts_.copy()
+        refreshed.partial_fit(t_clusters[shuffled[:300]])
+        assert np.allclose(refreshed.centroids, fitted, atol=0.1)
+        assert np.array_equal(refreshed._absorbed, sizes + refreshed.counts_)
+    
+    #the first batch must have enough samples to pick the starting centroids
+    try:
+        KMeans(k=10).partial_fit(t_clusters[:5])
+        assert False
+    except AttributeError:
+        assert True
+
+
+def test_kmeans_init():
+    t_clusters, t_labels = make_clusters(k=4, scale=0.3)
+    
+    #the same random_state should give the same fit, for every seeding method
+    for init in ["random", "k-means++", "k-means||"]:
+        first = KMeans(k=4, init=init, random_state=7)
+        first.fit(t_clusters)
+        second = KMeans(k=4, init=init, random_state=7)
+        second.fit(t_clusters)
+        assert np.array_equal(first.centroids, second.centroids)
+        assert first.clusters == second.clusters
+    
+    #k-means++ spreads the starting centroids out, so the tight clusters should all be found
+    kmeans = KMeans(k=4, init="k-means++", random_state=0)
+    kmeans.fit(t_clusters)
+    pred_labels = kmeans.predict(t_clusters)
+    for label in range(4):
+        assert len(np.unique(pred_labels[0][t_labels == label])) == 1
+    
+    #user-supplied centroids are used as the starting point
+    start = np.array([t_clusters[t_labels == label].mean(axis=0) for label in range(4)])
+    kmeans = KMeans(k=4, init=start, max_iter=1)
+    kmeans.fit(t_clusters)
+    assert np.allclose(kmeans.centroids, start)
+    assert np.array_equal(kmeans.predict(t_clusters)[0], t_labels)
+    
+    #the supplied centroids must match k
+    try:
+        KMeans(k=3, init=start)
+        assert False
+    except AttributeError:
+        assert True
+
+
+def test_kmeans_restarts():
+    t_clusters, t_labels = make_clusters(k=4, scale=1)
+    
+    #restarts from the same random_state should be reproducible
+    kmeans = KMeans(k=4, init="random", n_init=8, random_state=3)
+    kmeans.fit(t_clusters)
+    again = KMeans(k=4, init="random", n_init=8, random_state=3)
+    again.fit(t_clusters)
+    assert len(kmeans.clusters) == 4
+    assert np.array_equal(again.centroids, kmeans.centroids)
+    
+    #running the restarts on a process pool should give exactly the same fit
+    pooled = KMeans(k=4, init="random", n_init=8, n_jobs=2, random_state=3)
+    pooled.fit(t_clusters)
+    assert np.array_equal(pooled.centroids, kmeans.centroids)
+    assert pooled.clusters == kmeans.clusters
+    
+    #and so should a user-supplied thread pool
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        threaded = KMeans(k=4, init="random", n_init=8, executor=executor, random_state=3)
+        threaded.fit(t_clusters)
+    assert np.array_equal(threaded.centroids, kmeans.centroids)
+
+
+def test_kmeans_restarts_without_shared_memory(monkeypatch):
+    t_clusters, t_labels = make_clusters(k=4, scale=1)
+    kmeans = KMeans(k=4, init="random", n_init=4, random_state=3)
+    kmeans.fit(t_clusters)
+    
+    #before python 3.8 there is no multiprocessing.shared_memory, and the workers map a temporary file instead
+    monkeypatch.setitem(sys.modules, "multiprocessing.shared_memory", None)
+    monkeypatch.delattr(multiprocessing, "shared_memory", raising=False)
+    pooled = KMeans(k=4, init="random", n_init=4, n_jobs=2, random_state=3)
+    pooled.fit(t_clusters)
+    assert np.array_equal(pooled.centroids, kmeans.centroids)
+
+
+def test_kmeans_out_of_core(tmp_path):
+    t_clusters, t_labels = make_clusters(n=1000, k=4, scale=1)
+    start = t_clusters[[0, 300, 600, 900]]
+    kmeans = KMeans(k=4, init=start)
+    kmeans.fit(t_clusters)
+    #the fit matrix shouldn't be pinned on the model
+    assert not hasattr(kmeans, "fit_mat")
+    assert kmeans._data is None
+    
+    #a memory-mapped .npy file should fit exactly like the in-memory matrix
+    np.save(tmp_path / "clusters.npy", t_clusters)
+    mapped = np.load(tmp_path / "clusters.npy", mmap_mode="r")
+    memmap_fit = KMeans(k=4, init=start, working_memory=0.01)
+    memmap_fit.fit(mapped)
+    assert np.allclose(memmap_fit.centroids, kmeans.centroids)
+    assert memmap_fit.clusters == kmeans.clusters
+    
+    #so should a list of chunks, which keeps only the per-cluster sums and counts
+    chunks = [t_clusters[i:i + 128] for i in range(0, 1000, 128)]
+    chunk_fit = KMeans(k=4, init=start)
+    chunk_fit.fit(chunks)
+    assert np.allclose(chunk_fit.centroids, kmeans.centroids)
+    assert np.isclose(chunk_fit.get_error(), kmeans.get_error())
+    assert chunk_fit.n == 1000
+    assert np.array_equal(chunk_fit.predict(chunks), kmeans.predict(t_clusters))
+    
+    #seeding and mini-batches work from chunks too
+    seeded = KMeans(k=4, random_state=0)
+    seeded.fit(chunks)
+    assert len(seeded.centroids) == 4
+    minibatch = KMeans(k=4, algorithm="minibatch", batch_size=100, random_state=0)
+    minibatch.fit(chunks)
+    assert len(minibatch.centroids) == 4
+    
+    #the seeds are drawn from every chunk, so data sorted by cluster (as make_clusters writes it) is
+    #seeded from more than the first cluster
+    for seed in range(4):
+        seeded = KMeans(k=4, init="random", batch_size=8, max_iter=1, random_state=seed)
+        seeded._rng = np.random.default_rng(seed)
+        seeded._dtype = np.dtype(np.float64)
+        sample = seeded._seed_sample(chunks)
+        assert sample.shape == (8, 2)
+        assert len(np.unique(seeded._assign(sample, kmeans.centroids)[0])) > 1
+    
+    #chunked input is read several times, so a one-shot generator is rejected
+    try:
+        KMeans(k=4, init=start).fit(chunk for chunk in chunks)
+        assert False
+    except AttributeError:
+        assert True
+    #and the bounded algorithms need random access to the samples
+    try:
+        KMeans(k=4, algorithm="elkan").fit(chunks)
+        assert False
+    except AttributeError:
+        assert True
+
+
+def test_kmeans_labels():
+    t_clusters, t_labels = make_clusters(n=1000, k=4, scale=1)
+    kmeans = KMeans(k=4, random_state=0)
+    assert kmeans.clusters == [[], [], [], []]
+    kmeans.fit(t_clusters)
+    
+    #assignments are kept as one compact label array with the size of each cluster
+    assert kmeans.labels_.dtype == np.int32
+    assert kmeans.labels_.shape == (1000,)
+    assert np.array_equal(kmeans.counts_, np.bincount(kmeans.labels_, minlength=4))
+    pred_labels = kmeans.predict(t_clusters)
+    assert pred_labels.dtype == np.int32
+    assert np.array_equal(pred_labels[0], kmeans.labels_)
+    
+    #the clusters view lists the same assignments as indices
+    for label, cluster in enumerate(kmeans.clusters):
+        assert cluster == np.flatnonzero(kmeans.labels_ == label).tolist()
+    
+    #and the centroids are the means of the clusters
+    for label in range(4):
+        assert np.allclose(kmeans.get_centroids()[label], t_clusters[kmeans.labels_ == label].mean(axis=0))
+
+
+def test_kmeans_dtype():
+    t_clusters, t_labels = make_clusters(n=1000, k=4, scale=1)
+    single = t_clusters.astype(np.float32)
+    
+    #-----------------------------------------------------------
+    #an unsupported dtype raises an AttributeError
+    try:
+        KMeans(k=4, dtype=np.int32)
+        assert False
+    except AttributeError:
+        assert True
+    
+    #-----------------------------------------------------------
+    #float32 data is fit in float32 and gives the same clusters as float64
+    start = t_clusters[:4]
+    double_fit = KMeans(k=4, init=start)
+    double_fit.fit(t_clusters)
+    assert double_fit.centroids.dtype == np.float64
+    for algorithm in ["lloyd", "elkan", "hamerly"]:
+        kmeans = KMeans(k=4, init=start, algorithm=algorithm)
+        kmeans.fit(single)
+        assert kmeans.centroids.dtype == np.float32
+        assert np.array_equal(kmeans.labels_, double_fit.labels_)
+        assert np.allclose(kmeans.centroids, double_fit.centroids, atol=1e-4)
+        assert np.isclose(kmeans.get_error(), double_fit.get_error(), rtol=1e-4)
+    
+    #-----------------------------------------------------------
+    #the dtype option converts float64 data, and predictions agree
+    kmeans = KMeans(k=4, init=start, dtype=np.float32)
+    kmeans.fit(t_clusters)
+    assert kmeans.centroids.dtype == np.float32
+    assert np.array_equal(kmeans.predict(single), double_fit.predict(t_clusters))
+    assert np.array_equal(kmeans.predict(t_clusters), double_fit.predict(t_clusters))
+    
+    #-----------------------------------------------------------
+    #the cluster sums of many float32 samples far from the origin are still accumulated in float64
+    rng = np.random.default_rng(0)
+    offset = np.repeat([[1000, 1000], [-1000, -1000]], 1500000, axis=0)
+    large = (offset + rng.standard_normal((3000000, 2))).astype(np.float32)
+    means = [large[:1500000].astype(np.float64).mean(axis=0), large[1500000:].astype(np.float64).mean(axis=0)]
+    kmeans = KMeans(k=2, init=[[1000, 1000], [-1000, -1000]], max_iter=2)
+    kmeans.fit(large)
+    assert np.allclose(kmeans.get_centroids(), means, atol=1e-3)
+    assert np.allclose(kmeans.centroids, means, atol=1e-3)
+    del large, offset
+    
+    #-----------------------------------------------------------
+    #seeding, mini-batches and restarts keep float32 as well
+    for options in [dict(init="random"), dict(init="k-means||"), dict(algorithm="minibatch", batch_size=100), dict(n_init=2)]:
+        kmeans = KMeans(k=4, random_state=0, **options)
+        kmeans.fit(single)
+        assert kmeans.centroids.dtype == np.float32
+    
+    #-----------------------------------------------------------
+    #float32 assignment ranks centroids with a matrix product but returns exact distances
+    labels, distances = assign(single, single[:10])
+    dist = cdist(t_clusters, t_clusters[:10])
+    assert np.array_equal(labels, np.argmin(dist, axis=1))
+    assert np.allclose(distances, dist.min(axis=1), atol=1e-5)
+
+
+def test_kmeans_history():
+    t_clusters, t_labels = make_clusters(n=1000, k=4, scale=1)
+    
+    #every iteration is recorded and passed to the callback
+    records = []
+    kmeans = KMeans(k=4, random_state=0, callback=lambda model, record: records.append(record))
+    kmeans.fit(t_clusters)
+    assert kmeans.converged_
+    assert kmeans.n_iter_ == len(kmeans.history_) == len(records)
+    assert records == kmeans.history_
+    first, last = kmeans.history_[0], kmeans.history_[-1]
+    assert first["iteration"] == 1 and first["shift"] is None and first["n_changed"] is None
+    assert last["n_changed"] == 0 or abs(last["error"] - kmeans.history_[-2]["error"]) <= kmeans.tol
+    for record in kmeans.history_:
+        assert record["assign_time"] >= 0 and record["update_time"] >= 0 and record["error_time"] >= 0
+        assert np.isclose(record["inertia"], record["error"] * 1000)
+    #the recorded error matches the fit, and the errors never increase
+    assert np.isclose(last["error"], kmeans.get_error())
+    errors = [record["error"] for record in kmeans.history_]
+    assert all(b <= a + 1e-12 for a, b in zip(errors, errors[1:]))
+    assert np.isclose(last["inertia"], np.sum(cdist(t_clusters, kmeans.centroids).min(axis=1) ** 2))
+    
+    #stopping at max_iter doesn't count as converged
+    kmeans = KMeans(k=4, init="random", random_state=0, max_iter=1)
+    kmeans.fit(t_clusters)
+    assert not kmeans.converged_
+    assert kmeans.n_iter_ == 1
+    
+    #the bounded, minibatch and restarted fits keep a history as well
+    for options in [dict(algorithm="elkan"), dict(algorithm="minibatch", batch_size=200), dict(n_init=3)]:
+        kmeans = KMeans(k=4, random_state=0, **options)
+        kmeans.fit(t_clusters)
+        assert kmeans.n_iter_ == len(kmeans.history_) > 0
+
+
+def test_kmeans_save_load(tmp_path):
+    t_clusters, t_labels = make_clusters(n=1000, k=4, scale=1)
+    kmeans = KMeans(k=4, metric="cityblock", random_state=0, index="kdtree")
+    
+    #-----------------------------------------------------------
+    #an unfitted model can't be saved
+    try:
+        kmeans.save(tmp_path / "model.bin")
+        assert False
+    except AttributeError:
+        assert True
+    
+    #-----------------------------------------------------------
+    #a saved model predicts the same labels, with or without memory-mapping
+    kmeans.fit(t_clusters)
+    kmeans.save(tmp_path / "model.bin")
+    for mmap in [True, False]:
+        loaded = KMeans.load(tmp_path / "model.bin", mmap=mmap)
+        assert isinstance(loaded.centroids, np.memmap) == mmap
+        assert np.array_equal(loaded.centroids, kmeans.centroids)
+        assert np.array_equal(loaded.get_centroids(), kmeans.centroids)
+        assert np.array_equal(loaded.counts_, kmeans.counts_)
+        assert loaded.get_error() == kmeans.get_error()
+        assert (loaded.k, loaded.metric, loaded.index) == (4, "cityblock", "kdtree")
+        assert np.array_equal(loaded.predict(t_clusters), kmeans.predict(t_clusters))
+        assert loaded.predict_one(t_clusters[0]) == kmeans.predict_one(t_clusters[0])
+    
+    #the memory-mapped centroids are read-only and aligned in the file
+    loaded = KMeans.load(tmp_path / "model.bin")
+    assert not loaded.centroids.flags.writeable
+    assert loaded.centroids.offset % 64 == 0
+    #but the model can still be updated, which works on a copy
+    loaded.partial_fit(t_clusters[:100])
+    assert np.array_equal(KMeans.load(tmp_path / "model.bin").centroids, kmeans.centroids)
+    
+    #float32 centroids keep their dtype
+    single = KMeans(k=4, random_state=0)
+    single.fit(t_clusters.astype(np.float32))
+    single.save(tmp_path / "single.bin")
+    assert KMeans.load(tmp_path / "single.bin").centroids.dtype == np.float32
+    
+    #-----------------------------------------------------------
+    #other files are rejected
+    np.save(tmp_path / "other.npy", t_clusters)
+    try:
+        KMeans.load(tmp_path / "other.npy")
+        assert False
+    except AttributeError:
+        assert True
+
+
+def test_kmeans_empty_clusters():
+    t_clusters, t_labels = make_clusters(n=500, k=3, scale=0.3)
+    
+    #starting centroids that repeat a sample leave a cluster empty; it is moved instead of becoming NaN
+    start = np.vstack([t_clusters[:2], t_clusters[:2]])
+    kmeans = KMeans(k=4, init=start)
+    kmeans.fit(t_clusters)
+    assert not np.isnan(kmeans.centroids).any()
+    assert np.all(kmeans.counts_ > 0)
+    
+    #random seeding of many clusters never ends with NaN centroids
+    for seed in range(20):
+        kmeans = KMeans(k=10, init="random", random_state=seed)
+        kmeans.fit(t_clusters)
+        assert not np.isnan(kmeans.centroids).any()
+
+
+def test_kmeans_sparse():
+    t_clusters, t_labels = make_clusters(n=600, m=20, k=4, scale=1)
+    t_clusters[np.abs(t_clusters) < 3] = 0
+    t_sparse = sparse.csr_matrix(t_clusters)
+    start = t_clusters[:4]
+    
+    #-----------------------------------------------------------
+    #sparse input gives the same fit as the dense matrix, for every supported metric
+    for metric in ["euclidean", "sqeuclidean", "cosine"]:
+        for algorithm in ["lloyd", "minibatch"]:
+            dense_fit = KMeans(k=4, metric=metric, init=start, algorithm=algorithm, random_state=0)
+            dense_fit.fit(t_clusters)
+            sparse_fit = KMeans(k=4, metric=metric, init=start, algorithm=algorithm, random_state=0)
+            sparse_fit.fit(t_sparse)
+            assert np.array_equal(sparse_fit.labels_, dense_fit.labels_)
+            assert np.allclose(sparse_fit.centroids, dense_fit.centroids)
+            assert np.isclose(sparse_fit.get_error(), dense_fit.get_error())
+            assert np.array_equal(sparse_fit.predict(t_sparse), dense_fit.predict(t_clusters))
+            assert sparse_fit.predict_one(t_sparse[5])[0] == dense_fit.predict_one(t_clusters[5])[0]
+    
+    #the seeding methods and restarts work on sparse input too
+    for options in [dict(init="random"), dict(init="k-means++"), dict(init="k-means||"), dict(n_init=2)]:
+        kmeans = KMeans(k=4, random_state=0, **options)
+        kmeans.fit(t_sparse)
+        assert isinstance(kmeans.centroids, np.ndarray) and kmeans.centroids.shape == (4, 20)
+        #and the row norms of the fit matrix aren't kept after fitting
+        assert kmeans._data is None and kmeans._norms is None
+    
+    #-----------------------------------------------------------
+    #metrics without a sparse form and the bounded algorithms raise an AttributeError
+    for options in [dict(metric="cityblock"), dict(algorithm="elkan"), dict(algorithm="hamerly")]:
+        try:
+            KMeans(k=4, **options).fit(t_sparse)
+            assert False
+        except AttributeError:
+            assert True
+
+
+def test_kmeans_update():
+    t_clusters, t_labels = make_clusters(n=1000, m=4, k=4, scale=1.5)
+    
+    #-----------------------------------------------------------
+    #"auto" picks the update rule that suits the metric
+    rules = {"euclidean": "mean", "cityblock": "median", "cosine": "spherical", "chebyshev": "medoid"}
+    for metric, rule in rules.items():
+        kmeans = KMeans(k=4, metric=metric, random_state=0)
+        assert kmeans._update_rule() == rule
+        kmeans.fit(t_clusters)
+        assert kmeans.converged_
+    
+    #medians for cityblock: every centroid is the feature-wise median of its cluster
+    kmeans = KMeans(k=4, metric="cityblock", random_state=0)
+    kmeans.fit(t_clusters)
+    for label in range(4):
+        assert np.allclose(kmeans.centroids[label], np.median(t_clusters[kmeans.labels_ == label], axis=0))
+    
+    #normalized means for cosine, in minibatch fits too
+    for algorithm in ["lloyd", "minibatch"]:
+        kmeans = KMeans(k=4, metric="cosine", algorithm=algorithm, random_state=0)
+        kmeans.fit(t_clusters)
+        assert np.allclose(np.linalg.norm(kmeans.centroids, axis=1), 1)
+
+    #every sample counts by its direction only, however long it is
+    lengths = np.random.default_rng(0).uniform(0.1, 100, size=(1000, 1))
+    t_scaled = t_clusters * lengths
+    t_unit = t_scaled / np.linalg.norm(t_scaled, axis=1)[:, np.newaxis]
+    for data in [t_scaled, sparse.csr_matrix(t_scaled)]:
+        kmeans = KMeans(k=4, metric="cosine", tol=0, random_state=0)
+        kmeans.fit(data)
+        for label in range(4):
+            direction = t_unit[kmeans.labels_ == label].mean(axis=0)
+            assert np.allclose(kmeans.centroids[label], direction / np.linalg.norm(direction))
+
+    #-----------------------------------------------------------
+    #medoids are samples of their own cluster with the smallest summed distance to it
+    kmeans = KMeans(k=4, metric="chebyshev", random_state=0)
+    kmeans.fit(t_clusters)
+    assert np.array_equal(kmeans.centroids, t_clusters[kmeans.medoid_indices_])
+    assert np.array_equal(kmeans.labels_[kmeans.medoid_indices_], np.arange(4))
+    for label in range(4):
+        members = t_clusters[kmeans.labels_ == label]
+        assert np.isclose(cdist(members, kmeans.centroids[label:label + 1], "chebyshev").sum(),
+                          cdist(members, members, "chebyshev").sum(axis=0).min())
+    
+    #sampling fewer candidates than samples still gives medoids, and restarts keep them
+    for options in [dict(medoid_candidates=10), dict(n_init=2)]:
+        kmeans = KMeans(k=4, metric="chebyshev", random_state=0, **options)
+        kmeans.fit(t_clusters)
+        assert np.array_equal(kmeans.centroids, t_clusters[kmeans.medoid_indices_])
+    
+    #the medoids can be asked for with any metric
+    kmeans = KMeans(k=4, update="medoid", random_state=0)
+    kmeans.fit(t_clusters)
+    assert np.array_equal(kmeans.centroids, t_clusters[kmeans.medoid_indices_])
+    
+    #-----------------------------------------------------------
+    #an unknown rule is rejected as soon as the model is made
+    try:
+        KMeans(k=4, update="mode")
+        assert False
+    except AttributeError:
+        assert True
+    
+    #unknown rules, minibatch medians and medoids and chunked medoids raise an AttributeError
+    for options, data in [(dict(update="mode"), None), (dict(update="median", algorithm="minibatch"), None),
+                          (dict(update="medoid"), [t_clusters[:500], t_clusters[500:]])]:
+        try:
+            KMeans(k=4, **options).fit(data)
+            assert False
+        except AttributeError:
+            assert True
+    #while "auto" falls back to the mean over chunks, as it does for minibatch fits
+    for metric in ["cityblock", "chebyshev"]:
+        kmeans = KMeans(k=4, metric=metric, tol=0, random_state=0)
+        kmeans.fit([t_clusters[:500], t_clusters[500:]])
+        assert kmeans._update_rule() == "mean"
+        labels = kmeans.predict(t_clusters)[0]
+        for label in range(4):
+            assert np.allclose(kmeans.centroids[label], t_clusters[labels == label].mean(axis=0))
@@ -0,0 +1,75 @@
+#Importing Dependencies
+import pytest
+import numpy as np
+from main import main
+from cluster import KMeans, Silhouette
+
+
+def test_main(tmp_path, capsys):
+    data, truth = str(tmp_path / "data.npy"), str(tmp_path / "truth.npy")
+    
+    #-----------------------------------------------------------
+    #generate writes the data and labels as .npy files
+    assert main(["generate", data, "--n", "600", "--m", "3", "--k", "3", "--scale", "0.5", "--labels", truth, "--n-jobs", "2"]) == 0
+    mat = np.load(data)
+    assert mat.shape == (600, 3) and np.load(truth).shape == (600,)
+    csv = str(tmp_path / "data.csv")
+    np.savetxt(csv, mat, delimiter=",", header="a,b,c")
+    
+    #-----------------------------------------------------------
+    #fit saves a model and the labels of the fit data
+    model, labels = str(tmp_path / "model.km"), str(tmp_path / "labels.npy")
+    assert main(["fit", data, "--k", "3", "--model", model, "--labels", labels, "--random-state", "0"]) == 0
+    kmeans = KMeans.load(model)
+    assert np.array_equal(np.load(labels), kmeans.predict(mat)[0])
+    #text input in small chunks, with parallel restarts, gives a model of the same shape
+    csv_model = str(tmp_path / "csv_model.km")
+    assert main(["fit", csv, "--skip-header", "1", "--chunk-size", "100", "--k", "3", "--model", csv_model,
+                 "--n-init", "2", "--n-jobs", "2", "--random-state", "0"]) == 0
+    assert KMeans.load(csv_model).centroids.shape == (3, 3)
+    #text input also fits with metrics whose own update needs the full matrix, by falling back to the mean
+    assert main(["fit", csv, "--skip-header", "1", "--chunk-size", "100", "--k", "3", "--model", csv_model,
+                 "--metric", "cityblock", "--random-state", "0"]) == 0
+    assert KMeans.load(csv_model).metric == "cityblock"
+    #as do the bounded algorithms and the median update, which read text input into memory first
+    for options in [["--algorithm", "elkan"], ["--algorithm", "hamerly"], ["--update", "median"]]:
+        assert main(["fit", csv, "--skip-header", "1", "--chunk-size", "100", "--k", "3", "--model", csv_model,
+                     "--random-state", "0"] + options) == 0
+    #invalid options are usage errors, not tracebacks
+    with pytest.raises(SystemExit):
+        main(["fit", data, "--k", "3", "--model", csv_model, "--update", "mode"])
+    
+    #-----------------------------------------------------------
+    #predict streams labels and distances into text or .npy files, serially or on threads
+    for n_jobs in ["1", "2"]:
+        out, dist = str(tmp_path / ("labels" + n_jobs + ".csv")), str(tmp_path / ("dist" + n_jobs + ".npy"))
+        assert main(["predict", model, csv, "--skip-header", "1", "--chunk-size", "70", "--output", out,
+                     "--distances", dist, "--n-jobs", n_jobs]) == 0
+        expected, distances = kmeans.predict(mat, return_distances=True)
+        assert np.array_equal(np.loadtxt(out, dtype=int), expected[0])
+        assert np.allclose(np.load(dist), distances[0])
+    
+    #-----------------------------------------------------------
+    #score writes the per-observation scores, also for text input on several workers
+    scores = str(tmp_path / "scores.npy")
+    assert main(["score", data, labels, "--output", scores]) == 0
+    assert np.allclose(np.load(scores), Silhouette().score(mat, np.load(labels))[0])
+    assert main(["score", csv, labels, "--skip-header", "1", "--chunk-size", "100", "--n-jobs", "2"]) == 0
+    for method in ["sample", "simplified"]:
+        assert main(["score", data, labels, "--method", method, "--model", model, "--random-state", "0"]) == 0
+    
+    #-----------------------------------------------------------
+    #select-k writes a table with one row per candidate
+    table = str(tmp_path / "select.csv")
+    assert main(["select-k", csv, "--skip-header", "1", "--ks", "2", "3", "4", "--output", table, "--random-state", "0"]) == 0
+    results = np.loadtxt(table, delimiter=",", skiprows=1)
+    assert np.array_equal(results[:, 0], [2, 3, 4])
+    assert results[np.argmax(results[:, 2]), 0] == 3
+    
+    #every command reports its timings
+    assert "total" in capsys.readouterr().err
+    
+    #-----------------------------------------------------------
+    #select-k runs serially, so it has no --n-jobs option
+    with pytest.raises(SystemExit):
+        main(["select-k", data, "--n-jobs", "2"])
@@ -0,0 +1,32 @@
+#Importing dependencies
+import pytest
+import numpy as np
+from cluster import (KMeans, Silhouette, make_clusters, select_k)
+
+def test_select_k():
+    t_clusters, t_labels = make_clusters(n=600, k=4, scale=0.3)
+    result = select_k(t_clusters, ks=[6, 2, 3, 4, 5], random_state=0, working_memory=0.5)
+    
+    #the candidates come back sorted with one value per k
+    assert list(result["ks"]) == [2, 3, 4, 5, 6]
+    assert len(result["inertia"]) == 5
+    assert [c.shape for c in result["centroids"]] == [(k, 2) for k in range(2, 7)]
+    
+    #warm starts keep adding centroids, so the inertia should keep dropping
+    assert np.all(np.diff(result["inertia"]) < 0)
+    #the tight clusters should give the best silhouette at the true k
+    assert result["ks"][np.argmax(result["silhouette"])] == 4
+    
+    #the shared distance pass should agree with scoring each fit separately
+    for k, centroids, score in zip(result["ks"], result["centroids"], result["silhouette"]):
+        kmeans = KMeans(k=int(k), init=centroids, max_iter=1)
+        kmeans.fit(t_clusters)
+        pred_labels = kmeans.predict(t_clusters)
+        assert np.isclose(Silhouette().score(t_clusters, pred_labels).mean(), score)
+    
+    #k=1 has no silhouette
+    try:
+        select_k(t_clusters, ks=[1, 2])
+        assert False
+    except AttributeError:
+        assert True
@@ -1,6 +1,8 @@
 #Importing dependencies
 import pytest
 import numpy as np
+from scipy import sparse
+from scipy.spatial.distance import cdist
 from cluster import (KMeans, Silhouette, make_clusters)
 
 def test_silhouette():
@@ -15,4 +17,152 @@ def test_silhouette():
     #silhouette scores should be in between 1 and -1
     for i in range(0,scores.shape[1]):
         assert scores[0][i] <= 1
-        assert scores[0][i] >= -1
\ No newline at end of file
+        assert scores[0][i] >= -1
+
+def test_silhouette_blocks():
+    #the blockwise scores should match a direct calculation from the full distance matrix
+    t_clusters, t_labels = make_clusters(n=300, k=4, scale=1)
+    dist = cdist(t_clusters, t_clusters)
+    expected = []
+    for i in range(300):
+        same = t_labels == t_labels[i]
+        a = dist[i][same].sum() / (same.sum() - 1)
+        b = min(dist[i][t_labels == j].mean() for j in range(4) if j != t_labels[i])
+        expected.append((b - a) / max(a, b))
+    
+    scores = Silhouette().score(t_clusters, t_labels)
+    assert scores.shape == (1, 300)
+    assert np.allclose(scores[0], expected)
+    
+    #a tiny memory budget (many small tiles) should not change the scores
+    assert np.allclose(Silhouette(working_memory=0.01).score(t_clusters, t_labels), scores)
+    
+    #labels don't have to be 0..k-1, and a point alone in its cluster scores 0
+    labels = t_labels * 10 + 5
+    labels[0] = -1
+    scores = Silhouette().score(t_clusters, labels)
+    assert scores[0][0] == 0
+    
+    #a single cluster has no silhouette
+    try:
+        Silhouette().score(t_clusters, np.zeros(300, dtype=int))
+        assert False
+    except AttributeError:
+        assert True
+
+
+def test_silhouette_estimates():
+    t_clusters, t_labels = make_clusters(n=3000, k=4, scale=2)
+    test_s = Silhouette()
+    exact = test_s.score(t_clusters, t_labels).mean()
+    
+    #the sampled estimates should land near the exact mean, and are reproducible from random_state
+    for reference in ["full", "sample"]:
+        mean, (low, high) = test_s.sample_score(t_clusters, t_labels, sample_size=500, reference=reference, random_state=0)
+        assert low < mean < high
+        assert abs(mean - exact) < 0.05
+        assert test_s.sample_score(t_clusters, t_labels, sample_size=500, reference=reference, random_state=0)[0] == mean
+    #with full-data references, sampling every point gives the exact mean with no uncertainty
+    mean, (low, high) = test_s.sample_score(t_clusters, t_labels, sample_size=3000)
+    assert np.isclose(mean, exact)
+    assert np.isclose(low, high)
+    
+    #the simplified score uses the fitted centroids, or the cluster means when none are given
+    kmeans = KMeans(k=4, random_state=0)
+    kmeans.fit(t_clusters)
+    pred_labels = kmeans.predict(t_clusters)
+    mean, (low, high) = test_s.simplified_score(t_clusters, pred_labels, kmeans.centroids)
+    assert low < mean < high
+    assert -1 <= mean <= 1
+    #the fitted centroids are the cluster means of the fit, so both should agree
+    assert np.isclose(test_s.simplified_score(t_clusters, pred_labels)[0], mean)
+    #and each simplified score needs only the distances to the centroids
+    evals = test_s.n_distance_evals_
+    test_s.simplified_score(t_clusters, pred_labels)
+    assert test_s.n_distance_evals_ - evals == 3000 * 4
+
+
+def test_silhouette_parallel():
+    #scoring blocks of rows on a pool of threads or processes should give exactly the serial scores
+    t_clusters, t_labels = make_clusters(n=1000, k=4, scale=1)
+    serial = Silhouette().score(t_clusters, t_labels)
+    for backend in ["threads", "processes"]:
+        scorer = Silhouette(n_jobs=3, backend=backend)
+        parallel = scorer.score(t_clusters, t_labels)
+        assert np.array_equal(parallel, serial)
+        #every distance is counted, whichever worker computed it
+        assert scorer.n_distance_evals_ == 1000 * 1000
+    
+    #the sampled estimate scores against a separate reference set, which is shared as well
+    serial = Silhouette().sample_score(t_clusters, t_labels, sample_size=200, reference="sample", random_state=0)
+    parallel = Silhouette(n_jobs=2, backend="processes").sample_score(
+        t_clusters, t_labels, sample_size=200, reference="sample", random_state=0)
+    assert parallel == serial
+
+
+def test_silhouette_out_of_core(tmp_path):
+    t_clusters, t_labels = make_clusters(n=600, k=3, scale=1)
+    scores = Silhouette().score(t_clusters, t_labels)
+    
+    #memory-mapped and chunked inputs should give the same scores as the in-memory matrix
+    np.save(tmp_path / "clusters.npy", t_clusters)
+    mapped = np.load(tmp_path / "clusters.npy", mmap_mode="r")
+    chunks = [t_clusters[i:i + 100] for i in range(0, 600, 100)]
+    assert np.allclose(Silhouette(working_memory=0.01).score(mapped, t_labels), scores)
+    assert np.allclose(Silhouette().score(chunks, t_labels), scores)
+    #worker processes reopen the memory-mapped file rather than copying it
+    assert np.array_equal(Silhouette(n_jobs=2, backend="processes").score(mapped, t_labels), Silhouette().score(mapped, t_labels))
+    
+    #the estimates work from chunks as well
+    assert np.isclose(Silhouette().sample_score(chunks, t_labels, sample_size=600)[0], scores.mean())
+    assert np.isclose(Silhouette().simplified_score(chunks, t_labels)[0], Silhouette().simplified_score(t_clusters, t_labels)[0])
+
+
+def test_silhouette_dtype():
+    t_clusters, t_labels = make_clusters(n=600, k=3, scale=1)
+    scores = Silhouette().score(t_clusters, t_labels)
+    
+    #float32 data (or the float32 dtype option) gives scores close to float64
+    single = t_clusters.astype(np.float32)
+    assert np.allclose(Silhouette().score(single, t_labels), scores, atol=1e-4)
+    assert np.allclose(Silhouette(dtype=np.float32, working_memory=0.01).score(t_clusters, t_labels), scores, atol=1e-4)
+    assert np.isclose(Silhouette().simplified_score(single, t_labels)[0], Silhouette().simplified_score(t_clusters, t_labels)[0])
+    
+    #the cluster means of many float32 samples far from the origin are still accumulated in float64
+    #(cityblock distances go through cdist, so only the means can differ)
+    rng = np.random.default_rng(0)
+    large = np.repeat([[1000, 1000], [1004, 1000]], 1500000, axis=0) + rng.standard_normal((3000000, 2))
+    large_labels = np.repeat([0, 1], 1500000)
+    assert np.isclose(Silhouette(metric="cityblock").simplified_score(large.astype(np.float32), large_labels)[0],
+                      Silhouette(metric="cityblock").simplified_score(large, large_labels)[0], atol=1e-4)
+    del large
+    
+    #an unsupported dtype raises an AttributeError
+    try:
+        Silhouette(dtype=np.int64)
+        assert False
+    except AttributeError:
+        assert True
+
+
+def test_silhouette_sparse():
+    t_clusters, t_labels = make_clusters(n=600, m=20, k=4, scale=1)
+    t_clusters[np.abs(t_clusters) < 3] = 0
+    t_sparse = sparse.csr_matrix(t_clusters)
+    
+    #sparse input is scored tile by tile and matches the dense scores
+    for metric in ["euclidean", "sqeuclidean", "cosine"]:
+        scores = Silhouette(metric=metric).score(t_clusters, t_labels)
+        assert np.allclose(Silhouette(metric=metric, working_memory=0.05).score(t_sparse, t_labels), scores)
+        assert np.allclose(Silhouette(metric=metric, n_jobs=2).score(t_sparse, t_labels), scores)
+        assert np.isclose(Silhouette(metric=metric).simplified_score(t_sparse, t_labels)[0],
+                          Silhouette(metric=metric).simplified_score(t_clusters, t_labels)[0])
+        assert np.isclose(Silhouette(metric=metric).sample_score(t_sparse, t_labels, sample_size=100, random_state=0)[0],
+                          Silhouette(metric=metric).sample_score(t_clusters, t_labels, sample_size=100, random_state=0)[0])
+    
+    #sparse matrices can't be shared with worker processes
+    try:
+        Silhouette(n_jobs=2, backend="processes").score(t_sparse, t_labels)
+        assert False
+    except AttributeError:
+        assert True
@@ -0,0 +1,56 @@
+#Importing Dependencies
+import pytest
+import numpy as np
+from cluster import (make_clusters, iter_clusters, write_clusters)
+
+def test_make_clusters():
+    #the generator doesn't touch the global random state, and still gives the same data as before
+    state = np.random.get_state()[1].copy()
+    t_clusters, t_labels = make_clusters(n=200, k=3, seed=7)
+    assert np.array_equal(np.random.get_state()[1], state)
+    np.random.seed(7)
+    labels = np.sort(np.random.randint(0, 3, size=200))
+    centers = np.random.uniform(-10, 10, size=(3, 2))
+    assert np.array_equal(t_labels, labels)
+    assert np.allclose(t_clusters[t_labels == 0].mean(axis=0), centers[0], atol=0.5)
+
+
+def test_iter_clusters(tmp_path):
+    chunks = list(iter_clusters(n=10000, m=3, k=4, scale=0.5, seed=3, chunk_size=1500))
+    mat = np.concatenate([chunk for chunk, _ in chunks])
+    labels = np.concatenate([chunk_labels for _, chunk_labels in chunks])
+    
+    #-----------------------------------------------------------
+    #the chunks have the requested sizes and the rows are sorted by label, as in make_clusters
+    assert [len(chunk) for chunk, _ in chunks] == [1500] * 6 + [1000]
+    assert mat.shape == (10000, 3) and labels.dtype == np.int32
+    assert np.all(np.diff(labels) >= 0)
+    #every cluster gets roughly n / k samples, spread with the requested scale inside the bounds
+    counts = np.bincount(labels, minlength=4)
+    assert np.all(np.abs(counts - 2500) < 200)
+    for label in range(4):
+        members = mat[labels == label]
+        assert np.all(np.abs(members.std(axis=0) - 0.5) < 0.05)
+        assert np.all(np.abs(members.mean(axis=0)) < 10)
+    
+    #the same seed gives the same data, and a different seed different data
+    again = np.concatenate([chunk for chunk, _ in iter_clusters(n=10000, m=3, k=4, scale=0.5, seed=3, chunk_size=1500)])
+    assert np.array_equal(again, mat)
+    other = np.concatenate([chunk for chunk, _ in iter_clusters(n=10000, m=3, k=4, scale=0.5, seed=4, chunk_size=1500)])
+    assert not np.array_equal(other, mat)
+    
+    #-----------------------------------------------------------
+    #writing to a file gives the same data, whether the chunks are written by one or several processes
+    for n_jobs in [None, 2]:
+        path, labels_path = tmp_path / "mat.npy", tmp_path / "labels.npy"
+        written, written_labels = write_clusters(str(path), n=10000, m=3, k=4, scale=0.5, seed=3,
+                                                 chunk_size=1500, labels_path=str(labels_path), n_jobs=n_jobs)
+        assert isinstance(written, np.memmap)
+        assert np.array_equal(written, mat)
+        assert np.array_equal(written_labels, labels)
+        assert np.array_equal(np.load(path), mat)
+    
+    #and in float32 without labels
+    written, written_labels = write_clusters(str(tmp_path / "single.npy"), n=1000, chunk_size=300, dtype=np.float32)
+    assert written.dtype == np.float32 and written.shape == (1000, 2)
+    assert written_labels is None